@@ -31,182 +31,376 @@
 MAX_WARNINGS_SHOWN = 100 # Maximum number of warnings to show per export
 EXPORT_WINDOW_NUMSLOTS = 100 # Number of slots in the export windows
 REPLACE_FIRST_UNDERSCORE = True # Whether to replace the first underscore in joint names with a dot (example: j_shoulder_le -> j.shoulder_le). This is in order to keep parity with MESA's SMD importer.
+MAX_VERTEX_INFLUENCES = 0 # Maximum number of joints influencing a single vertex, the smallest weights are dropped and the rest renormalized. 0 for no limit (studiomdl only uses 3)
+MIN_VERTEX_WEIGHT = 0.000001 # Weights smaller than this are dropped
+FLOAT_PRECISION = 6 # Number of decimals written for each number in exported files
+TRIM_TRAILING_ZEROS = False # Whether to remove trailing zeros from written numbers (example: 1.500000 -> 1.5). This makes exported files smaller.
+SPARSE_ANIM_FRAMES = False # Whether animation frames after the first only list the joints that moved since they were last written. This makes animation files smaller and faster to compile
+SPARSE_POSITION_EPSILON = 0.00001 # Minimum position change (in inches) for a joint to be written again in sparse animation frames
+SPARSE_ROTATION_EPSILON = 0.00001 # Minimum rotation change (in radians) for a joint to be written again in sparse animation frames
+SKIP_UNCHANGED_SLOTS = True # Whether multi export skips slots whose joints, meshes, skin weights, animation curves and settings haven't changed since the slot was last exported, as long as the exported file is still there. Model slots are always exported by the first multi export of a Maya session
+SAMPLE_CACHE_SIZE = 512 # Maximum size in MB of the on-disk cache of sampled joint transforms, which lets animations be re-exported without sampling the scene again. The least recently used samples are removed first. 0 to disable the cache
+SAMPLE_CACHE_FOLDER = "" # Folder of the sample cache, empty to use Maya's temp folder
+ANIM_SHARDS = 0 # Number of headless mayapy processes sampling long animations in parallel, each opening the saved scene and sampling its own part of the frame range. 0 to always sample inside Maya
+ANIM_SHARD_MIN_FRAMES = 1000 # Animations shorter than this many frames are always sampled inside Maya, since starting the shard processes takes a while
+ANIM_CHUNK_FRAMES = 0 # Animations longer than this many frames are sampled in chunks of this size into a scratch file in Maya's temp folder instead of memory. An interrupted export then resumes from the last finished chunk. 0 to always sample in memory
+WELD_PRECISION = 6 # Number of decimals compared when welding triangle corners into shared vertices. Corners whose position, skin weights, normal, UV and color match up to this many decimals become one vertex in DMX files
+MAX_MESH_JOINTS = 0 # When a model has more joints than this, its triangles are split into several SMD files that each use at most this many joints, counting the parents of the joints they're weighted to. Each part only holds those joints. The first part keeps the slot's file name, the others get "_part2", "_part3"... 0 to never split
+OPTIMIZE_TRIANGLE_ORDER = False # Whether the triangles of each mesh are grouped by material and reordered so neighbouring triangles reuse the same vertices, which makes better use of the GPU's post-transform vertex cache. The average cache miss ratio (ACMR) before and after is printed after each model export
+VERTEX_CACHE_SIZE = 24 # Number of vertices in the FIFO vertex cache that triangles are reordered and ACMR is measured for
+LOD_RATIOS = [] # Triangle ratios of the LOD models written next to each exported model, for example [0.5, 0.25] also writes "_lod1" and "_lod2" files with about half and a quarter of the triangles. Vertices on UV seams, hard edges, material borders and open borders are kept, and vertices are only merged with neighbours mostly weighted to the same joint. Empty to not write LODs
+PRUNE_UNUSED_JOINTS = False # Whether selected joints that are never used are left out of exported files. Models only keep the joints weighted to their vertices, animations the joints that move during the animation or influence any skin cluster in the scene. The parents of kept joints are always kept, and so is the first root joint. Joints only used as attachments or by other tools can be pruned, so make sure to check the exported hierarchy
+REPORT_VERTEX_DUPLICATION = False # Whether model exports print how many times each welded vertex is repeated in the triangle list, and how many triangles are degenerate after welding
+DMX_CONSTANT_EPSILON = 0.00001 # Channels of DMX animations that move less than this over the whole animation are written as a single key
+EXPORT_WORKERS = 0 # Number of background processes formatting and writing files during multi export, while Maya extracts the next slot. 0 to write every file on Maya's main thread, -1 for one process per CPU core
 
 # ------------------------------------------------------------------------------------------------------------------------------------------------------------------
 # ---------------------------------------------------------------------------- Global ------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------------------------------------------------------------------------------------------
 import os
-import maya.cmds as cmds
-import maya.mel as mel
 import math
 import sys
 import datetime
 import os.path
 import traceback
-import maya.OpenMaya as OpenMaya
-import maya.OpenMayaAnim as OpenMayaAnim
 import urllib2
 import socket
 import subprocess
 import webbrowser
-import Queue
-import _winreg as reg
 import time
 import struct
 import shutil
 import zipfile
 import re
+import array
+import itertools
+import hashlib
+import multiprocessing
+import mmap
+import json
+import collections
+import heapq
+import tempfile
+
+# Outside of Maya (and Windows) only the parts of the script that don't touch the scene or the UI can be used, such as the
+# rotation math, mesh processing, serializers and sample caches
+try:
+    import maya.cmds as cmds
+    import maya.mel as mel
+    import maya.OpenMaya as OpenMaya
+    import maya.OpenMayaAnim as OpenMayaAnim
+except ImportError:
+    cmds = mel = OpenMaya = OpenMayaAnim = None
+try:
+    import _winreg as reg
+except ImportError:
+    reg = None
+
 from subprocess import Popen, PIPE, STDOUT
 
+# "Reload Script" runs this file again in the same module, so the callbacks registered by the previous run are removed
+# before the lists holding their IDs are replaced
+if OpenMaya != None:
+    for callbackID in globals().get("GraphLookupCallbacks", []) + globals().get("MeshChangeCallbacks", []):
+        try:
+            OpenMaya.MMessage.removeCallback(callbackID)
+        except RuntimeError as e: # Already removed along with its node
+            pass
+
 WarningsDuringExport = 0 # Number of warnings shown during current export
+MeshExtractionStats = [] # Statistics of each mesh extracted during the current export, printed as one summary by ExportSMDModel, see IterShapes
+SMDTemplates = None # Format strings used by the SMD serializer, see GetSMDTemplates
+SMD_BLOCK_TRIANGLES = 4096 # Most triangles formatted into one string before it's written, see WriteSMDTriangles
+GraphLookupCache = {} # (lookup name, node hash code) -> (MObjectHandle, result) of dependency graph lookups, see GetCachedGraphLookup
+GraphLookupCallbacks = [] # IDs of the callbacks clearing GraphLookupCache
+SkeletonIndexCache = None # Selection (full path names) -> joint table while an export is running, see GetSelectedJointTable
+AnimCurvesHashCache = None # Joint paths -> GetAnimCurvesHash while an export is running
+ExportPool = None # Worker processes used during multi export, see EXPORT_WORKERS
+PendingExports = [] # (file path, async result) of every file handed to ExportPool
+PendingScratchFiles = [] # Sample scratch files still read by ExportPool, removed once every file is written
+PendingFingerprints = [] # (window ID, slot index, file path, fingerprint) of every slot handed to ExportPool, saved once its file is written
+OUTPUT_SETTINGS = ["FLOAT_PRECISION", "TRIM_TRAILING_ZEROS", "MAX_VERTEX_INFLUENCES", "MIN_VERTEX_WEIGHT", "REPLACE_FIRST_UNDERSCORE", "SPARSE_ANIM_FRAMES", "SPARSE_POSITION_EPSILON", "SPARSE_ROTATION_EPSILON", "DMX_CONSTANT_EPSILON", "WELD_PRECISION", "MAX_MESH_JOINTS", "OPTIMIZE_TRIANGLE_ORDER", "VERTEX_CACHE_SIZE", "LOD_RATIOS", "PRUNE_UNUSED_JOINTS", "SMD_BLOCK_TRIANGLES"] # Settings that change the exported files, fingerprinted and sent to every ExportPool process
+MeshChangeTicks = {} # Mesh node hash code -> [MObjectHandle, tick of its last change], see GetMeshChangeTick
+MeshChangeCallbacks = [] # IDs of the callbacks updating MeshChangeTicks
+LastMeshChangeTick = 0 # Last tick handed out to MeshChangeTicks
+FINGERPRINT_SESSION = "%i %f" % (os.getpid(), time.time()) # Identifies this Maya session in fingerprints, as mesh change ticks restart with every session
+IS_EXPORT_WORKER = os.environ.get("SOURCEMAYATOOLS_EXPORT_WORKER") == "1" # Whether this script was imported by one of the ExportPool processes
+SAMPLE_CACHE_HEADER = struct.Struct("4sIII") # Magic, version, joint count, frame count
+SAMPLE_CACHE_VALUES = 22 # Values stored per joint sample: position, scale and rotation matrix
+SAMPLE_CACHE_CHECK_FRAMES = 8 # Cached frames sampled again to check that the sample cache still matches the scene, see SampleJointsCached
+TRAILING_ZEROS_REGEX = re.compile(r"(?<![^\s])(-?\d+)\.(\d*?)0+(?=\s)") # Only whole numeric tokens, so names ending in digits (like material "mat1.50") are kept
+EXPORT_FORMATS = ["SMD", "DMX"] # File formats selectable per slot, in the order of the format drop down
+DMX_ELEMENT, DMX_INT, DMX_FLOAT, DMX_BOOL, DMX_STRING, DMX_TIME, DMX_VECTOR2, DMX_VECTOR3, DMX_QUATERNION = 1, 2, 3, 4, 5, 7, 9, 10, 13 # Datamodel attribute type IDs
+DMX_ARRAY = 14 # Added to an attribute type ID for arrays of that type
+DMX_VALUE_FORMATS = {DMX_INT: ("i", 1), DMX_FLOAT: ("f", 1), DMX_BOOL: ("b", 1), DMX_TIME: ("i", 1), DMX_VECTOR2: ("f", 2), DMX_VECTOR3: ("f", 3), DMX_QUATERNION: ("f", 4)} # Struct format and number of components of each plain value type
 CM_TO_INCH = 0.3937007874015748031496062992126 # 1cm = 50/127in
 PI_CONST = 3.141592
 
-GLOBAL_STORAGE_REG_KEY = (reg.HKEY_CURRENT_USER, "Software\\SourceMayaTools") # Registry path for global data storage
-#               name     :      control code name,              control friendly name,  data storage node name, refresh function,       export function
-OBJECT_NAMES =  {'menu'  :      ["SourceMayaToolsMenu",            "Source Engine Tools",   None,                   None,                   None],
-                 'progress' :   ["SourceMayaToolsProgressbar",     "Progress",             None,                   None,                   None],
-                 'smdmodel':      ["SMDModelExportWindow",   "Export SMD Model",        "SMDModelExporterInfo",   "RefreshSMDModelWindow",  "ExportSMDModel"],
-                 'smdanim' :      ["SMDAnimExportWindow",    "Export SMD Anim",         "SMDAnimExporterInfo",    "RefreshSMDAnimWindow",   "ExportSMDAnim"],
+GLOBAL_STORAGE_REG_KEY = (getattr(reg, "HKEY_CURRENT_USER", None), "Software\\SourceMayaTools") # Registry path for global data storage
+#               name     :      control code name,              control friendly name,  data storage node name, refresh function,       export function,    fingerprint function
+OBJECT_NAMES =  {'menu'  :      ["SourceMayaToolsMenu",            "Source Engine Tools",   None,                   None,                   None,               None],
+                 'progress' :   ["SourceMayaToolsProgressbar",     "Progress",             None,                   None,                   None,               None],
+                 'smdmodel':      ["SMDModelExportWindow",   "Export SMD Model",        "SMDModelExporterInfo",   "RefreshSMDModelWindow",  "ExportSMDModel",   "GetSMDModelFingerprint"],
+                 'smdanim' :      ["SMDAnimExportWindow",    "Export SMD Anim",         "SMDAnimExporterInfo",    "RefreshSMDAnimWindow",   "ExportSMDAnim",    "GetSMDAnimFingerprint"],
                  }
 
 # UTILITY FUNCTIONS FOR EXPORT
 
-# Thanks to SETools
-def __math_matrixtoquat__(maya_matrix):
-    """Converts a Maya matrix array to a quaternion"""
-    quat_x, quat_y, quat_z, quat_w = (0, 0, 0, 1)
-
-    trans_remain = maya_matrix[0] + maya_matrix[5] + maya_matrix[10]
-    if trans_remain > 0:
-        divisor = math.sqrt(trans_remain + 1.0) * 2.0
-        quat_w = 0.25 * divisor
-        quat_x = (maya_matrix[6] - maya_matrix[9]) / divisor
-        quat_y = (maya_matrix[8] - maya_matrix[2]) / divisor
-        quat_z = (maya_matrix[1] - maya_matrix[4]) / divisor
-    elif (maya_matrix[0] > maya_matrix[5]) and (maya_matrix[0] > maya_matrix[10]):
-        divisor = math.sqrt(
-            1.0 + maya_matrix[0] - maya_matrix[5] - maya_matrix[10]) * 2.0
-        quat_w = (maya_matrix[6] - maya_matrix[9]) / divisor
-        quat_x = 0.25 * divisor
-        quat_y = (maya_matrix[4] + maya_matrix[1]) / divisor
-        quat_z = (maya_matrix[8] + maya_matrix[2]) / divisor
-    elif maya_matrix[5] > maya_matrix[10]:
-        divisor = math.sqrt(
-            1.0 + maya_matrix[5] - maya_matrix[0] - maya_matrix[10]) * 2.0
-        quat_w = (maya_matrix[8] - maya_matrix[2]) / divisor
-        quat_x = (maya_matrix[4] + maya_matrix[1]) / divisor
-        quat_y = 0.25 * divisor
-        quat_z = (maya_matrix[9] + maya_matrix[6]) / divisor
-    else:
-        divisor = math.sqrt(
-            1.0 + maya_matrix[10] - maya_matrix[0] - maya_matrix[5]) * 2.0
-        quat_w = (maya_matrix[1] - maya_matrix[4]) / divisor
-        quat_x = (maya_matrix[8] + maya_matrix[2]) / divisor
-        quat_y = (maya_matrix[9] + maya_matrix[6]) / divisor
-        quat_z = 0.25 * divisor
+# ROTATION MATH
+# These work on whole lists of rotations at once, using plain (x, y, z, w) tuples instead of MQuaternions, and don't need Maya
 
-    # Return the result
-    return OpenMaya.MQuaternion(quat_x, quat_y, quat_z, quat_w)
+# Thanks to SETools
+def BatchMatricesToQuats(matrices):
+    """Converts a list of Maya matrix arrays to a list of (x, y, z, w) quaternions"""
+    quats = []
+    sqrt = math.sqrt
+    for maya_matrix in matrices:
+        m0, m1, m2 = maya_matrix[0], maya_matrix[1], maya_matrix[2]
+        m4, m5, m6 = maya_matrix[4], maya_matrix[5], maya_matrix[6]
+        m8, m9, m10 = maya_matrix[8], maya_matrix[9], maya_matrix[10]
+
+        trans_remain = m0 + m5 + m10
+        if trans_remain > 0:
+            divisor = sqrt(trans_remain + 1.0) * 2.0
+            quats.append(((m6 - m9) / divisor, (m8 - m2) / divisor, (m1 - m4) / divisor, 0.25 * divisor))
+        elif (m0 > m5) and (m0 > m10):
+            divisor = sqrt(1.0 + m0 - m5 - m10) * 2.0
+            quats.append((0.25 * divisor, (m4 + m1) / divisor, (m8 + m2) / divisor, (m6 - m9) / divisor))
+        elif m5 > m10:
+            divisor = sqrt(1.0 + m5 - m0 - m10) * 2.0
+            quats.append(((m4 + m1) / divisor, 0.25 * divisor, (m9 + m6) / divisor, (m8 - m2) / divisor))
+        else:
+            divisor = sqrt(1.0 + m10 - m0 - m5) * 2.0
+            quats.append(((m8 + m2) / divisor, (m9 + m6) / divisor, 0.25 * divisor, (m1 - m4) / divisor))
+
+    return quats
+
+def BatchQuatsToEulers(quats):
+    """Converts a list of quaternions to a list of XYZ Euler rotations in radians, the same as MQuaternion.asEulerRotation"""
+    eulers = []
+    atan2 = math.atan2
+    sqrt = math.sqrt
+    for x, y, z, w in quats:
+        # Rows of the (normalized) rotation matrix, only the elements needed for an XYZ decomposition
+        dotp = x*x + y*y + z*z + w*w
+        s = 2.0 / dotp if dotp > 0 else 0.0
+        m00 = 1.0 - s * (y*y + z*z)
+        m01 = s * (x*y + w*z)
+        m02 = s * (x*z - w*y)
+        m12 = s * (y*z + w*x)
+        m22 = 1.0 - s * (x*x + y*y)
+
+        cosY = sqrt(m00*m00 + m01*m01)
+        if cosY > 1.0e-10:
+            eulers.append((atan2(m12, m22), atan2(-m02, cosY), atan2(m01, m00)))
+        else:
+            # Gimbal lock, Z is folded into X
+            m10 = s * (x*y - w*z)
+            m11 = 1.0 - s * (x*x + z*z)
+            eulers.append((atan2(-m02 * m10, m11), atan2(-m02, cosY), 0.0))
+
+    return eulers
+
+def BatchQuatInverse(quats):
+    """Inverts a list of quaternions"""
+    inverted = []
+    for x, y, z, w in quats:
+        dotp = x*x + y*y + z*z + w*w
+        if dotp > 0:
+            inv = 1.0 / dotp
+            inverted.append((-x * inv, -y * inv, -z * inv, w * inv))
+        else:
+            inverted.append((-x, -y, -z, w))
+    return inverted
+
+def BatchQuatAlign(ps, qs):
+    """Flips each quaternion in qs that's on the opposite hemisphere of the matching quaternion in ps"""
+    aligned = []
+    for p, q in zip(ps, qs):
+        a = 0
+        b = 0
+        for i in range(0, 4):
+            a += (p[i]-q[i])*(p[i]-q[i])
+            b += (p[i]+q[i])*(p[i]+q[i])
+
+        if(a > b):
+            aligned.append((-q[0], -q[1], -q[2], -q[3]))
+        else:
+            aligned.append(q)
+    return aligned
+
+def BatchQuatMultiply(ps, qs):
+    """Multiplies each quaternion in ps by the matching quaternion in qs, after aligning them"""
+    result = []
+    for p, q2 in zip(ps, BatchQuatAlign(ps, qs)):
+        px, py, pz, pw = p
+        qx, qy, qz, qw = q2
+        result.append((
+             px * qw + py * qz - pz * qy + pw * qx,
+            -px * qz + py * qw + pz * qx + pw * qy,
+             px * qy - py * qx + pz * qw + pw * qz,
+            -px * qx - py * qy - pz * qz + pw * qw
+        ))
+    return result
 
 def GetJointList():
-    joints = []
-    
-    # Get selected objects
+    # Returns (parent index, MFnDagNode) of every selected joint, top selected joints first and then breadth first
+    # The parent of a joint is its closest selected joint ancestor, even through unselected nodes, -1 if there's none
+    # Instead of walking the whole hierarchy under every top joint, each selected joint's ancestors are walked once
+    # (shared ancestors only once in total) and the joints are sorted into breadth first order by (top joint, depth,
+    # child index of every ancestor)
     selectedObjects = OpenMaya.MSelectionList()
     OpenMaya.MGlobal.getActiveSelectionList(selectedObjects)
     
+    selectedJoints = {} # Full path name -> MDagPath
+    selectionOrder = []
     for i in range(selectedObjects.length()):
-        # Get object path and node
         dagPath = OpenMaya.MDagPath()
         selectedObjects.getDagPath(i, dagPath)
-        dagNode = OpenMaya.MFnDagNode(dagPath)
-        
-        # Ignore nodes that aren't joints or arn't top-level
-        if not dagPath.hasFn(OpenMaya.MFn.kJoint) or not RecursiveCheckIsTopNode(selectedObjects, dagNode):
+        if not dagPath.hasFn(OpenMaya.MFn.kJoint):
             continue
+        name = dagPath.fullPathName()
+        if not name in selectedJoints:
+            selectedJoints[name] = dagPath
+            selectionOrder.append(name)
+    
+    # (child indices from the world down to the node, closest selected joint at or above the node, topmost selected
+    # joint at or above the node) of every node walked through, by full path name
+    ancestry = {"": ((), None, None)}
+    childIndices = {} # Full path name of a node -> {full path name of each child: child index}
+    for name in selectionOrder:
+        # Walk up to the first node already known
+        chain = []
+        path = OpenMaya.MDagPath(selectedJoints[name])
+        pathName = name
+        while not pathName in ancestry:
+            chain.append(pathName)
+            path.pop()
+            parentName = path.length() > 0 and path.fullPathName() or ""
+            if not parentName in childIndices:
+                parentNode = OpenMaya.MFnDagNode(path.node())
+                indices = {}
+                for i in range(parentNode.childCount()):
+                    childPath = OpenMaya.MDagPath(path)
+                    childPath.push(parentNode.child(i))
+                    indices[childPath.fullPathName()] = i
+                childIndices[parentName] = indices
+            pathName = parentName
         
-        # Breadth first search of joint tree
-        searchQueue = Queue.Queue(0)
-        searchQueue.put((-1, dagNode, True)) # (index = child node's parent index, child node)
-        while not searchQueue.empty():
-            node = searchQueue.get()
-            index = len(joints)
-            
-            if node[2]:
-                joints.append((node[0], node[1]))
-            else:
-                index = node[0]
-            
-            for i in range(node[1].childCount()):
-                dagPath = OpenMaya.MDagPath()
-                childNode = OpenMaya.MFnDagNode(node[1].child(i))
-                childNode.getPath(dagPath)
-                searchQueue.put((index, childNode, selectedObjects.hasItem(dagPath) and dagPath.hasFn(OpenMaya.MFn.kJoint)))
+        # Then fill in the nodes on the way back down
+        route, closest, top = ancestry[pathName]
+        for nodeName in reversed(chain):
+            route = route + (childIndices[pathName].get(nodeName, 0),)
+            if nodeName in selectedJoints:
+                closest = nodeName
+                if top == None:
+                    top = nodeName
+            ancestry[nodeName] = (route, closest, top)
+            pathName = nodeName
+    
+    topOrder = dict([(name, i) for i, name in enumerate(selectionOrder)])
+    sortedJoints = sorted(selectionOrder, key=lambda name: (topOrder[ancestry[name][2]], len(ancestry[name][0]), ancestry[name][0]))
+    jointIndices = dict([(name, i) for i, name in enumerate(sortedJoints)])
+    
+    joints = []
+    for name in sortedJoints:
+        # The closest selected joint above this one is the closest one at or above its parent
+        parentName = name[:name.rindex("|")]
+        parent = -1
+        if parentName in ancestry and ancestry[parentName][1] != None:
+            parent = jointIndices[ancestry[parentName][1]]
+        joints.append((parent, OpenMaya.MFnDagNode(selectedJoints[name])))
     
     return joints
 
-def RecursiveCheckIsTopNode(cSelectionList, currentNode): # Checks if the given node has ANY selected parent, grandparent, etc joints
-    if currentNode.parentCount() == 0:
-        return True
-    
-    for i in range(currentNode.parentCount()):
-        parentDagPath = OpenMaya.MDagPath()
-        parentNode = OpenMaya.MFnDagNode(currentNode.parent(i))
-        parentNode.getPath(parentDagPath)
-    
-        if not parentDagPath.hasFn(OpenMaya.MFn.kJoint): # Not a joint, but still check parents
-            if not RecursiveCheckIsTopNode(cSelectionList, parentNode):
-                return False # A parent joint is selected, we're done
-            else:
-                continue # No parent joints are selected, ignore this node
-        
-        if cSelectionList.hasItem(parentDagPath):
-            return False
-        else:
-            if not RecursiveCheckIsTopNode(cSelectionList, parentNode):
-                return False
-                
+def GetSelectedJointTable():
+    # Returns the joint table (see GetJointTable) of the selected joints
+    # While SkeletonIndexCache is on, the table is only built once per selection, so the slots and fingerprints of an
+    # export sharing a selection share the same table
+    if SkeletonIndexCache == None:
+        return GetJointTable(GetJointList())
+    selection = tuple(cmds.ls(selection=True, long=True) or [])
+    if not selection in SkeletonIndexCache:
+        SkeletonIndexCache[selection] = GetJointTable(GetJointList())
+    return SkeletonIndexCache[selection]
+
+def StartSkeletonIndexCache():
+    # Turns on SkeletonIndexCache and AnimCurvesHashCache if they aren't already on
+    # Returns True if they were turned on (the caller should then call FinishSkeletonIndexCache)
+    # Neither the hierarchy nor the animation curves are edited during an export, so the caches never have to be invalidated while they're on
+    global SkeletonIndexCache, AnimCurvesHashCache
+    if SkeletonIndexCache != None:
+        return False
+    SkeletonIndexCache = {}
+    AnimCurvesHashCache = {}
     return True
 
-
-def GetMaterialsFromMesh(mesh, dagPath):
-    textures = {}
-    
+def FinishSkeletonIndexCache():
+    global SkeletonIndexCache, AnimCurvesHashCache
+    SkeletonIndexCache = None
+    AnimCurvesHashCache = None
+
+
+def GetCachedGraphLookup(lookupName, node, lookup):
+    # Returns lookup(node), only computed once per node until the scene changes, so meshes and slots sharing shading groups
+    # and skin clusters only walk the dependency graph for them once
+    # Lookups return nodes rather than names or values read from them, so only new and broken connections, removed
+    # nodes and new scenes can make them stale (see InstallGraphLookupCallbacks)
+    InstallGraphLookupCallbacks()
+    key = (lookupName, OpenMaya.MObjectHandle(node).hashCode())
+    cached = GraphLookupCache.get(key)
+    if cached == None or not cached[0].isValid() or not cached[0].object() == node: # Hash codes aren't unique
+        cached = (OpenMaya.MObjectHandle(node), lookup(node))
+        GraphLookupCache[key] = cached
+    return cached[1]
+
+def ClearGraphLookupCache(*args):
+    GraphLookupCache.clear()
+
+def InstallGraphLookupCallbacks():
+    # Registers the callbacks clearing GraphLookupCache, once per Maya session
+    if len(GraphLookupCallbacks) > 0 or IS_EXPORT_WORKER:
+        return
+    for message in (OpenMaya.MSceneMessage.kAfterNew, OpenMaya.MSceneMessage.kAfterOpen, OpenMaya.MSceneMessage.kAfterImport,
+                    OpenMaya.MSceneMessage.kAfterLoadReference, OpenMaya.MSceneMessage.kAfterUnloadReference, OpenMaya.MSceneMessage.kAfterRemoveReference):
+        GraphLookupCallbacks.append(OpenMaya.MSceneMessage.addCallback(message, ClearGraphLookupCache))
+    GraphLookupCallbacks.append(OpenMaya.MDGMessage.addConnectionCallback(ClearGraphLookupCache))
+    GraphLookupCallbacks.append(OpenMaya.MDGMessage.addNodeRemovedCallback(ClearGraphLookupCache, "dependNode"))
+
+def FindShaderMaterials(shaderObject):
+    # Returns (material node, file texture node or None) of every material connected to a shading group
     # http://rabidsquirrelgames.googlecode.com/svn/trunk/Maya%20plugin/fileExportCmd.py
-    # The code below gets a dictionary of [material name: material file name], ex: [a_material: a_material.dds]
-    shaders = OpenMaya.MObjectArray()
-    shaderIndices = OpenMaya.MIntArray()
-    mesh.getConnectedShaders(dagPath.instanceNumber(), shaders, shaderIndices)
+    materials = []
+    shaderNode = OpenMaya.MFnDependencyNode(shaderObject)
+    shaderPlug = shaderNode.findPlug("surfaceShader")
+    material = OpenMaya.MPlugArray()
+    shaderPlug.connectedTo(material, 1, 0)
+    
+    for j in range(material.length()):
+        materialNode = OpenMaya.MFnDependencyNode(material[j].node())
+        colorPlug = materialNode.findPlug("color")
+        
+        dgIt = OpenMaya.MItDependencyGraph(
+            colorPlug,
+            OpenMaya.MFn.kFileTexture,
+            OpenMaya.MItDependencyGraph.kUpstream,
+            OpenMaya.MItDependencyGraph.kBreadthFirst,
+            OpenMaya.MItDependencyGraph.kNodeLevel)
+        
+        textureNode = None
+        try: # If there is no texture, this part can throw an exception
+            dgIt.disablePruningOnFilter()
+            textureNode = dgIt.currentItem()
+        except Exception:
+            pass
+        
+        materials.append((material[j].node(), textureNode))
     
-    for i in range(shaders.length()):
-            shaderNode = OpenMaya.MFnDependencyNode(shaders[i])
-            shaderPlug = shaderNode.findPlug("surfaceShader")
-            material = OpenMaya.MPlugArray()
-            shaderPlug.connectedTo(material, 1, 0)
-            
-            for j in range(material.length()):
-                    materialNode = OpenMaya.MFnDependencyNode(material[j].node())
-                    colorPlug = materialNode.findPlug("color")
-                    
-                    dgIt = OpenMaya.MItDependencyGraph(
-                        colorPlug,
-                        OpenMaya.MFn.kFileTexture,
-                        OpenMaya.MItDependencyGraph.kUpstream,
-                        OpenMaya.MItDependencyGraph.kBreadthFirst,
-                        OpenMaya.MItDependencyGraph.kNodeLevel)
-                    
-                    texturePath = ""
-                    
-                    try: # If there is no texture, this part can throw an exception
-                        dgIt.disablePruningOnFilter()
-                        textureNode = OpenMaya.MFnDependencyNode(dgIt.currentItem())
-                        texturePlug = textureNode.findPlug("fileTextureName")
-                        texturePath = os.path.basename(texturePlug.asString())
-                    except Exception:
-                        pass
-                    
-                    textures[i] = (materialNode.name(), texturePath)
+    return materials
+
+def GetMaterialsFromMesh(mesh, dagPath):
+    # Returns the (material name, texture file name) of each face of a mesh instance, None for faces without a material
+    textures, shaderIndices = GetMeshShaderMaterials(mesh, dagPath)
     
     texturesToFaces = []
     for i in range(shaderIndices.length()):
@@ -217,202 +411,1019 @@ def GetMaterialsFromMesh(mesh, dagPath):
     
     return texturesToFaces
 
+def GetMeshShaderMaterials(mesh, dagPath):
+    # Returns ({shading group index: (material name, texture file name)}, shading group index of each face) of a mesh instance
+    textures = {}
     
-def WriteJointData(f, jointC):
-    jointNode = jointC[1]
-    # Get the joint's transform
-    path = OpenMaya.MDagPath() 
-    jointNode.getPath(path)
-    transform = OpenMaya.MFnTransform(path)
-    
-    # Get joint position
-    pos = transform.getTranslation(OpenMaya.MSpace.kTransform)
+    # The code below gets a dictionary of [material name: material file name], ex: [a_material: a_material.dds]
+    # Names and file names are read from the cached nodes every time, so renaming them doesn't need the cache cleared
+    shaders = OpenMaya.MObjectArray()
+    shaderIndices = OpenMaya.MIntArray()
+    mesh.getConnectedShaders(dagPath.instanceNumber(), shaders, shaderIndices)
     
-    # Get scale (almost always 1)
-    scaleUtil = OpenMaya.MScriptUtil()
-    scaleUtil.createFromList([1,1,1], 3)
-    scalePtr = scaleUtil.asDoublePtr()
-    transform.getScale(scalePtr)
-    scale = [OpenMaya.MScriptUtil.getDoubleArrayItem(scalePtr, 0), OpenMaya.MScriptUtil.getDoubleArrayItem(scalePtr, 1), OpenMaya.MScriptUtil.getDoubleArrayItem(scalePtr, 2)]
+    for i in range(shaders.length()):
+        for materialObject, textureObject in GetCachedGraphLookup("materials", shaders[i], FindShaderMaterials):
+            texturePath = ""
+            if textureObject is not None:
+                try:
+                    textureNode = OpenMaya.MFnDependencyNode(textureObject)
+                    texturePath = os.path.basename(textureNode.findPlug("fileTextureName").asString())
+                except Exception:
+                    pass
+            
+            textures[i] = (OpenMaya.MFnDependencyNode(materialObject).name(), texturePath)
     
-    # Get rotation matrix (mat is a 4x4, but the last row and column arn't needed)
-    jointRotQuat = __math_matrixtoquat__(cmds.getAttr(path.fullPathName()+".matrix"))
-
-    eulerRotation = jointRotQuat.asEulerRotation()
-
-    joint_offset = (pos.x*CM_TO_INCH, pos.y*CM_TO_INCH, pos.z*CM_TO_INCH)
-
-    joint_rotation = (eulerRotation.x,eulerRotation.y,eulerRotation.z)
-
-    joint_scale = (scale[0], scale[1], scale[2])
+    return (textures, shaderIndices)
 
-    f.write("%f %f %f  %f %f %f\n" % (joint_offset[0] * scale[0], joint_offset[1] * scale[1], joint_offset[2] * scale[2], joint_rotation[0], joint_rotation[1], joint_rotation[2]))
-
-def GetJointData(jointC):
-    jointNode = jointC[1]
-    # Get the joint's transform
-    path = OpenMaya.MDagPath() 
-    jointNode.getPath(path)
-    transform = OpenMaya.MFnTransform(path)
-    
-    # Get joint position
-    pos = transform.getTranslation(OpenMaya.MSpace.kTransform)
     
-    # Get scale (almost always 1)
-    scaleUtil = OpenMaya.MScriptUtil()
-    scaleUtil.createFromList([1,1,1], 3)
-    scalePtr = scaleUtil.asDoublePtr()
-    transform.getScale(scalePtr)
-    scale = [OpenMaya.MScriptUtil.getDoubleArrayItem(scalePtr, 0), OpenMaya.MScriptUtil.getDoubleArrayItem(scalePtr, 1), OpenMaya.MScriptUtil.getDoubleArrayItem(scalePtr, 2)]
+def GetJointTable(joints):
+    # Resolves everything needed to sample and name each joint once per export, instead of once per joint per frame
+    # Takes the list from GetJointList and returns a list of dictionaries in the same order
+    jointTable = []
+    for joint in joints:
+        path = OpenMaya.MDagPath()
+        joint[1].getPath(path)
+        depNode = OpenMaya.MFnDependencyNode(path.node())
+        
+        # Reusable scale buffer for MFnTransform.getScale
+        scaleUtil = OpenMaya.MScriptUtil()
+        scaleUtil.createFromList([1,1,1], 3)
+        
+        jointTable.append({
+            "parent": joint[0], # Parent's index in the table, -1 if none
+            "node": joint[1], # MFnDagNode
+            "path": path,
+            "partialName": joint[1].partialPathName(),
+            "name": GetJointExportName(joint[1].partialPathName()),
+            "transform": OpenMaya.MFnTransform(path),
+            "scaleUtil": scaleUtil, # Keeps scalePtr's memory alive
+            "scalePtr": scaleUtil.asDoublePtr(),
+            "plugs": [depNode.findPlug(attribute) for attribute in ("translateX", "translateY", "translateZ", "scaleX", "scaleY", "scaleZ", "matrix")]
+        })
+    
+    return jointTable
+
+def GetJointExportName(partialPathName):
+    name = partialPathName.split("|")
+    name = name[len(name)-1].split(":") # Remove namespace prefixes
+    if REPLACE_FIRST_UNDERSCORE == True:
+        return name[len(name)-1].replace('_', '.', 1)
+    else:
+        return name[len(name)-1]
+
+def GetSkinnedJointPaths():
+    # Returns the full paths of every joint influencing a skin cluster in the scene
+    paths = set()
+    iterator = OpenMaya.MItDependencyNodes(OpenMaya.MFn.kSkinCluster)
+    while not iterator.isDone():
+        paths.update([influence.fullPathName() for influence in GetSkinInfluences(OpenMayaAnim.MFnSkinCluster(iterator.thisNode()))])
+        iterator.next()
+    return paths
+
+def GetPrunedJoints(nodes, usedJoints):
+    # Returns the indices of the joints kept when pruning (see PRUNE_UNUSED_JOINTS and MAX_MESH_JOINTS), in their original order
+    # nodes are (name, parent index) pairs in GetJointList's order, so parents always come before their children
+    # A joint is kept if it's in usedJoints, if it's the first joint, or if any of its children is kept
+    kept = [False] * len(nodes)
+    for j in range(len(nodes)-1, -1, -1):
+        if kept[j] or j in usedJoints or j == 0:
+            kept[j] = True
+            if nodes[j][1] >= 0:
+                kept[nodes[j][1]] = True
+    return [j for j in range(len(nodes)) if kept[j]]
+
+def PruneJointNodes(nodes, keptJoints):
+    # Returns the nodes of the kept joints (see GetPrunedJoints), with their parent indices remapped
+    remap = dict([(j, i) for i, j in enumerate(keptJoints)])
+    return [(nodes[j][0], remap.get(nodes[j][1], -1)) for j in keptJoints]
+
+def PruneModelJoints(model):
+    # Removes the joints no triangle vertex is weighted to from an extracted model (see ExportSMDModel), remapping every weight
+    # Only the vertices used by the triangles count, since the buffers of a split model's parts share their vertex arrays
+    # Vertices without weights are bound to the first joint, which is always kept
+    # Returns the number of joints removed
+    usedJoints = set()
+    for buffer in model["buffers"]:
+        weightOffsets = buffer["weightOffsets"]
+        weightJoints = buffer["weightJoints"]
+        for vert in set(buffer["triVerts"]):
+            usedJoints.update(weightJoints[weightOffsets[vert]:weightOffsets[vert+1]])
+    keptJoints = GetPrunedJoints(model["nodes"], usedJoints)
+    if len(keptJoints) == len(model["nodes"]):
+        return 0
+    
+    # The remap keeps the joints in the same order, so welded vertices stay the same and the cached weld is kept
+    numRemoved = len(model["nodes"]) - len(keptJoints)
+    remap = dict([(j, i) for i, j in enumerate(keptJoints)])
+    model["nodes"] = PruneJointNodes(model["nodes"], keptJoints)
+    model["skeleton"] = [model["skeleton"][j] for j in keptJoints]
+    # Vertices no triangle uses may be weighted to removed joints, they're moved to the first joint
+    model["buffers"] = [dict(buffer, weightJoints=array.array('i', [remap.get(j, 0) for j in buffer["weightJoints"]])) for buffer in model["buffers"]]
+    return numRemoved
+
+def GetAnimatedJoints(anim, referenceSamples):
+    # Returns the indices of the joints of an animation payload whose samples differ from referenceSamples (one sample per joint)
+    # on any frame, by more than SPARSE_POSITION_EPSILON or SPARSE_ROTATION_EPSILON
+    animatedJoints = set()
+    positionEpsilon = SPARSE_POSITION_EPSILON / CM_TO_INCH
+    for start, samples in IterAnimSampleChunks(anim):
+        for frameSamples in samples:
+            for j, (pos, scale, matrix) in enumerate(frameSamples):
+                if j in animatedJoints:
+                    continue
+                referencePos, referenceScale, referenceMatrix = referenceSamples[j]
+                for i in range(3):
+                    if abs(pos[i] - referencePos[i]) > positionEpsilon or abs(scale[i] - referenceScale[i]) > SPARSE_ROTATION_EPSILON:
+                        animatedJoints.add(j)
+                        break
+                else:
+                    for i in (0, 1, 2, 4, 5, 6, 8, 9, 10):
+                        if abs(matrix[i] - referenceMatrix[i]) > SPARSE_ROTATION_EPSILON:
+                            animatedJoints.add(j)
+                            break
+    return animatedJoints
+
+def PruneAnimJoints(anim, usedJoints):
+    # Removes the joints that aren't in usedJoints (and aren't kept for the hierarchy, see GetPrunedJoints) from an animation payload
+    keptJoints = GetPrunedJoints(anim["nodes"], usedJoints)
+    if len(keptJoints) == len(anim["nodes"]):
+        return
+    print "Pruned %i unused joints, %i are left" % (len(anim["nodes"]) - len(keptJoints), len(keptJoints))
     
-    # Get rotation matrix (mat is a 4x4, but the last row and column arn't needed)
-    jointRotQuat = __math_matrixtoquat__(cmds.getAttr(path.fullPathName()+".matrix"))
-
-    joint_offset = (pos.x*CM_TO_INCH * scale[0], pos.y*CM_TO_INCH * scale[1], pos.z*CM_TO_INCH * scale[2])
-
-    return ( joint_offset, jointRotQuat )
-
-def WriteJointDataSubstracted(f, jointC, jointData):
-    jointNode = jointC[1]
-    # Get the joint's transform
-    path = OpenMaya.MDagPath() 
-    jointNode.getPath(path)
-    transform = OpenMaya.MFnTransform(path)
+    anim["nodes"] = PruneJointNodes(anim["nodes"], keptJoints)
+    if anim["scratch"] != None:
+        anim["scratch"] = dict(anim["scratch"], joints=[anim["scratch"]["joints"][j] for j in keptJoints])
+    else:
+        anim["samples"] = [[frameSamples[j] for j in keptJoints] for frameSamples in anim["samples"]]
+    if anim["substract"] != None:
+        anim["substract"] = [anim["substract"][j] for j in keptJoints]
 
+def GetJointSample(joint):
+    # Samples a joint table entry at the current time
+    # A joint sample is (position, scale, rotation matrix), the same layout as the samples returned by SampleJoints
+    transform = joint["transform"]
+    
     # Get joint position
     pos = transform.getTranslation(OpenMaya.MSpace.kTransform)
     
     # Get scale (almost always 1)
-    scaleUtil = OpenMaya.MScriptUtil()
-    scaleUtil.createFromList([1,1,1], 3)
-    scalePtr = scaleUtil.asDoublePtr()
+    scalePtr = joint["scalePtr"]
     transform.getScale(scalePtr)
     scale = [OpenMaya.MScriptUtil.getDoubleArrayItem(scalePtr, 0), OpenMaya.MScriptUtil.getDoubleArrayItem(scalePtr, 1), OpenMaya.MScriptUtil.getDoubleArrayItem(scalePtr, 2)]
     
     # Get rotation matrix (mat is a 4x4, but the last row and column arn't needed)
-    jointRotQuat = __math_matrixtoquat__(cmds.getAttr(path.fullPathName()+".matrix"))
-
-    jointInvQuat = __quat_inverse(jointData[1])
-
-    jointSubQuat = __quat_multiply(jointInvQuat, jointRotQuat)
-
-    eulerRotation = jointSubQuat.asEulerRotation()
-
-    joint_offset = (pos.x*CM_TO_INCH * scale[0], pos.y*CM_TO_INCH * scale[1], pos.z*CM_TO_INCH * scale[2])
-
-    joint_rotation = (eulerRotation.x,eulerRotation.y,eulerRotation.z)
-
-    joint_scale = (scale[0], scale[1], scale[2])
-
-    f.write("%f %f %f  %f %f %f\n" % (joint_offset[0]-jointData[0][0], joint_offset[1]-jointData[0][1], joint_offset[2]-jointData[0][2], joint_rotation[0], joint_rotation[1], joint_rotation[2]))
-
-def __toMayaQuat(x,y,z,w):
-    return OpenMaya.MQuaternion(x, y, z, w)
+    matrix = OpenMaya.MFnMatrixData(joint["plugs"][6].asMObject()).matrix()
+    return ((pos.x, pos.y, pos.z), scale, [matrix(r, c) for r in range(4) for c in range(4)])
+
+def SampleJoints(jointTable, frames):
+    # Samples the local transforms of all joints in the table at each of the given frames, without changing the current time
+    # Every frame is evaluated through a DG context, so the scene isn't re-evaluated or redrawn as a whole
+    # Returns a list with one list of joint samples (see GetJointSample) per frame
+    samples = []
+    for frame in frames:
+        context = OpenMaya.MDGContext(OpenMaya.MTime(frame, OpenMaya.MTime.uiUnit()))
+        frameSamples = []
+        for joint in jointTable:
+            jointPlugs = joint["plugs"]
+            matrix = OpenMaya.MFnMatrixData(jointPlugs[6].asMObject(context)).matrix()
+            frameSamples.append((
+                (jointPlugs[0].asDouble(context), jointPlugs[1].asDouble(context), jointPlugs[2].asDouble(context)), # Position
+                [jointPlugs[3].asDouble(context), jointPlugs[4].asDouble(context), jointPlugs[5].asDouble(context)], # Scale
+                [matrix(r, c) for r in range(4) for c in range(4)] # Rotation matrix
+            ))
+        samples.append(frameSamples)
+        
+    return samples
 
-def __QuatToArray(q):
-    return [q.x, q.y, q.z, q.w]
+def GetSampleQuats(samples, jointsToSubstract=None):
+    # Converts all rotation matrices of a sample block to quaternions in one batch, as a single flat list
+    # If jointsToSubstract is given (a list of GetJointSampleData results), each rotation is made relative to it
+    quats = BatchMatricesToQuats([sample[2] for frameSamples in samples for sample in frameSamples])
+    if jointsToSubstract != None:
+        jointInvQuats = BatchQuatInverse([jointData[1] for jointData in jointsToSubstract])
+        quats = BatchQuatMultiply(jointInvQuats * len(samples), quats)
+    return quats
 
-def __quat_conjugate(quat):
-    result = OpenMaya.MQuaternion()
-    result.x = -quat.x
-    result.y = -quat.y
-    result.z = -quat.z
-    result.w = quat.w
-    return result
+def GetSampleRotations(samples, jointsToSubstract=None):
+    # Converts all rotation matrices of a sample block to Euler rotations in one batch, one list per frame
+    if len(samples) == 0:
+        return []
+    numJoints = len(samples[0])
+    eulers = BatchQuatsToEulers(GetSampleQuats(samples, jointsToSubstract))
+    return [eulers[i*numJoints:(i+1)*numJoints] for i in range(len(samples))]
 
-def __quat_dotproduct(quat1, quat2):
-    return quat1.x * quat2.x + quat1.y * quat2.y + quat1.z * quat2.z + quat1.w * quat2.w
-
-def __quat_inverse(quat):
-    dotp = __quat_dotproduct(quat, quat)
-    conjugated = __quat_conjugate(quat)
-    if(dotp > 0):
-        inv = 1.0 / dotp
-        conjugated.x *= inv
-        conjugated.y *= inv
-        conjugated.z *= inv
-        conjugated.w *= inv
-
-    return conjugated
-
-def __quat_align(p, q):
-    a = 0
-    b = 0
-    result = OpenMaya.MQuaternion()
-    for i in range(0, 4):
-        a += (p[i]-q[i])*(p[i]-q[i])
-        b += (p[i]+q[i])*(p[i]+q[i])
-    
-    if(a > b):
-        result.x = -q.x
-        result.y = -q.y
-        result.z = -q.z
-        result.w = -q.w
-    else:
-        result.x = q.x
-        result.y = q.y
-        result.z = q.z
-        result.w = q.w
+def GetJointSampleRow(sample, joint_rotation):
+    # Returns the 6 values written for a joint sample in an SMD skeleton block
+    pos, scale, matrix = sample
     
-    return result
-
+    joint_offset = (pos[0]*CM_TO_INCH, pos[1]*CM_TO_INCH, pos[2]*CM_TO_INCH)
 
+    return (joint_offset[0] * scale[0], joint_offset[1] * scale[1], joint_offset[2] * scale[2], joint_rotation[0], joint_rotation[1], joint_rotation[2])
 
-def __quat_multiply(p, q):
-    q2 = __quat_align(p, q)
+def GetJointSampleRowSubstracted(sample, jointData, joint_rotation):
+    # Same as GetJointSampleRow, but the position is made relative to jointData (joint_rotation should already be relative)
+    pos, scale, matrix = sample
+    
+    joint_offset = (pos[0]*CM_TO_INCH * scale[0], pos[1]*CM_TO_INCH * scale[1], pos[2]*CM_TO_INCH * scale[2])
 
-    result = OpenMaya.MQuaternion()
+    return (joint_offset[0]-jointData[0][0], joint_offset[1]-jointData[0][1], joint_offset[2]-jointData[0][2], joint_rotation[0], joint_rotation[1], joint_rotation[2])
 
-    result.x =  p.x * q2.w + p.y * q2.z - p.z * q2.y + p.w * q2.x
-    result.y = -p.x * q2.z + p.y * q2.w + p.z * q2.x + p.w * q2.y
-    result.z =  p.x * q2.y - p.y * q2.x + p.z * q2.w + p.w * q2.z
-    result.w = -p.x * q2.x - p.y * q2.y - p.z * q2.z + p.w * q2.w
+def GetJointSampleData(sample):
+    pos, scale, matrix = sample
+    
+    jointRotQuat = BatchMatricesToQuats([matrix])[0]
 
-    return result
+    joint_offset = (pos[0]*CM_TO_INCH * scale[0], pos[1]*CM_TO_INCH * scale[1], pos[2]*CM_TO_INCH * scale[2])
 
+    return ( joint_offset, jointRotQuat )
 
 
-# Converts a set of vertices (toConvertVertexIndices) from object-relative IDs to face-relative IDs
-# vertexIndices is a list of object-relative vertex indices in face order (from polyIter.getVertices)
-# toConvertVertexIndices is any set of vertices from the same faces as vertexIndices, not necessarily the same length
-# Returns false if a vertex index is unable to be converted (= bad vertex values)
-def VerticesObjRelToLocalRel(vertexIndices, toConvertVertexIndices):
-    # http://svn.gna.org/svn/cal3d/trunk/cal3d/plugins/cal3d_maya_exporter/MayaMesh.cpp
-    localVertexIndices = OpenMaya.MIntArray()
-    
-    for i in range(toConvertVertexIndices.length()):
-        found = False
-        for j in range(vertexIndices.length()):
-            if toConvertVertexIndices[i] == vertexIndices[j]:
-                localVertexIndices.append(j)
-                found = True
+def GetMeshBulkData(dagPath, mesh, skin=None, space=None):
+    # Reads everything needed from a mesh with whole-mesh calls, instead of walking it with vertex and polygon iterators
+    # Points and normals are in the given space, world space by default
+    # Returns a dictionary of flat Python lists and arrays:
+    #   points            - XYZ of each vertex, 3 values per vertex (array)
+    #   polyVertCounts    - number of vertices in each polygon
+    #   polyVerts         - object-relative vertex indices of every polygon, in face-vertex order
+    #   triCounts         - number of triangles in each polygon
+    #   triVerts          - object-relative vertex indices of every triangle, 3 values per triangle
+    #   normals/normalIds - normals (array, 3 values per normal), and the normal index of each face-vertex
+    #   Us/Vs             - UV values of the current UV set
+    #   uvCounts/uvIds    - number of UVs assigned to each polygon (0 if unmapped), and the UV index of each mapped face-vertex
+    #   colors            - RGBA of each face-vertex (array, 4 values per face-vertex)
+    #   influences        - partial path names of the skin's influence objects
+    #   weights           - skin weights, numInfluences values per vertex (array)
+    data = {}
+    if space == None:
+        space = OpenMaya.MSpace.kWorld
+    
+    points = OpenMaya.MPointArray()
+    mesh.getPoints(points, space)
+    data["points"] = array.array('d')
+    for i in range(points.length()):
+        point = points[i]
+        data["points"].extend((point.x, point.y, point.z))
+    
+    polyVertCounts = OpenMaya.MIntArray()
+    polyVerts = OpenMaya.MIntArray()
+    mesh.getVertices(polyVertCounts, polyVerts)
+    data["polyVertCounts"] = list(polyVertCounts)
+    data["polyVerts"] = list(polyVerts)
+    
+    triCounts = OpenMaya.MIntArray()
+    triVerts = OpenMaya.MIntArray()
+    mesh.getTriangles(triCounts, triVerts)
+    data["triCounts"] = list(triCounts)
+    data["triVerts"] = list(triVerts)
+    
+    normals = OpenMaya.MFloatVectorArray()
+    normalCounts = OpenMaya.MIntArray()
+    normalIds = OpenMaya.MIntArray()
+    mesh.getNormals(normals, space)
+    mesh.getNormalIds(normalCounts, normalIds)
+    data["normals"] = array.array('d')
+    for i in range(normals.length()):
+        normal = normals[i]
+        data["normals"].extend((normal.x, normal.y, normal.z))
+    data["normalIds"] = list(normalIds)
+    
+    Us = OpenMaya.MFloatArray()
+    Vs = OpenMaya.MFloatArray()
+    uvCounts = OpenMaya.MIntArray()
+    uvIds = OpenMaya.MIntArray()
+    mesh.getUVs(Us, Vs)
+    mesh.getAssignedUVs(uvCounts, uvIds)
+    data["Us"] = list(Us)
+    data["Vs"] = list(Vs)
+    data["uvCounts"] = list(uvCounts)
+    data["uvIds"] = list(uvIds)
+    
+    colors = OpenMaya.MColorArray()
+    mesh.getFaceVertexColors(colors)
+    data["colors"] = array.array('f')
+    for i in range(colors.length()):
+        color = colors[i]
+        data["colors"].extend((color.r, color.g, color.b, color.a))
+    
+    data["influences"] = []
+    data["weights"] = []
+    data["numInfluences"] = 0
+    if skin != None:
+        data["influences"] = [influence.partialPathName() for influence in GetSkinInfluences(skin)]
+        
+        # Weights of every influence for every vertex, in one call
+        vertComponent = OpenMaya.MFnSingleIndexedComponent()
+        vertComponentObject = vertComponent.create(OpenMaya.MFn.kMeshVertComponent)
+        vertComponent.setCompleteData(mesh.numVertices())
+        weights = OpenMaya.MDoubleArray()
+        numInfluences = OpenMaya.MScriptUtil() # Need this because getWeights crashes without being passed a count
+        numInfluencesPtr = numInfluences.asUintPtr()
+        skin.getWeights(dagPath, vertComponentObject, weights, numInfluencesPtr)
+        data["weights"] = array.array('d', weights)
+        data["numInfluences"] = OpenMaya.MScriptUtil.getUint(numInfluencesPtr)
+    
+    return data
+
+
+def GetSkinWeightsCSR(weights, numVerts, numInfluences, influences, influenceToJoint, meshName):
+    # Converts the dense weight list from MFnSkinCluster.getWeights (numInfluences values per vertex) to CSR arrays (see NewMeshBuffer)
+    # influences are the influence names, influenceToJoint maps each influence to its exported joint index, or None if the joint isn't exported
+    # The dense list is processed one influence column at a time with slicing, map and compress, so the per-weight work
+    # happens in C and only the non-zero weights are touched in Python
+    vertRange = range(numVerts)
+    keepWeight = MIN_VERTEX_WEIGHT.__le__
+    
+    # Gather the weights of every vertex, in influence order
+    vertWeights = [[] for v in vertRange]
+    for k in range(min(numInfluences, len(influenceToJoint))):
+        column = weights[k::numInfluences]
+        if len(column) == 0 or max(column) < MIN_VERTEX_WEIGHT:
+            continue
+        
+        jointIndex = influenceToJoint[k]
+        influencedVerts = itertools.compress(vertRange, itertools.imap(keepWeight, column))
+        if jointIndex == None:
+            for v in influencedVerts:
+                PrintWarning("Unexported joint %s is influencing vertex '%s.vtx[%d]' by %f%%" % (("'%s'" % influences[k]).ljust(15), meshName, v, column[v]*100))
+            continue
+        
+        for v in influencedVerts:
+            vertWeights[v].append((jointIndex, column[v]))
+    
+    # Cap, renormalize and pack
+    offsets = array.array('i', [0])
+    joints = array.array('i')
+    values = array.array('d')
+    for finalWeights in vertWeights:
+        if MAX_VERTEX_INFLUENCES > 0 and len(finalWeights) > MAX_VERTEX_INFLUENCES:
+            # Keep the largest weights, in their original order
+            largest = sorted(range(len(finalWeights)), key=lambda i: -finalWeights[i][1])[:MAX_VERTEX_INFLUENCES]
+            largest.sort()
+            finalWeights = [finalWeights[i] for i in largest]
+        
+        # Make sure the total weight adds up to 1
+        if len(finalWeights) > 0:
+            weightMultiplier = 1 / sum([weight[1] for weight in finalWeights])
+            joints.extend([weight[0] for weight in finalWeights])
+            values.extend([weight[1] * weightMultiplier for weight in finalWeights])
+        offsets.append(len(joints))
+    
+    return (offsets, joints, values)
+
+def NewMeshBuffer():
+    # Creates an empty mesh buffer, the structure-of-arrays mesh representation yielded by IterShapes
+    # Vertex data:
+    #   positions    - world-space XYZ, 3 values per vertex
+    # Skin weights, as a CSR (compressed sparse row) matrix of vertices x exported joints:
+    #   weightOffsets - the weights of vertex v are at [weightOffsets[v], weightOffsets[v+1]) in the two arrays below, numVerts+1 values
+    #   weightJoints  - exported joint index of each weight
+    #   weightValues  - value of each weight, the weights of each vertex add up to 1
+    # Triangle data (per-vertex per-face values are stored for each of the triangle's 3 corners):
+    #   triShapes    - index of the mesh in shapes["meshes"], 1 value per triangle
+    #   triMaterials - index of the material in shapes["materials"], 1 value per triangle
+    #   triVerts     - vertex indices, 3 values per triangle
+    #   uvs          - UV, 6 values per triangle
+    #   colors       - RGBA, 12 values per triangle
+    #   normals      - world-space XYZ, 9 values per triangle
+    # Once computed, GetMeshBufferWeld caches the welded vertices of the buffer in "weld"
+    return {
+        "positions": array.array('d'),
+        "weightOffsets": array.array('i', [0]),
+        "weightJoints": array.array('i'),
+        "weightValues": array.array('d'),
+        "triShapes": array.array('i'),
+        "triMaterials": array.array('i'),
+        "triVerts": array.array('i'),
+        "uvs": array.array('d'),
+        "colors": array.array('f'),
+        "normals": array.array('d')
+    }
+
+def GetMeshBufferCounts(buffer):
+    # Returns (vertex count, triangle count)
+    return (len(buffer["positions"]) / 3, len(buffer["triMaterials"]))
+
+def GetMeshContentHash(data, meshMaterials):
+    # Hashes everything a mesh buffer is built from (object space geometry, UVs, normals, colors and materials), so identical copies of a mesh can share one buffer
+    md5 = hashlib.md5()
+    md5.update(repr(meshMaterials))
+    for key in ("points", "normals", "colors"):
+        md5.update(data[key].tostring())
+    for key in ("polyVertCounts", "polyVerts", "triCounts", "triVerts", "normalIds", "uvCounts", "uvIds"):
+        md5.update(array.array('i', data[key]).tostring())
+    for key in ("Us", "Vs"):
+        md5.update(array.array('f', data[key]).tostring())
+    return md5.digest()
+
+def FillMeshBufferTriangles(buffer, data, meshMaterials, materials, materialDict, meshName):
+    # Builds the triangle arrays of a mesh buffer from GetMeshBulkData results
+    # New materials are added to materials/materialDict
+    # Returns an error string on failure
+    # Note: UVs, normals, and colors, are "per-vertex per face", because even though two faces may share
+    # a vertex, they might have different UVs, colors, or normals. So, each face has to contain this info
+    # for each of it's vertices instead of each vertex alone
+    polyVertCounts = data["polyVertCounts"]
+    polyVerts = data["polyVerts"]
+    triCounts = data["triCounts"]
+    triVerts = data["triVerts"]
+    normals = data["normals"]
+    normalIds = data["normalIds"]
+    Us = data["Us"]
+    Vs = data["Vs"]
+    uvCounts = data["uvCounts"]
+    uvIds = data["uvIds"]
+    colors = data["colors"]
+    bufferTriVerts = buffer["triVerts"]
+    bufferUVs = buffer["uvs"]
+    bufferColors = buffer["colors"]
+    bufferNormals = buffer["normals"]
+    bufferMaterials = buffer["triMaterials"]
+    faceVertOffset = 0
+    triVertOffset = 0
+    uvOffset = 0
+    for p in range(len(polyVertCounts)):
+        numPolyVerts = polyVertCounts[p]
+        numPolyTris = triCounts[p]
+        polyHasUVs = uvCounts[p] > 0
+        
+        # Get this poly's material
+        polyMaterial = meshMaterials[p]
+        
+        # Every face must have a material
+        if polyMaterial == None:
+            PrintWarning("Found no material on face '%s.f[%d]'; ignoring face" % (meshName, p))
+        else:
+            # Add this poly's material to the global list of used materials
+            if not polyMaterial[0] in materialDict:
+                materialDict[polyMaterial[0]] = len(materials)
+                materials.append(polyMaterial)
+            materialIndex = materialDict[polyMaterial[0]]
+            
+            # Object-relative vertex indices of this poly, used to find each triangle vertex's face-relative index
+            polyVertexIndices = polyVerts[faceVertOffset:faceVertOffset+numPolyVerts]
+            
+            # Add each triangle in this poly to the mesh's triangle arrays
+            for t in range(numPolyTris):
+                triangleIndices = triVerts[triVertOffset+t*3:triVertOffset+t*3+3]
+                for vert in triangleIndices:
+                    try:
+                        local = polyVertexIndices.index(vert)
+                    except ValueError:
+                        return "Failed to convert object-relative vertices to face-relative on poly '%s.f[%d]'" % (meshName, p)
+                    
+                    faceVert = faceVertOffset + local
+                    bufferTriVerts.append(vert)
+                    if polyHasUVs:
+                        uv = uvIds[uvOffset + local]
+                        bufferUVs.extend((Us[uv], Vs[uv]))
+                    else:
+                        bufferUVs.extend((0.0, 0.0))
+                    bufferColors.extend(colors[faceVert*4:faceVert*4+4])
+                    normal = normalIds[faceVert]*3
+                    bufferNormals.extend(normals[normal:normal+3])
+                bufferMaterials.append(materialIndex)
+        
+        faceVertOffset += numPolyVerts
+        triVertOffset += numPolyTris * 3
+        if polyHasUVs:
+            uvOffset += uvCounts[p]
+    
+    return None
+
+def TransformMeshBuffer(buffer, dagPath):
+    # Returns a copy of an object space mesh buffer moved to the world space of the given instance
+    # Only positions and normals are copied, every other array is shared with the original buffer
+    matrix = dagPath.inclusiveMatrix()
+    m = [matrix(r, c) for r in range(4) for c in range(4)]
+    inverse = dagPath.inclusiveMatrixInverse()
+    n = [inverse(r, c) for r in range(3) for c in range(3)]
+    
+    positions = buffer["positions"]
+    worldPositions = array.array('d', positions)
+    for i in range(0, len(positions), 3):
+        x, y, z = positions[i], positions[i+1], positions[i+2]
+        worldPositions[i] = x*m[0] + y*m[4] + z*m[8] + m[12]
+        worldPositions[i+1] = x*m[1] + y*m[5] + z*m[9] + m[13]
+        worldPositions[i+2] = x*m[2] + y*m[6] + z*m[10] + m[14]
+    
+    # Normals are transformed by the inverse transpose
+    normals = buffer["normals"]
+    worldNormals = array.array('d', normals)
+    sqrt = math.sqrt
+    for i in range(0, len(normals), 3):
+        x, y, z = normals[i], normals[i+1], normals[i+2]
+        wx = x*n[0] + y*n[1] + z*n[2]
+        wy = x*n[3] + y*n[4] + z*n[5]
+        wz = x*n[6] + y*n[7] + z*n[8]
+        length = sqrt(wx*wx + wy*wy + wz*wz)
+        if length > 0:
+            wx /= length
+            wy /= length
+            wz /= length
+        worldNormals[i] = wx
+        worldNormals[i+1] = wy
+        worldNormals[i+2] = wz
+    
+    worldBuffer = dict(buffer)
+    worldBuffer["positions"] = worldPositions
+    worldBuffer["normals"] = worldNormals
+    worldBuffer.pop("weld", None)
+    return worldBuffer
+
+def WeldMeshBuffer(buffer, precision=None):
+    # Welds the triangle corners of a mesh buffer into unique vertices: corners whose position, skin weights, normal, UV
+    # and color are equal once rounded to precision decimals (WELD_PRECISION by default) become the same vertex
+    # Each array is quantized in a single pass over the whole mesh, then every corner is hashed as one tuple
+    # Returns {"indices": unique vertex of each corner, 3 per triangle, "vertices": first corner of each unique vertex,
+    #          "degenerate": number of triangles using the same unique vertex more than once}
+    if precision == None:
+        precision = WELD_PRECISION
+    scale = 10.0 ** precision
+    floor = math.floor
+    def Quantize(values, size):
+        quantized = [floor(value * scale + 0.5) for value in values]
+        return zip(*[quantized[i::size] for i in range(size)])
+    
+    # Positions and weights belong to the vertex, so they're combined into one key per vertex first
+    weightOffsets = buffer["weightOffsets"]
+    weightJoints = buffer["weightJoints"]
+    weightValues = [floor(value * scale + 0.5) for value in buffer["weightValues"]]
+    vertexKeys = [(position, tuple(weightJoints[start:end]), tuple(weightValues[start:end])) for position, start, end in zip(Quantize(buffer["positions"], 3), weightOffsets, weightOffsets[1:])]
+    
+    keys = zip(map(vertexKeys.__getitem__, buffer["triVerts"]), Quantize(buffer["normals"], 3), Quantize(buffer["uvs"], 2), Quantize(buffer["colors"], 4))
+    unique = {}
+    indices = array.array('i', [unique.setdefault(key, len(unique)) for key in keys])
+    
+    vertices = array.array('i', [0]) * len(unique)
+    for corner in range(len(indices) - 1, -1, -1):
+        vertices[indices[corner]] = corner
+    
+    degenerate = 0
+    for a, b, c in zip(indices[0::3], indices[1::3], indices[2::3]):
+        if a == b or b == c or a == c:
+            degenerate += 1
+    
+    return {"indices": indices, "vertices": vertices, "degenerate": degenerate}
+
+def GetMeshBufferWeld(buffer):
+    # Returns the welded vertices of a mesh buffer (see WeldMeshBuffer), only welding it once
+    if not "weld" in buffer:
+        buffer["weld"] = WeldMeshBuffer(buffer)
+    return buffer["weld"]
+
+def SliceMeshBufferTriangles(buffer, triangles):
+    # Returns a mesh buffer with only the given triangles of buffer, sharing its vertex arrays
+    sliced = dict(buffer)
+    sliced.pop("weld", None)
+    for key, size in (("triShapes", 1), ("triMaterials", 1), ("triVerts", 3), ("uvs", 6), ("colors", 12), ("normals", 9)):
+        values = buffer[key]
+        sliced[key] = array.array(values.typecode, [values[i] for t in triangles for i in range(t*size, t*size+size)])
+    return sliced
+
+def GetCacheMissRatio(indices, triangles, cacheSize):
+    # Returns the ACMR (average number of vertices transformed per triangle) of drawing the given triangles of an index
+    # buffer in order, with a FIFO post-transform cache of cacheSize vertices
+    cache = collections.deque()
+    cached = set()
+    misses = 0
+    for t in triangles:
+        for v in (indices[t*3], indices[t*3+1], indices[t*3+2]):
+            if v in cached:
+                continue
+            misses += 1
+            cache.append(v)
+            cached.add(v)
+            if len(cache) > cacheSize:
+                cached.discard(cache.popleft())
+    return misses / float(max(len(triangles), 1))
+
+def GetVertexCacheOrder(indices, triangles, cacheSize):
+    # Reorders triangles of an index buffer for a FIFO post-transform vertex cache, with the linear-speed Tipsify algorithm
+    # (Sander, Nehab and Barczak, "Fast Triangle Reordering for Vertex Locality and Reduced Overdraw"): triangles are emitted
+    # as fans around one vertex at a time, and the next fan is around whichever vertex of the last fan will still be in the
+    # cache once its remaining triangles are emitted
+    # Map the vertices to local indices, with the triangles of each vertex stored as a CSR list
+    localIndices = {}
+    triVerts = [localIndices.setdefault(indices[i], len(localIndices)) for t in triangles for i in (t*3, t*3+1, t*3+2)]
+    tris = zip(triVerts[0::3], triVerts[1::3], triVerts[2::3])
+    numVerts = len(localIndices)
+    live = [0] * numVerts # Triangles left on each vertex
+    for v in triVerts:
+        live[v] += 1
+    offsets = [0] * (numVerts + 1)
+    for v in range(numVerts):
+        offsets[v+1] = offsets[v] + live[v]
+    vertTris = [0] * len(triVerts)
+    fill = offsets[:-1]
+    for i, v in enumerate(triVerts):
+        vertTris[fill[v]] = i / 3
+        fill[v] += 1
+    
+    timeStamps = [0] * numVerts # Time each vertex last entered the cache
+    emitted = [False] * len(tris)
+    deadEnd = [] # Recently used vertices, to continue from when a fan has no good next vertex
+    order = []
+    now = cacheSize + 1
+    cursor = 0
+    fanVertex = 0
+    if numVerts == 0:
+        fanVertex = -1
+    while fanVertex >= 0:
+        # Emit every triangle left around the fan vertex
+        candidates = []
+        for t in vertTris[offsets[fanVertex]:offsets[fanVertex+1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(triangles[t])
+            for v in tris[t]:
+                deadEnd.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if now - timeStamps[v] > cacheSize:
+                    timeStamps[v] = now
+                    now += 1
+        
+        # Pick the oldest candidate that will still be in the cache after its own fan
+        fanVertex = -1
+        bestPriority = -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if now - timeStamps[v] + 2 * live[v] <= cacheSize:
+                    priority = now - timeStamps[v]
+                if priority > bestPriority:
+                    bestPriority = priority
+                    fanVertex = v
+        
+        # Otherwise continue from the most recent vertex that has triangles left, or the next one in order
+        while fanVertex < 0 and len(deadEnd) > 0:
+            v = deadEnd.pop()
+            if live[v] > 0:
+                fanVertex = v
+        while fanVertex < 0 and cursor < numVerts:
+            if live[cursor] > 0:
+                fanVertex = cursor
+            cursor += 1
+    
+    return order
+
+def OptimizeMeshBufferTriangles(buffer, cacheSize):
+    # Returns a copy of a mesh buffer with its triangles grouped by material, and each group ordered for the vertex cache
+    # (see GetVertexCacheOrder), along with the ACMR before and after
+    weld = GetMeshBufferWeld(buffer)
+    indices = weld["indices"]
+    triMaterials = buffer["triMaterials"]
+    numTris = len(triMaterials)
+    
+    groups = {}
+    for t, material in enumerate(triMaterials):
+        groups.setdefault(material, []).append(t)
+    order = []
+    for material in sorted(groups.keys()):
+        order.extend(GetVertexCacheOrder(indices, groups[material], cacheSize))
+    
+    before = GetCacheMissRatio(indices, range(numTris), cacheSize)
+    after = GetCacheMissRatio(indices, order, cacheSize)
+    
+    # The welded vertices are reordered along with the triangles, instead of welding again
+    optimized = SliceMeshBufferTriangles(buffer, order)
+    optimizedIndices = array.array('i', [indices[i] for t in order for i in (t*3, t*3+1, t*3+2)])
+    vertices = array.array('i', weld["vertices"])
+    for corner in range(len(optimizedIndices) - 1, -1, -1):
+        vertices[optimizedIndices[corner]] = corner
+    optimized["weld"] = {"indices": optimizedIndices, "vertices": vertices, "degenerate": weld["degenerate"]}
+    return (optimized, before, after)
+
+def PartitionMeshBuffers(buffers, maxJoints, nodes=None):
+    # Splits the triangles of a list of mesh buffers into parts that each use at most maxJoints joints
+    # If the joint nodes ((name, parent index) pairs) are given, a triangle also uses the first joint and the parents of its
+    # joints, since a part pruned to its joints keeps them as well (see GetPrunedJoints)
+    # Triangles are grouped by the set of joints they use, then the sets are packed greedily, largest first, into the
+    # part they grow the least
+    # Returns (list of mesh buffer lists, number of triangles using more than maxJoints joints on their own,
+    #          number of vertices used by triangles of more than one part)
+    jointsWithParents = {} # Joint -> the joint, its parents and the first joint
+    def AddParents(jointSet):
+        joints = set()
+        for j in jointSet:
+            if not j in jointsWithParents:
+                chain = set([0])
+                parent = j
+                while parent >= 0 and not parent in chain:
+                    chain.add(parent)
+                    parent = nodes[parent][1]
+                jointsWithParents[j] = chain
+            joints.update(jointsWithParents[j])
+        return frozenset(joints)
+    
+    jointSetTriangles = {} # Joint set -> (buffer index, triangle index) of every triangle using exactly those joints
+    for b, buffer in enumerate(buffers):
+        weightOffsets = buffer["weightOffsets"]
+        weightJoints = buffer["weightJoints"]
+        vertexJoints = [weightJoints[start:end] or (0,) for start, end in zip(weightOffsets, weightOffsets[1:])]
+        triVerts = buffer["triVerts"]
+        for t in range(len(triVerts) / 3):
+            jointSet = frozenset(itertools.chain(vertexJoints[triVerts[t*3]], vertexJoints[triVerts[t*3+1]], vertexJoints[triVerts[t*3+2]]))
+            jointSetTriangles.setdefault(jointSet, []).append((b, t))
+    if nodes != None:
+        closedSets = {}
+        for jointSet, triangles in jointSetTriangles.iteritems():
+            closedSets.setdefault(AddParents(jointSet), []).extend(triangles)
+        jointSetTriangles = closedSets
+    
+    parts = [] # (joints used, joint sets)
+    oversized = 0
+    for jointSet in sorted(jointSetTriangles.keys(), key=len, reverse=True):
+        best = None
+        bestGrowth = None
+        for part in parts:
+            growth = len(jointSet - part[0])
+            if len(part[0]) + growth <= maxJoints and (best == None or growth < bestGrowth):
+                best = part
+                bestGrowth = growth
+        if best == None:
+            if len(jointSet) > maxJoints:
+                oversized += len(jointSetTriangles[jointSet])
+            best = (set(), [])
+            parts.append(best)
+        best[0].update(jointSet)
+        best[1].append(jointSet)
+    
+    # Rebuild the buffers of each part, keeping the triangles in their original order
+    partBuffers = []
+    vertexParts = {} # (buffer index, vertex index) -> number of parts using the vertex
+    for joints, jointSets in parts:
+        bufferTriangles = [[] for buffer in buffers]
+        for jointSet in jointSets:
+            for b, t in jointSetTriangles[jointSet]:
+                bufferTriangles[b].append(t)
+        partBuffers.append([])
+        for b, triangles in enumerate(bufferTriangles):
+            if len(triangles) > 0:
+                triangles.sort()
+                partBuffers[-1].append(SliceMeshBufferTriangles(buffers[b], triangles))
+                for vert in set(partBuffers[-1][-1]["triVerts"]):
+                    vertexParts[(b, vert)] = vertexParts.get((b, vert), 0) + 1
+    
+    sharedVerts = len([count for count in vertexParts.itervalues() if count > 1])
+    return (partBuffers, oversized, sharedVerts)
+
+def GetPartFilePath(filePath, part):
+    # Returns the path of a part of a split model, the first part keeps the original path
+    if part == 0:
+        return filePath
+    base, extension = os.path.splitext(filePath)
+    return "%s_part%i%s" % (base, part+1, extension)
+
+def GetLODFilePath(filePath, lod):
+    # Returns the path of the LOD model of the given index (0 for the first LOD)
+    base, extension = os.path.splitext(filePath)
+    return "%s_lod%i%s" % (base, lod+1, extension)
+
+def CompactMeshBufferVertices(buffer):
+    # Returns a copy of a mesh buffer without the vertices that no triangle uses
+    triVerts = buffer["triVerts"]
+    used = sorted(set(triVerts))
+    remap = dict([(vert, i) for i, vert in enumerate(used)])
+    positions = buffer["positions"]
+    weightOffsets = buffer["weightOffsets"]
+    weightJoints = buffer["weightJoints"]
+    weightValues = buffer["weightValues"]
+    
+    compact = dict(buffer)
+    compact.pop("weld", None)
+    compact["triVerts"] = array.array('i', [remap[vert] for vert in triVerts])
+    compact["positions"] = array.array('d', [positions[i] for vert in used for i in (vert*3, vert*3+1, vert*3+2)])
+    compact["weightOffsets"] = array.array('i', [0])
+    compact["weightJoints"] = array.array('i')
+    compact["weightValues"] = array.array('d')
+    for vert in used:
+        start = weightOffsets[vert]
+        end = weightOffsets[vert+1]
+        compact["weightJoints"].extend(weightJoints[start:end])
+        compact["weightValues"].extend(weightValues[start:end])
+        compact["weightOffsets"].append(len(compact["weightJoints"]))
+    return compact
+
+def DecimateMeshBuffer(buffer, ratio):
+    # Returns a copy of a mesh buffer simplified to about ratio of its triangles by quadric error edge collapses
+    # (Garland and Heckbert, "Surface Simplification Using Quadric Error Metrics")
+    # Edges are collapsed onto one of their vertices instead of a new position, so skin weights never have to be blended.
+    # Vertices are never removed if they're on an open border or a non-manifold edge, or if their triangle corners don't
+    # all share the same UV, normal, color and material (UV seams, hard edges and material borders). A vertex is only
+    # collapsed into a neighbour mostly weighted to the same joint, which keeps the borders between joints
+    # The cheapest collapse is always taken from a heap, entries made stale by earlier collapses being skipped
+    positions = buffer["positions"]
+    triMaterials = buffer["triMaterials"]
+    triVerts = array.array('i', buffer["triVerts"])
+    uvs = array.array('d', buffer["uvs"])
+    normals = array.array('d', buffer["normals"])
+    colors = array.array('f', buffer["colors"])
+    numVerts = len(positions) / 3
+    numTris = len(triMaterials)
+    targetTris = int(numTris * ratio)
+    
+    # Find the vertices to keep, and the joint each vertex is mostly weighted to
+    locked = [False] * numVerts
+    cornerKeys = [None] * numVerts
+    edgeTris = {}
+    for t in range(numTris):
+        for k in range(3):
+            corner = t*3+k
+            vert = triVerts[corner]
+            key = (triMaterials[t], uvs[corner*2:corner*2+2], normals[corner*3:corner*3+3], colors[corner*4:corner*4+4])
+            if cornerKeys[vert] == None:
+                cornerKeys[vert] = key
+            elif cornerKeys[vert] != key:
+                locked[vert] = True
+            other = triVerts[t*3+(k+1)%3]
+            edge = vert < other and (vert, other) or (other, vert)
+            edgeTris[edge] = edgeTris.get(edge, 0) + 1
+    for (a, b), count in edgeTris.iteritems():
+        if count != 2:
+            locked[a] = locked[b] = True
+    
+    weightOffsets = buffer["weightOffsets"]
+    weightJoints = buffer["weightJoints"]
+    weightValues = buffer["weightValues"]
+    mainJoints = [-1] * numVerts
+    for vert in range(numVerts):
+        start = weightOffsets[vert]
+        end = weightOffsets[vert+1]
+        if end > start:
+            weights = weightValues[start:end]
+            mainJoints[vert] = weightJoints[start + weights.index(max(weights))]
+    
+    # Quadric of each vertex, the sum of the area weighted planes of its triangles, as 10 values per vertex
+    quadrics = [0.0] * (numVerts * 10)
+    vertTris = [[] for vert in range(numVerts)]
+    sqrt = math.sqrt
+    for t in range(numTris):
+        a, b, c = triVerts[t*3], triVerts[t*3+1], triVerts[t*3+2]
+        vertTris[a].append(t)
+        vertTris[b].append(t)
+        vertTris[c].append(t)
+        ax, ay, az = positions[a*3], positions[a*3+1], positions[a*3+2]
+        ux, uy, uz = positions[b*3] - ax, positions[b*3+1] - ay, positions[b*3+2] - az
+        vx, vy, vz = positions[c*3] - ax, positions[c*3+1] - ay, positions[c*3+2] - az
+        nx, ny, nz = uy*vz - uz*vy, uz*vx - ux*vz, ux*vy - uy*vx
+        length = sqrt(nx*nx + ny*ny + nz*nz)
+        if length == 0:
+            continue
+        area = length * 0.5
+        nx, ny, nz = nx / length, ny / length, nz / length
+        d = -(nx*ax + ny*ay + nz*az)
+        plane = (nx*nx, nx*ny, nx*nz, nx*d, ny*ny, ny*nz, ny*d, nz*nz, nz*d, d*d)
+        for vert in (a, b, c):
+            offset = vert * 10
+            for i in range(10):
+                quadrics[offset+i] += plane[i] * area
+    
+    def GetCollapseCost(u, v):
+        # Error of moving u onto v, with the quadrics of both
+        q = [quadrics[u*10+i] + quadrics[v*10+i] for i in range(10)]
+        x, y, z = positions[v*3], positions[v*3+1], positions[v*3+2]
+        return q[0]*x*x + 2*q[1]*x*y + 2*q[2]*x*z + 2*q[3]*x + q[4]*y*y + 2*q[5]*y*z + 2*q[6]*y + q[7]*z*z + 2*q[8]*z + q[9]
+    
+    stamps = [0] * numVerts # Changed whenever a vertex's quadric changes, so stale heap entries can be skipped
+    heap = []
+    def PushCollapses(vert, neighbours):
+        for other in neighbours:
+            if mainJoints[vert] != mainJoints[other]:
+                continue
+            if not locked[vert]:
+                heapq.heappush(heap, (GetCollapseCost(vert, other), vert, other, stamps[vert], stamps[other]))
+            if not locked[other]:
+                heapq.heappush(heap, (GetCollapseCost(other, vert), other, vert, stamps[other], stamps[vert]))
+    for (a, b) in edgeTris.iterkeys():
+        PushCollapses(a, (b,))
+    
+    alive = [True] * numTris
+    removed = [False] * numVerts
+    numAlive = numTris
+    def GetNormal(a, b, c):
+        ax, ay, az = positions[a*3], positions[a*3+1], positions[a*3+2]
+        ux, uy, uz = positions[b*3] - ax, positions[b*3+1] - ay, positions[b*3+2] - az
+        vx, vy, vz = positions[c*3] - ax, positions[c*3+1] - ay, positions[c*3+2] - az
+        return (uy*vz - uz*vy, uz*vx - ux*vz, ux*vy - uy*vx)
+    
+    while numAlive > targetTris and len(heap) > 0:
+        cost, u, v, stampU, stampV = heapq.heappop(heap)
+        if removed[u] or removed[v] or stamps[u] != stampU or stamps[v] != stampV:
+            continue
+        
+        trisU = [t for t in vertTris[u] if alive[t]]
+        vertTris[u] = trisU
+        shared = [t for t in trisU if triVerts[t*3] == v or triVerts[t*3+1] == v or triVerts[t*3+2] == v]
+        if len(shared) == 0:
+            continue
+        
+        # Only collapse if the surface stays manifold (the link condition) and no triangle flips over or turns by more
+        # than 60 degrees, which would fold curved surfaces
+        trisV = [t for t in vertTris[v] if alive[t]]
+        vertTris[v] = trisV
+        neighboursU = set([triVerts[i] for t in trisU for i in (t*3, t*3+1, t*3+2)])
+        neighboursV = set([triVerts[i] for t in trisV for i in (t*3, t*3+1, t*3+2)])
+        if len(neighboursU & neighboursV) - 2 != len(shared):
+            continue
+        valid = True
+        moved = [t for t in trisU if not t in shared]
+        for t in moved:
+            corners = list(triVerts[t*3:t*3+3])
+            before = GetNormal(*corners)
+            corners[corners.index(u)] = v
+            after = GetNormal(*corners)
+            dot = before[0]*after[0] + before[1]*after[1] + before[2]*after[2]
+            if dot <= 0 or dot*dot < 0.25 * (before[0]*before[0] + before[1]*before[1] + before[2]*before[2]) * (after[0]*after[0] + after[1]*after[1] + after[2]*after[2]):
+                valid = False
                 break
-        if not found:
-            return False
-    
-    return localVertexIndices
-
+        if not valid:
+            continue
+        
+        # Corners moved onto v take the UV, normal and color v has in the collapsed triangles, since u has the same
+        # values on every corner
+        s = shared[0]
+        source = s*3 + list(triVerts[s*3:s*3+3]).index(v)
+        for t in shared:
+            alive[t] = False
+            numAlive -= 1
+        for t in moved:
+            corner = t*3 + list(triVerts[t*3:t*3+3]).index(u)
+            triVerts[corner] = v
+            uvs[corner*2:corner*2+2] = uvs[source*2:source*2+2]
+            normals[corner*3:corner*3+3] = normals[source*3:source*3+3]
+            colors[corner*4:corner*4+4] = colors[source*4:source*4+4]
+            trisV.append(t)
+        for i in range(10):
+            quadrics[v*10+i] += quadrics[u*10+i]
+        removed[u] = True
+        stamps[v] += 1
+        
+        neighbours = set([triVerts[i] for t in trisV if alive[t] for i in (t*3, t*3+1, t*3+2)])
+        neighbours.discard(v)
+        PushCollapses(v, neighbours)
+    
+    decimated = dict(buffer, triVerts=triVerts, uvs=uvs, normals=normals, colors=colors)
+    decimated.pop("weld", None)
+    return CompactMeshBufferVertices(SliceMeshBufferTriangles(decimated, [t for t in range(numTris) if alive[t]]))
+
+def GetSkinCluster(dagPath):
+    # Returns the MFnSkinCluster deforming the given mesh shape, or None
+    clusterNode = GetCachedGraphLookup("skinCluster", dagPath.node(), FindSkinCluster)
+    if clusterNode is None: # MObjects can't be compared to None with ==
+        return None
+    return OpenMayaAnim.MFnSkinCluster(clusterNode)
 
-def GetShapes(joints):
-    # Vars
-    meshes = []
-    verts = []
-    tris = []
+def FindSkinCluster(shapeNode):
+    # Returns the skin cluster node deforming a mesh shape node, or None
+    clusterName = mel.eval("findRelatedSkinCluster " + OpenMaya.MFnDagNode(shapeNode).partialPathName()) # I couldn't figure out how to get the skin cluster via the API
+    if clusterName == None or clusterName == "" or clusterName.isspace():
+        return None
+    selList = OpenMaya.MSelectionList()
+    selList.add(clusterName)
+    clusterNode = OpenMaya.MObject()
+    selList.getDependNode(0, clusterNode)
+    return clusterNode
+
+def GetSkinInfluences(skin):
+    # Returns the MDagPaths of the influences of an MFnSkinCluster
+    # The cache holds the influence nodes, since reparenting a joint doesn't clear it and would leave a cached path stale
+    paths = []
+    for handle in GetCachedGraphLookup("influences", skin.object(), FindSkinInfluences):
+        path = OpenMaya.MDagPath()
+        OpenMaya.MDagPath.getAPathTo(handle.object(), path)
+        paths.append(path)
+    return paths
+
+def FindSkinInfluences(clusterNode):
+    # Returns MObjectHandles of the influence nodes of a skin cluster node, in the order of its weights
+    influences = OpenMaya.MDagPathArray()
+    OpenMayaAnim.MFnSkinCluster(clusterNode).influenceObjects(influences)
+    return [OpenMaya.MObjectHandle(influences[i].node()) for i in range(influences.length())]
+
+def IterShapes(jointTable, shapes):
+    # Yields one mesh buffer (see NewMeshBuffer) per selected mesh, so only a single mesh has to be held in memory at a time
+    # shapes["meshes"] and shapes["materials"] are filled in as the meshes are walked
+    # Yields an error string and stops if a mesh can't be read
+    # Unskinned meshes are extracted in object space and cached, both by shape node and by content, so instances and
+    # identical copies of a mesh are only triangulated once and then just moved to each instance's world space
+    meshes = shapes["meshes"]
+    materials = shapes["materials"]
     materialDict = {}
-    materials = []
+    meshPaths = set()
+    instanceCache = {} # (shape node hash code, materials) -> (MObjectHandle of the shape node, object space mesh buffer)
+    contentCache = {} # GetMeshContentHash -> object space mesh buffer
     
     # Convert the joints to a dictionary, for simple searching for joint indices
     jointDict = {}
-    for i, joint in enumerate(joints):
-        jointDict[joint[1].partialPathName()] = i
+    for i, joint in enumerate(jointTable):
+        jointDict[joint["partialName"]] = i
     
     # Get all selected objects
     selectedObjects = OpenMaya.MSelectionList()
     OpenMaya.MGlobal.getActiveSelectionList(selectedObjects)
     
-    # The global vert index at the start of each object
-    currentStartingVertIndex = 0
-    
     # Loop through all objects
     for i in range(0, selectedObjects.length()):
         # Get data on object
@@ -429,189 +1440,236 @@ def GetShapes(joints):
         # Lower path to shape node
         # Selecting a shape transform or shape will get the same dagPath to the shape using this
         dagPath.extendToShape()
+        meshName = dagPath.partialPathName()
         
         # Check for duplicates
-        if dagPath.partialPathName() in meshes:
+        if meshName in meshPaths:
             ProgressBarStep()
             continue
         
         # Add shape to list
-        meshes.append(dagPath.partialPathName())
+        meshPaths.add(meshName)
+        meshes.append(meshName)
+        shapeIndex = len(meshes)-1
         
         # Get mesh
         mesh = OpenMaya.MFnMesh(dagPath)
         
         # Get skin cluster
-        clusterName = mel.eval("findRelatedSkinCluster " + dagPath.partialPathName()) # I couldn't figure out how to get the skin cluster via the API
-        hasSkin = False
-        if clusterName != None and clusterName != "" and not clusterName.isspace():
-            hasSkin = True
-            selList = OpenMaya.MSelectionList()
-            selList.add(clusterName)
-            clusterNode = OpenMaya.MObject()
-            selList.getDependNode(0, clusterNode)
-            skin = OpenMayaAnim.MFnSkinCluster(clusterNode)
-        
-        # Loop through all vertices
-        vertIter = OpenMaya.MItMeshVertex(dagPath)
-        while not vertIter.isDone():
-            if not hasSkin:
-                verts.append((vertIter.position(OpenMaya.MSpace.kWorld), []))
-                vertIter.next()
-                continue
-            
-            # Get weight values
-            weightValues = OpenMaya.MDoubleArray()
-            numWeights = OpenMaya.MScriptUtil() # Need this because getWeights crashes without being passed a count
-            skin.getWeights(dagPath, vertIter.currentItem(), weightValues, numWeights.asUintPtr())
-            
-            # Get weight names
-            weightJoints = OpenMaya.MDagPathArray()
-            skin.influenceObjects(weightJoints)
-            
-            # Make sure the list of weight values and names match
-            if weightValues.length() != weightJoints.length():
-                PrintWarning("Failed to retrieve vertex weight list on '%s.vtx[%d]'; using default joints." % (dagPath.partialPathName(), vertIter.index()))
-            
-            # Remove weights of value 0 or weights from unexported joints
-            finalWeights = []
-            weightsSize = 0
-            for i in range(0, weightJoints.length()):
-                if weightValues[i] < 0.000001: # 0.000001 is the smallest decimal in xmodel exports
-                    continue
-                jointName = weightJoints[i].partialPathName()
-                if not jointName in jointDict:
-                    PrintWarning("Unexported joint %s is influencing vertex '%s.vtx[%d]' by %f%%" % (("'%s'" % jointName).ljust(15), dagPath.partialPathName(), vertIter.index(), weightValues[i]*100))
-                else:
-                    finalWeights.append([jointDict[jointName], weightValues[i]])
-                    weightsSize += weightValues[i]
-            
-            # Make sure the total weight adds up to 1
-            if weightsSize > 0:
-                weightMultiplier = 1 / weightsSize
-                for weight in finalWeights:
-                    weight[1] *= weightMultiplier
-            
-            verts.append((
-                vertIter.position(OpenMaya.MSpace.kWorld), # XYZ position
-                finalWeights # List of weights
-            ))
-            
-            # Next vert
-            vertIter.next()
+        skin = GetSkinCluster(dagPath)
+        
+        startTime = time.clock()
+        cached = False
         
         # Get materials used by this mesh
         meshMaterials = GetMaterialsFromMesh(mesh, dagPath)
         
-        # Loop through all faces
-        polyIter = OpenMaya.MItMeshPolygon(dagPath)
-        currentObjectVertexOffset = 0
-        while not polyIter.isDone():
-            # Get this poly's material
-            polyMaterial = meshMaterials[polyIter.index()]
+        if skin != None:
+            # Pull the whole mesh out in a handful of calls
+            data = GetMeshBulkData(dagPath, mesh, skin)
             
-            # Every face must have a material
-            if polyMaterial == None:
-                PrintWarning("Found no material on face '%s.f[%d]'; ignoring face" % (dagPath.partialPathName(), polyIter.index()))
-                polyIter.next()
-                continue
+            buffer = NewMeshBuffer()
+            buffer["positions"] = data["points"]
             
-            # Add this poly's material to the global list of used materials
-            if not polyMaterial[0] in materialDict:
-                materialDict[polyMaterial[0]] = len(materials)
-                materials.append(polyMaterial)
+            # Map each skin influence to its exported joint index once, instead of once per vertex
+            influenceToJoint = [jointDict.get(name) for name in data["influences"]]
+            if data["numInfluences"] != len(influenceToJoint):
+                PrintWarning("Failed to retrieve vertex weight list on '%s'; using default joints." % meshName)
+            buffer["weightOffsets"], buffer["weightJoints"], buffer["weightValues"] = GetSkinWeightsCSR(data["weights"], len(data["points"]) / 3, data["numInfluences"], data["influences"], influenceToJoint, meshName)
             
-            # Get vertex indices of this poly, and the vertex indices of this poly's triangles
-            trianglePoints = OpenMaya.MPointArray()
-            triangleIndices = OpenMaya.MIntArray()
-            vertexIndices = OpenMaya.MIntArray()
-            polyIter.getTriangles(trianglePoints, triangleIndices)
-            polyIter.getVertices(vertexIndices)
-            
-            # localTriangleIndices is the same as triangleIndices, except each vertex is listed as the face-relative index intead of the object-realtive index
-            localTriangleIndices = VerticesObjRelToLocalRel(vertexIndices, triangleIndices)
-            if localTriangleIndices == False:
-                return "Failed to convert object-relative vertices to face-relative on poly '%s.f[%d]'" % (dagPath.partialPathName(), polyIter.index())
-            
-            # Note: UVs, normals, and colors, are "per-vertex per face", because even though two faces may share
-            # a vertex, they might have different UVs, colors, or normals. So, each face has to contain this info
-            # for each of it's vertices instead of each vertex alone
-            Us = OpenMaya.MFloatArray()
-            Vs = OpenMaya.MFloatArray()
-            normals = OpenMaya.MVectorArray()
-            polyIter.getUVs(Us, Vs)
-            polyIter.getNormals(normals, OpenMaya.MSpace.kWorld)
-            
-            # Add each triangle in this poly to the global face list
-            for i in range(triangleIndices.length()/3): # vertexIndices.length() has 3 values per triangle
-                # Put local indices into an array for easy access
-                locals = [localTriangleIndices[i*3], localTriangleIndices[i*3+1], localTriangleIndices[i*3+2]]
-                
-                # Using polyIter.getColors() doesn't always work - sometimes values in the return array would
-                # be valid Python objects, but when used they would cause Maya to completely crash. No idea
-                # why that happens, but getting the colors individually fixed the problem.
-                vert0Color = OpenMaya.MColor()
-                vert1Color = OpenMaya.MColor()
-                vert2Color = OpenMaya.MColor()
-                polyIter.getColor(vert0Color, locals[0])
-                polyIter.getColor(vert1Color, locals[1])
-                polyIter.getColor(vert2Color, locals[2])
-                    
-                # Note: Vertices are in 0,2,1 order to make CoD happy
-                tris.append((
-                    len(meshes)-1, # Shape index
-                    materialDict[polyMaterial[0]], # Matertial index 
-                    (currentStartingVertIndex + triangleIndices[i*3], currentStartingVertIndex + triangleIndices[i*3+1], currentStartingVertIndex + triangleIndices[i*3+2]), # Vert indices
-                    ((Us[locals[0]], 1-Vs[locals[0]]),      (Us[locals[1]], 1-Vs[locals[1]]),       (Us[locals[2]], 1-Vs[locals[2]])),    # UVs
-                    (vert0Color,                            vert1Color,                             vert2Color),                          # Colors
-                    (OpenMaya.MVector(normals[locals[0]]),  OpenMaya.MVector(normals[locals[1]]),   OpenMaya.MVector(normals[locals[2]])) # Normals; Must copy the normals into a new container, because the original is destructed at the end of this poltIter iteration.
-                ))
-            
-            # Next poly
-            polyIter.next()
+            error = FillMeshBufferTriangles(buffer, data, meshMaterials, materials, materialDict, meshName)
+            if error != None:
+                yield error
+                return
+        else:
+            shapeNode = dagPath.node()
+            instanceKey = (OpenMaya.MObjectHandle(shapeNode).hashCode(), tuple(meshMaterials))
+            objectBuffer = None
+            instance = instanceCache.get(instanceKey)
+            if instance != None and instance[0].object() == shapeNode: # Hash codes aren't unique
+                objectBuffer = instance[1]
+            cached = objectBuffer != None
+            if objectBuffer == None:
+                data = GetMeshBulkData(dagPath, mesh, None, OpenMaya.MSpace.kObject)
+                contentKey = GetMeshContentHash(data, meshMaterials)
+                objectBuffer = contentCache.get(contentKey)
+                cached = objectBuffer != None
+                if objectBuffer == None:
+                    objectBuffer = NewMeshBuffer()
+                    objectBuffer["positions"] = data["points"]
+                    objectBuffer["weightOffsets"] = array.array('i', [0]) * (len(data["points"]) / 3 + 1)
+                    error = FillMeshBufferTriangles(objectBuffer, data, meshMaterials, materials, materialDict, meshName)
+                    if error != None:
+                        yield error
+                        return
+                    contentCache[contentKey] = objectBuffer
+                instanceCache[instanceKey] = (OpenMaya.MObjectHandle(shapeNode), objectBuffer)
+            buffer = TransformMeshBuffer(objectBuffer, dagPath)
         
-        # Update starting vertex index
-        currentStartingVertIndex = len(verts)
+        numVerts, numTris = GetMeshBufferCounts(buffer)
+        buffer["triShapes"] = array.array('i', [shapeIndex]) * numTris
+        
+        # Track extraction throughput, only printed once per export so instance heavy scenes don't flood the script editor
+        stats = {"name": meshName, "verts": numVerts, "tris": numTris, "seconds": time.clock() - startTime, "cached": cached}
+        
+        # Reorder the triangles for the vertex cache
+        if OPTIMIZE_TRIANGLE_ORDER:
+            startTime = time.clock()
+            buffer, stats["acmrBefore"], stats["acmrAfter"] = OptimizeMeshBufferTriangles(buffer, VERTEX_CACHE_SIZE)
+            stats["reorderSeconds"] = time.clock() - startTime
+        
+        # Report how much the triangle list repeats each vertex
+        if REPORT_VERTEX_DUPLICATION:
+            weld = GetMeshBufferWeld(buffer)
+            stats["weldedVerts"] = len(weld["vertices"])
+            stats["degenerateTris"] = weld["degenerate"]
+        MeshExtractionStats.append(stats)
         
         ProgressBarStep()
         
-    # Error messages
-    if len(meshes) == 0:
+        yield buffer
+
+
+def GetShapesError(numMeshes, numVerts, numTris, numMaterials):
+    if numMeshes == 0:
         return "No meshes selected to export."
-    if len(verts) == 0:
+    if numVerts == 0:
         return "No vertices found in selected meshes."
-    if len(tris) == 0:
+    if numTris == 0:
         return "No faces found in selected meshes."
-    if len(materials) == 0:
+    if numMaterials == 0:
         return "No materials found on the selected meshes."
+    return None
+
+
+# SMD SERIALIZATION
+# Everything is formatted a whole block at a time (up to SMD_BLOCK_TRIANGLES triangles of a material run, all joints of
+# a frame) with precomputed format strings, and written with a single f.write per block
+
+def GetSMDTemplates():
+    global SMDTemplates
+    if SMDTemplates == None or SMDTemplates["precision"] != FLOAT_PRECISION:
+        number = "%%.%if" % FLOAT_PRECISION
+        SMDTemplates = {
+            "precision": FLOAT_PRECISION,
+            "joint": "%s %s %s  %s %s %s\n" % ((number,) * 6), # Position, rotation
+            "position": "%s %s %s" % ((number,) * 3),
+            "corner": "0 %%s %s %s %s %s %s %%s\n" % ((number,) * 5), # Position string, normal, UV, weight string
+            "weight": " %%i %s " % number,
+            "defaultWeight": (" 0 %s " % number) % 1.0
+        }
+    return SMDTemplates
+
+def FinishSMDBlock(text):
+    # Applies the final formatting options to a block of SMD text
+    if TRIM_TRAILING_ZEROS:
+        return TRAILING_ZEROS_REGEX.sub(lambda match: match.group(2) and match.group(1) + "." + match.group(2) or match.group(1), text)
+    return text
+
+def FormatSMDSkeletonFrame(time, rows, jointIndices=None):
+    # Formats a "time" entry of a skeleton block, rows being GetJointSampleRow results in joint order
+    # If jointIndices is given, only those joints are written
+    jointTemplate = "%i  " + GetSMDTemplates()["joint"]
+    lines = ["time %i\n" % time]
+    if jointIndices == None:
+        jointIndices = range(len(rows))
+    for j in jointIndices:
+        lines.append(jointTemplate % ((j,) + tuple(rows[j])))
+    return FinishSMDBlock("".join(lines))
+
+def GetSparseJoints(rows, positionEpsilon, rotationEpsilon, lastRows):
+    # Returns the indices of the joints to write on each frame of a block of skeleton rows, for sparse animation frames
+    # lastRows holds the last row written for each joint and is updated, so an animation can be processed a block at a time
+    # While it's empty, the first frame has every joint. Later frames only have the joints that moved more than the epsilons since they were last written
+    numFrames = len(rows)
+    if numFrames == 0:
+        return []
+    jointIndices = [[] for i in range(numFrames)]
+    start = 0
+    if len(lastRows) == 0:
+        lastRows.extend(rows[0])
+        jointIndices[0] = range(len(rows[0]))
+        start = 1
+    
+    # Walk the block one joint at a time, comparing each row to the last one written
+    for j in range(len(lastRows)):
+        last = lastRows[j]
+        for i in range(start, numFrames):
+            row = rows[i][j]
+            if abs(row[0] - last[0]) > positionEpsilon or abs(row[1] - last[1]) > positionEpsilon or abs(row[2] - last[2]) > positionEpsilon or \
+                abs(row[3] - last[3]) > rotationEpsilon or abs(row[4] - last[4]) > rotationEpsilon or abs(row[5] - last[5]) > rotationEpsilon:
+                jointIndices[i].append(j)
+                last = row
+        lastRows[j] = last
+    
+    return jointIndices
+
+def FormatSMDNodes(nodes):
+    # Formats the nodes block, nodes being (joint name, parent index) tuples
+    lines = ["nodes\n"]
+    if len(nodes) == 0:
+        lines.append("0 \"tag_origin\" -1\n")
+    else:
+        for i, node in enumerate(nodes):
+            lines.append("%i \"%s\" %i\n" % (i, node[0], node[1]))
+    lines.append("end\n")
+    return "".join(lines)
+
+def WriteSMDTriangles(f, buffer, materials):
+    # Writes all triangles of a mesh buffer
+    templates = GetSMDTemplates()
+    cornerTemplate = templates["corner"]
+    weightTemplate = templates["weight"]
+    defaultWeight = " 1 " + templates["defaultWeight"]
+    positions = buffer["positions"]
+    triMaterials = buffer["triMaterials"]
+    triVerts = buffer["triVerts"]
+    normals = buffer["normals"]
+    uvs = buffer["uvs"]
+    
+    # Everything that only depends on the vertex or the material is formatted once
+    materialNames = [material[0].split(":")[-1] + "\n" for material in materials]
+    positionTemplate = templates["position"]
+    positionStrings = [positionTemplate % (positions[v]*CM_TO_INCH, positions[v+1]*CM_TO_INCH, positions[v+2]*CM_TO_INCH) for v in range(0, len(positions), 3)]
+    weightOffsets = buffer["weightOffsets"]
+    weightJoints = buffer["weightJoints"]
+    weightValues = buffer["weightValues"]
+    weightStrings = []
+    for v in range(len(weightOffsets) - 1):
+        start = weightOffsets[v]
+        end = weightOffsets[v+1]
+        if end > start:
+            weightStrings.append(" %i " % (end - start) + "".join([weightTemplate % (weightJoints[i], weightValues[i]) for i in range(start, end)]))
+        else:
+            weightStrings.append(defaultWeight)
+    
+    # Write one block per run of triangles using the same material, long runs being cut into blocks of SMD_BLOCK_TRIANGLES
+    # so memory use doesn't grow with the size of the mesh
+    numTris = len(triMaterials)
+    runStart = 0
+    while runStart < numTris:
+        material = triMaterials[runStart]
+        runEnd = runStart + 1
+        while runEnd < numTris and runEnd - runStart < SMD_BLOCK_TRIANGLES and triMaterials[runEnd] == material:
+            runEnd += 1
         
-    # Done!
-    return {"meshes": meshes, "verts": verts, "faces": tris, "materials": materials}
-
-
-# EXPORT
-
-def ExportSMDModel(filePath):
-    currentunit_state = cmds.currentUnit(query=True, linear=True)
-    currentangle_state = cmds.currentUnit(query=True, angle=True)
-    cmds.autoKeyframe(state=False)
-    cmds.currentUnit(linear="cm", angle="deg")
-
-    numSelectedObjects = len(cmds.ls(selection=True))
-    if numSelectedObjects == 0:
-        return "Error: No objects selected for export"
-
-    # Get data
-    joints = GetJointList()
-    if len(joints) > 128:
-        print "Warning: More than 128 joints have been selected. The model might not compile."
-
-    shapes = GetShapes(joints)
-    if type(shapes) == str:
-        return shapes
+        materialName = materialNames[material]
+        lines = []
+        append = lines.append
+        for t in range(runStart, runEnd):
+            append(materialName)
+            for corner in range(t*3, t*3+3):
+                vert = triVerts[corner]
+                n = corner*3
+                uv = corner*2
+                append(cornerTemplate % (positionStrings[vert], normals[n], normals[n+1], normals[n+2], uvs[uv], uvs[uv+1], weightStrings[vert]))
+        f.write(FinishSMDBlock("".join(lines)))
+        
+        runStart = runEnd
 
-    # Open file
-    f = None
+def OpenExportFile(filePath, mode='w'):
+    # Creates the export directory if needed and opens the file for writing
+    # Returns the file, or an error string
     try:
         # Create export directory if it doesn't exist
         directory = os.path.dirname(filePath)
@@ -619,68 +1677,1159 @@ def ExportSMDModel(filePath):
             os.makedirs(directory)
         
         # Create file
-        f = open(filePath, 'w')
+        return open(filePath, mode)
     except (IOError, OSError) as e:
         typex, value, traceback = sys.exc_info()
         return "Unable to create file:\n\n%s" % value.strerror
 
-    # Write header
-    f.write("// Exported with Source Maya Tools\n")
-    if cmds.file(query=True, exists=True):
-        f.write("// Scene: '%s'\n" % os.path.normpath(os.path.abspath(cmds.file(query=True, sceneName=True))).encode('ascii', 'ignore')) # Ignore Ascii characters using .encode()
+def WriteSMDModel(filePath, model):
+    # Writes a model extracted by ExportSMDModel, returns an error string on failure
+    # model["buffers"] is either a list of mesh buffers, or the IterShapes generator filling model["shapes"], in which case
+    # every mesh is extracted as it's written
+    # The triangles are streamed into a temporary file, which only replaces the real file once every mesh was written
+    tempFilePath = filePath + ".tmp"
+    f = OpenExportFile(tempFilePath)
+    if type(f) == str:
+        return f
+    
+    f.write(model["header"])
+    f.write(FormatSMDNodes(model["nodes"]))
+    
+    f.write("skeleton\n")
+    if len(model["nodes"]) == 0:
+        f.write("time 0\n")
+        f.write("0 0 0 0 0 0 0\n")
     else:
-        f.write("// Scene: Unsaved\n\n")
-    f.write("version 1\n")
+        samples = model["skeleton"]
+        rotations = GetSampleRotations([samples])[0]
+        f.write(FormatSMDSkeletonFrame(0, [GetJointSampleRow(sample, rotation) for sample, rotation in zip(samples, rotations)]))
+    f.write("end\n")
+    
+    f.write("triangles\n")
+    shapes = model["shapes"]
+    numVerts = 0
+    numTris = 0
+    error = None
+    for batch in model["buffers"]:
+        if type(batch) == str:
+            error = batch
+            break
+        WriteSMDTriangles(f, batch, shapes["materials"])
+        batchVerts, batchTris = GetMeshBufferCounts(batch)
+        numVerts += batchVerts
+        numTris += batchTris
+    f.write("end\n")
+    
+    f.close()
+    
+    if error == None:
+        error = GetShapesError(len(shapes["meshes"]), numVerts, numTris, len(shapes["materials"]))
+    if error != None:
+        os.remove(tempFilePath)
+        return error
+    
+    if os.path.exists(filePath):
+        os.remove(filePath)
+    os.rename(tempFilePath, filePath)
 
-    f.write("nodes\n")
-    if len(joints) == 0:
-        f.write("0 \"tag_origin\" -1\n")
-    else:
-        for i, joint in enumerate(joints):
-            name = joint[1].partialPathName().split("|")
-            name = name[len(name)-1].split(":") # Remove namespace prefixes
-            if REPLACE_FIRST_UNDERSCORE == True:
-                name = name[len(name)-1].replace('_', '.', 1)
+def WriteSMDAnim(filePath, anim):
+    # Writes an animation sampled by ExportSMDAnim, returns an error string on failure
+    f = OpenExportFile(filePath)
+    if type(f) == str:
+        return f
+    
+    f.write(anim["header"])
+    f.write(FormatSMDNodes(anim["nodes"]))
+    
+    f.write("skeleton\n")
+    
+    jointsToSubstract = anim["substract"]
+    frames = anim["frames"]
+    frameStart = anim["frameStart"]
+    lastRows = []
+    for chunkStart, samples in IterAnimSampleChunks(anim):
+        # Convert every rotation of the chunk in one batch
+        rotations = GetSampleRotations(samples, jointsToSubstract)
+        
+        rows = []
+        for frameSamples, frameRotations in zip(samples, rotations):
+            if jointsToSubstract != None:
+                rows.append([GetJointSampleRowSubstracted(sample, jointsToSubstract[j], frameRotations[j]) for j, sample in enumerate(frameSamples)])
             else:
-                name = name[len(name)-1]
-            f.write("%i \"%s\" %i\n" % (i, name, joint[0]))
+                rows.append([GetJointSampleRow(sample, rotation) for sample, rotation in zip(frameSamples, frameRotations)])
+        
+        # Sparse frames only list the joints that moved
+        if anim["sparse"] != None:
+            jointIndices = GetSparseJoints(rows, anim["sparse"][0], anim["sparse"][1], lastRows)
+        else:
+            jointIndices = [None] * len(rows)
+        
+        for i, frameRows, frameJoints in zip(frames[chunkStart:chunkStart+len(rows)], rows, jointIndices):
+            f.write(FormatSMDSkeletonFrame(i - frameStart, frameRows, frameJoints))
     f.write("end\n")
+    
+    f.close()
 
-    f.write("skeleton\n")
-    f.write("time 0\n")
-    if len(joints) == 0:
-        f.write("0 0 0 0 0 0 0\n")
+
+# DMX SERIALIZATION
+# Models can also be written as binary DMX (Source's Datamodel format, "binary 2" encoding, "model 18" format), which stores
+# every vertex once in indexed streams instead of repeating it for every triangle corner like SMD does.
+# An element is a dictionary with a type, a name, and a list of (attribute name, type ID, value) tuples. Element attributes
+# hold another element or None, and arrays of fixed size values (ints, floats, vectors...) are stored as flat lists
+
+def NewDMXElement(elementType, name):
+    return {"type": elementType, "name": name, "attributes": []}
+
+def AddDMXAttribute(element, name, attributeType, value):
+    # Adds an attribute to an element, returns the value so lists can be filled in afterwards
+    element["attributes"].append((name, attributeType, value))
+    return value
+
+def EncodeDMXValue(attributeType, value, elementIndices):
+    # Returns the binary encoding of an attribute value
+    if attributeType > DMX_ARRAY:
+        valueType = attributeType - DMX_ARRAY
+        if valueType == DMX_ELEMENT:
+            return struct.pack("<i%ii" % len(value), len(value), *[elementIndices[id(element)] for element in value])
+        if valueType == DMX_STRING:
+            return struct.pack("<i", len(value)) + "".join([string + "\0" for string in value])
+        if valueType == DMX_TIME:
+            value = [int(round(seconds * 10000)) for seconds in value]
+        code, components = DMX_VALUE_FORMATS[valueType]
+        return struct.pack("<i%i%s" % (len(value), code), len(value) / components, *value)
+    
+    if attributeType == DMX_ELEMENT:
+        return struct.pack("<i", value == None and -1 or elementIndices[id(value)])
+    if attributeType == DMX_STRING:
+        return value + "\0"
+    if attributeType == DMX_TIME:
+        value = int(round(value * 10000))
+    code, components = DMX_VALUE_FORMATS[attributeType]
+    if components == 1:
+        return struct.pack("<" + code, value)
+    return struct.pack("<%i%s" % (components, code), *value)
+
+def WriteDMXBinary(f, root, formatName, formatVersion):
+    # Writes every element reachable from root in the binary 2 encoding
+    # Collect the elements breadth first, the root has to be the first one
+    elements = [root]
+    elementIndices = {id(root): 0}
+    for element in elements:
+        for name, attributeType, value in element["attributes"]:
+            if attributeType == DMX_ELEMENT:
+                children = value != None and [value] or []
+            elif attributeType == DMX_ELEMENT + DMX_ARRAY:
+                children = value
+            else:
+                continue
+            for child in children:
+                if id(child) not in elementIndices:
+                    elementIndices[id(child)] = len(elements)
+                    elements.append(child)
+    
+    # Element types and attribute names are stored once in a string dictionary, element names and string values are inline
+    strings = []
+    stringIndices = {}
+    for element in elements:
+        for string in [element["type"]] + [attribute[0] for attribute in element["attributes"]]:
+            if string not in stringIndices:
+                stringIndices[string] = len(strings)
+                strings.append(string)
+    
+    f.write("<!-- dmx encoding binary 2 format %s %i -->\n\0" % (formatName, formatVersion))
+    f.write(struct.pack("<h", len(strings)))
+    f.write("".join([string + "\0" for string in strings]))
+    
+    # Element headers, with IDs derived from the element's place in the file so the same model always writes the same file
+    f.write(struct.pack("<i", len(elements)))
+    for i, element in enumerate(elements):
+        f.write(struct.pack("<h", stringIndices[element["type"]]))
+        f.write(element["name"] + "\0")
+        f.write(hashlib.md5("%i %s %s" % (i, element["type"], element["name"])).digest())
+    
+    # Element bodies
+    for element in elements:
+        attributes = element["attributes"]
+        f.write(struct.pack("<i", len(attributes)))
+        f.write("".join([struct.pack("<hb", stringIndices[name], attributeType) + EncodeDMXValue(attributeType, value, elementIndices) for name, attributeType, value in attributes]))
+
+def NewDMXTransform(name, position, orientation):
+    transform = NewDMXElement("DmeTransform", name)
+    AddDMXAttribute(transform, "position", DMX_VECTOR3, position)
+    AddDMXAttribute(transform, "orientation", DMX_QUATERNION, orientation)
+    return transform
+
+def NewDMXDag(elementType, name, transform, shape=None):
+    # Creates a DmeDag, DmeJoint or DmeModel, returns (element, children list)
+    dag = NewDMXElement(elementType, name)
+    AddDMXAttribute(dag, "transform", DMX_ELEMENT, transform)
+    AddDMXAttribute(dag, "shape", DMX_ELEMENT, shape)
+    AddDMXAttribute(dag, "visible", DMX_BOOL, True)
+    return (dag, AddDMXAttribute(dag, "children", DMX_ELEMENT + DMX_ARRAY, []))
+
+def GetDMXSkeleton(name, nodes, jointData):
+    # Builds the DmeModel holding the joint hierarchy, nodes being (joint name, parent index) tuples and jointData their
+    # (position, quaternion) in the parent's space, like GetJointSampleData results
+    # Returns (DmeModel, children list of the DmeModel, DmeTransform of each joint)
+    if len(nodes) == 0:
+        nodes = [("tag_origin", -1)]
+        jointData = [((0.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0))]
+    
+    model, modelChildren = NewDMXDag("DmeModel", name, NewDMXTransform(name, (0.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0)))
+    joints = []
+    jointChildren = []
+    transforms = []
+    for (jointName, parent), (position, orientation) in zip(nodes, jointData):
+        transforms.append(NewDMXTransform(jointName, position, orientation))
+        joint, children = NewDMXDag("DmeJoint", jointName, transforms[-1])
+        joints.append(joint)
+        jointChildren.append(children)
+    for joint, (jointName, parent) in zip(joints, nodes):
+        if parent >= 0:
+            jointChildren[parent].append(joint)
+        else:
+            modelChildren.append(joint)
+    
+    AddDMXAttribute(model, "jointList", DMX_ELEMENT + DMX_ARRAY, joints)
+    AddDMXAttribute(model, "jointTransforms", DMX_ELEMENT + DMX_ARRAY, transforms)
+    baseState = NewDMXElement("DmeTransformList", "base")
+    AddDMXAttribute(baseState, "transforms", DMX_ELEMENT + DMX_ARRAY, transforms)
+    AddDMXAttribute(model, "baseStates", DMX_ELEMENT + DMX_ARRAY, [baseState])
+    return (model, modelChildren, transforms)
+
+def GetDMXMesh(name, buffer, materialElements):
+    # Builds the DmeDag of a mesh buffer (see NewMeshBuffer)
+    # Every welded vertex (see WeldMeshBuffer) is one face vertex, and normals and UVs are each stored once
+    positions = buffer["positions"]
+    normals = buffer["normals"]
+    uvs = buffer["uvs"]
+    triVerts = buffer["triVerts"]
+    triMaterials = buffer["triMaterials"]
+    weld = GetMeshBufferWeld(buffer)
+    
+    normalValues = []
+    normalDict = {}
+    uvValues = []
+    uvDict = {}
+    positionIndices = []
+    normalIndices = []
+    uvIndices = []
+    for corner in weld["vertices"]:
+        normal = (normals[corner*3], normals[corner*3+1], normals[corner*3+2])
+        normalIndex = normalDict.get(normal)
+        if normalIndex == None:
+            normalIndex = normalDict[normal] = len(normalDict)
+            normalValues.extend(normal)
+        uv = (uvs[corner*2], uvs[corner*2+1])
+        uvIndex = uvDict.get(uv)
+        if uvIndex == None:
+            uvIndex = uvDict[uv] = len(uvDict)
+            uvValues.extend(uv)
+        positionIndices.append(triVerts[corner])
+        normalIndices.append(normalIndex)
+        uvIndices.append(uvIndex)
+    
+    faces = {} # Material index -> face vertices of its triangles, each triangle ending with -1
+    indices = weld["indices"]
+    for t, material in enumerate(triMaterials):
+        faces.setdefault(material, []).extend((indices[t*3], indices[t*3+1], indices[t*3+2], -1))
+    
+    # Skin weights are per position, padded to the largest number of weights on a vertex
+    weightOffsets = buffer["weightOffsets"]
+    weightJoints = buffer["weightJoints"]
+    weightValues = buffer["weightValues"]
+    numVerts = len(weightOffsets) - 1
+    jointCount = max([1] + [weightOffsets[v+1] - weightOffsets[v] for v in range(numVerts)])
+    blendWeights = []
+    blendIndices = []
+    for v in range(numVerts):
+        start = weightOffsets[v]
+        end = weightOffsets[v+1]
+        if end > start:
+            blendWeights.extend(weightValues[start:end])
+            blendIndices.extend(weightJoints[start:end])
+        else:
+            blendWeights.append(1.0)
+            blendIndices.append(0)
+            end = start + 1
+        blendWeights.extend([0.0] * (jointCount - (end - start)))
+        blendIndices.extend([0] * (jointCount - (end - start)))
+    
+    vertexData = NewDMXElement("DmeVertexData", "bind")
+    AddDMXAttribute(vertexData, "vertexFormat", DMX_STRING + DMX_ARRAY, ["position$0", "normal$0", "texcoord$0", "blendweights$0", "blendindices$0"])
+    AddDMXAttribute(vertexData, "jointCount", DMX_INT, jointCount)
+    AddDMXAttribute(vertexData, "flipVCoordinates", DMX_BOOL, True) # UVs are written as they are in Maya, same as in SMD files
+    AddDMXAttribute(vertexData, "position$0", DMX_VECTOR3 + DMX_ARRAY, [position*CM_TO_INCH for position in positions])
+    AddDMXAttribute(vertexData, "position$0Indices", DMX_INT + DMX_ARRAY, positionIndices)
+    AddDMXAttribute(vertexData, "normal$0", DMX_VECTOR3 + DMX_ARRAY, normalValues)
+    AddDMXAttribute(vertexData, "normal$0Indices", DMX_INT + DMX_ARRAY, normalIndices)
+    AddDMXAttribute(vertexData, "texcoord$0", DMX_VECTOR2 + DMX_ARRAY, uvValues)
+    AddDMXAttribute(vertexData, "texcoord$0Indices", DMX_INT + DMX_ARRAY, uvIndices)
+    AddDMXAttribute(vertexData, "blendweights$0", DMX_FLOAT + DMX_ARRAY, blendWeights)
+    AddDMXAttribute(vertexData, "blendindices$0", DMX_INT + DMX_ARRAY, blendIndices)
+    
+    faceSets = []
+    for material in sorted(faces.keys()):
+        faceSet = NewDMXElement("DmeFaceSet", materialElements[material]["name"])
+        AddDMXAttribute(faceSet, "material", DMX_ELEMENT, materialElements[material])
+        AddDMXAttribute(faceSet, "faces", DMX_INT + DMX_ARRAY, faces[material])
+        faceSets.append(faceSet)
+    
+    mesh = NewDMXElement("DmeMesh", name)
+    AddDMXAttribute(mesh, "visible", DMX_BOOL, True)
+    AddDMXAttribute(mesh, "bindState", DMX_ELEMENT, vertexData)
+    AddDMXAttribute(mesh, "currentState", DMX_ELEMENT, vertexData)
+    AddDMXAttribute(mesh, "baseStates", DMX_ELEMENT + DMX_ARRAY, [vertexData])
+    AddDMXAttribute(mesh, "deltaStates", DMX_ELEMENT + DMX_ARRAY, [])
+    AddDMXAttribute(mesh, "faceSets", DMX_ELEMENT + DMX_ARRAY, faceSets)
+    
+    return NewDMXDag("DmeDag", name, NewDMXTransform(name, (0.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0)), mesh)[0]
+
+def WriteDMXModel(filePath, model):
+    # Writes a model extracted by ExportSMDModel as a binary DMX file, returns an error string on failure
+    # Takes the same model as WriteSMDModel, every mesh becomes its own DmeMesh with one face set per material
+    name = os.path.splitext(os.path.basename(filePath))[0]
+    skeleton, modelChildren, transforms = GetDMXSkeleton(name, model["nodes"], [GetJointSampleData(sample) for sample in model["skeleton"]])
+    root = NewDMXElement("DmElement", "root")
+    AddDMXAttribute(root, "skeleton", DMX_ELEMENT, skeleton)
+    AddDMXAttribute(root, "model", DMX_ELEMENT, skeleton)
+    
+    shapes = model["shapes"]
+    materialElements = []
+    numVerts = 0
+    numTris = 0
+    for batch in model["buffers"]:
+        if type(batch) == str:
+            return batch
+        
+        # Materials are added to shapes["materials"] as the meshes are extracted
+        for material in shapes["materials"][len(materialElements):]:
+            materialElements.append(NewDMXElement("DmeMaterial", material[0].split(":")[-1]))
+            AddDMXAttribute(materialElements[-1], "mtlName", DMX_STRING, materialElements[-1]["name"])
+        
+        batchVerts, batchTris = GetMeshBufferCounts(batch)
+        if batchTris > 0:
+            modelChildren.append(GetDMXMesh(shapes["meshes"][batch["triShapes"][0]], batch, materialElements))
+        numVerts += batchVerts
+        numTris += batchTris
+    
+    error = GetShapesError(len(shapes["meshes"]), numVerts, numTris, len(shapes["materials"]))
+    if error != None:
+        return error
+    
+    return WriteDMXFile(filePath, root)
+
+def NewDMXChannel(name, transform, attribute, valueType, times, values):
+    # Creates a DmeChannel animating an attribute of a joint's DmeTransform, values being a flat list with one value per time
+    logType = valueType == DMX_QUATERNION and "DmeQuaternion" or "DmeVector3"
+    layer = NewDMXElement(logType + "LogLayer", name)
+    AddDMXAttribute(layer, "times", DMX_TIME + DMX_ARRAY, times)
+    AddDMXAttribute(layer, "curvetypes", DMX_INT + DMX_ARRAY, [])
+    AddDMXAttribute(layer, "values", valueType + DMX_ARRAY, values)
+    
+    log = NewDMXElement(logType + "Log", name)
+    AddDMXAttribute(log, "layers", DMX_ELEMENT + DMX_ARRAY, [layer])
+    AddDMXAttribute(log, "curveinfo", DMX_ELEMENT, None)
+    AddDMXAttribute(log, "usedefaultvalue", DMX_BOOL, False)
+    AddDMXAttribute(log, "defaultvalue", valueType, values[:DMX_VALUE_FORMATS[valueType][1]])
+    
+    channel = NewDMXElement("DmeChannel", name)
+    AddDMXAttribute(channel, "fromElement", DMX_ELEMENT, None)
+    AddDMXAttribute(channel, "fromAttribute", DMX_STRING, "")
+    AddDMXAttribute(channel, "fromIndex", DMX_INT, 0)
+    AddDMXAttribute(channel, "toElement", DMX_ELEMENT, transform)
+    AddDMXAttribute(channel, "toAttribute", DMX_STRING, attribute)
+    AddDMXAttribute(channel, "toIndex", DMX_INT, 0)
+    AddDMXAttribute(channel, "mode", DMX_INT, 3) # Play
+    AddDMXAttribute(channel, "log", DMX_ELEMENT, log)
+    return channel
+
+def IsDMXChannelConstant(values, components, epsilon):
+    # Returns whether every value of a flat channel list is within epsilon of the first one
+    for c in range(components):
+        first = values[c]
+        for value in itertools.islice(values, c, None, components):
+            if abs(value - first) > epsilon:
+                return False
+    return True
+
+def WriteDMXAnim(filePath, anim):
+    # Writes an animation sampled by ExportSMDAnim as a binary DMX file, returns an error string on failure
+    # Takes the same animation as WriteSMDAnim. Every joint gets a position and an orientation channel holding one key per
+    # frame, or a single key if the channel doesn't move over the whole animation
+    jointsToSubstract = anim["substract"]
+    numJoints = len(anim["nodes"])
+    positions = [array.array('f') for j in range(numJoints)] # XYZ in inches, 3 values per frame
+    orientations = [array.array('f') for j in range(numJoints)] # XYZW, 4 values per frame
+    lastQuats = None
+    for chunkStart, samples in IterAnimSampleChunks(anim):
+        quats = GetSampleQuats(samples, jointsToSubstract)
+        for i, frameSamples in enumerate(samples):
+            # Keep every joint's orientation on the same hemisphere as on the previous frame, so the keys interpolate the short way
+            frameQuats = quats[i*numJoints:(i+1)*numJoints]
+            if lastQuats != None:
+                frameQuats = BatchQuatAlign(lastQuats, frameQuats)
+            lastQuats = frameQuats
+            
+            for j, sample in enumerate(frameSamples):
+                pos, scale, matrix = sample
+                offset = (pos[0]*CM_TO_INCH * scale[0], pos[1]*CM_TO_INCH * scale[1], pos[2]*CM_TO_INCH * scale[2])
+                if jointsToSubstract != None:
+                    jointData = jointsToSubstract[j]
+                    offset = (offset[0]-jointData[0][0], offset[1]-jointData[0][1], offset[2]-jointData[0][2])
+                positions[j].extend(offset)
+                orientations[j].extend(frameQuats[j])
+    
+    # The skeleton is posed on the first frame
+    name = os.path.splitext(os.path.basename(filePath))[0]
+    if len(anim["frames"]) > 0:
+        jointData = [(positions[j][0:3], orientations[j][0:4]) for j in range(numJoints)]
     else:
-        for i, joint in enumerate(joints):
-            f.write("%i  " % (i))
-            WriteJointData(f, joint)
-    f.write("end\n")
+        jointData = [((0.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0))] * numJoints
+    skeleton, modelChildren, transforms = GetDMXSkeleton(name, anim["nodes"], jointData)
+    
+    frameRate = anim["frameRate"]
+    times = [(frame - anim["frameStart"]) / float(frameRate) for frame in anim["frames"]]
+    channels = []
+    for j, (jointName, parent) in enumerate(anim["nodes"]):
+        for attribute, valueType, values in (("position", DMX_VECTOR3, positions[j]), ("orientation", DMX_QUATERNION, orientations[j])):
+            components = DMX_VALUE_FORMATS[valueType][1]
+            if len(values) == 0:
+                continue
+            if IsDMXChannelConstant(values, components, DMX_CONSTANT_EPSILON):
+                channelTimes, values = times[:1], values[:components]
+            else:
+                channelTimes = times
+            channels.append(NewDMXChannel("%s_%s" % (jointName, attribute[0]), transforms[j], attribute, valueType, channelTimes, values))
+    
+    timeFrame = NewDMXElement("DmeTimeFrame", "timeframe")
+    AddDMXAttribute(timeFrame, "start", DMX_TIME, 0.0)
+    AddDMXAttribute(timeFrame, "duration", DMX_TIME, len(times) > 0 and times[-1] or 0.0)
+    AddDMXAttribute(timeFrame, "offset", DMX_TIME, 0.0)
+    AddDMXAttribute(timeFrame, "scale", DMX_FLOAT, 1.0)
+    
+    clip = NewDMXElement("DmeChannelsClip", name)
+    AddDMXAttribute(clip, "timeFrame", DMX_ELEMENT, timeFrame)
+    AddDMXAttribute(clip, "text", DMX_STRING, "")
+    AddDMXAttribute(clip, "mute", DMX_BOOL, False)
+    AddDMXAttribute(clip, "trackGroups", DMX_ELEMENT + DMX_ARRAY, [])
+    AddDMXAttribute(clip, "displayScale", DMX_FLOAT, 1.0)
+    AddDMXAttribute(clip, "channels", DMX_ELEMENT + DMX_ARRAY, channels)
+    AddDMXAttribute(clip, "frameRate", DMX_INT, int(round(frameRate)))
+    
+    animationList = NewDMXElement("DmeAnimationList", "animationList")
+    AddDMXAttribute(animationList, "animations", DMX_ELEMENT + DMX_ARRAY, [clip])
+    
+    root = NewDMXElement("DmElement", "root")
+    AddDMXAttribute(root, "skeleton", DMX_ELEMENT, skeleton)
+    AddDMXAttribute(root, "animationList", DMX_ELEMENT, animationList)
+    
+    return WriteDMXFile(filePath, root)
+
+def WriteDMXFile(filePath, root):
+    # Writes a model 18 DMX file through a temporary file, like WriteSMDModel, returns an error string on failure
+    tempFilePath = filePath + ".tmp"
+    f = OpenExportFile(tempFilePath, 'wb')
+    if type(f) == str:
+        return f
+    WriteDMXBinary(f, root, "model", 18)
+    f.close()
+    
+    if os.path.exists(filePath):
+        os.remove(filePath)
+    os.rename(tempFilePath, filePath)
 
-    f.write("triangles\n")
-    verts = shapes["verts"]
-    materials = shapes["materials"]
-    for j, face in enumerate(shapes["faces"]):
-        f.write("%s\n" % (materials[face[1]][0].split(":")[-1]))
-        for i in range(0, 3):
-            f.write("0 %f %f %f %f %f %f %f %f " % (
-                verts[face[2][i]][0].x*CM_TO_INCH, verts[face[2][i]][0].y*CM_TO_INCH, verts[face[2][i]][0].z*CM_TO_INCH,
-                face[5][i].x, face[5][i].y, face[5][i].z,
-                face[3][i][0], 1-face[3][i][1]
-                ))
-            f.write(" %i " % max(len(verts[face[2][i]][1]), 1))
-            if len(verts[face[2][i]][1]) > 0:
-                for bone in verts[face[2][i]][1]:
-                    f.write(" %i %f " % (bone[0], bone[1]))
+
+# EXPORT WORKERS
+# Scene extraction has to happen on Maya's main thread, but formatting and writing the files doesn't need Maya at all.
+# During multi export, every extracted file is handed to a pool of mayapy processes as plain data, so Maya can move on to the next slot
+
+def StartExportPool():
+    # Starts the worker pool if EXPORT_WORKERS asks for one and none is running
+    # Returns True if a pool was started (the caller should then call FinishExportPool)
+    global ExportPool
+    if ExportPool != None or IS_EXPORT_WORKER:
+        return False
+    
+    numWorkers = EXPORT_WORKERS
+    if numWorkers < 0:
+        numWorkers = multiprocessing.cpu_count()
+    if numWorkers == 0:
+        return False
+    
+    # Maya's own executable can't run the workers, so they use the mayapy interpreter next to it
+    mayapy = os.path.join(os.path.dirname(sys.executable), "mayapy.exe")
+    if os.path.exists(mayapy):
+        multiprocessing.set_executable(mayapy)
+    
+    # The workers import this script only for its writers; the flag keeps them from building the UI
+    environment = dict(os.environ)
+    os.environ["SOURCEMAYATOOLS_EXPORT_WORKER"] = "1"
+    os.environ["PYTHONPATH"] = os.pathsep.join([os.path.dirname(os.path.abspath(__file__))] + [path for path in [environment.get("PYTHONPATH")] if path])
+    try:
+        ExportPool = multiprocessing.Pool(numWorkers)
+        print "Started %i export workers" % numWorkers
+    except (OSError, IOError) as e:
+        print "Warning: Unable to start export workers, exporting on the main thread instead (%s)" % e
+        ExportPool = None
+    finally:
+        os.environ.clear()
+        os.environ.update(environment)
+    
+    return ExportPool != None
+
+def FinishExportPool():
+    # Waits for every file handed to the worker pool and shows the errors of the ones that failed
+    global ExportPool
+    if ExportPool == None:
+        return
+    
+    ExportPool.close()
+    errors = []
+    failedFiles = set()
+    finished = False
+    try:
+        for filePath, result in PendingExports:
+            response = result.get()
+            if type(response) == str or type(response) == unicode:
+                errors.append("%s\n\n%s" % (filePath, response))
+                failedFiles.add(filePath)
+        finished = True
+    finally:
+        # Always reset the pool, even if waiting for a worker was interrupted, so the next export starts clean
+        if not finished:
+            ExportPool.terminate()
+            failedFiles.update([filePath for filePath, result in PendingExports])
+        del PendingExports[:]
+        ExportPool.join()
+        ExportPool = None
+        
+        for filePath in PendingScratchFiles:
+            if os.path.exists(filePath):
+                os.remove(filePath)
+        del PendingScratchFiles[:]
+        
+        # Only remember the fingerprints of the slots that were actually written
+        for windowID, slotIndex, filePath, fingerprint in PendingFingerprints:
+            if filePath in failedFiles:
+                fingerprint = None
+            SaveSlotFingerprint(windowID, slotIndex, filePath, fingerprint)
+        del PendingFingerprints[:]
+    
+    for error in errors:
+        MessageBox(error)
+
+def GetOutputSettings():
+    # Returns the name and value of every setting that changes the exported files (see OUTPUT_SETTINGS)
+    return [(name, globals()[name]) for name in OUTPUT_SETTINGS]
+
+def RunExportWorker(writer, filePath, payload, settings):
+    # Runs a writer inside a worker process, with the output settings of the Maya session
+    globals().update(settings)
+    try:
+        return writer(filePath, payload)
+    except Exception as e:
+        return "An unhandled error occurred during export:\n\n" + traceback.format_exc()
+
+def SubmitExport(writer, filePath, payload):
+    # Writes an extracted file with the given writer, in the background if the worker pool is running
+    # Returns an error string if the file was written right away and failed
+    if ExportPool == None:
+        return writer(filePath, payload)
+    PendingExports.append((filePath, ExportPool.apply_async(RunExportWorker, (writer, filePath, payload, GetOutputSettings()))))
+    return None
+
+
+# INCREMENTAL EXPORT
+# Multi export fingerprints the scene data of each slot and skips the slot if neither the fingerprint nor the exported file changed
+# since it was last exported. The fingerprint is stored in the "fingerprints" attribute of the window's data storage node
+
+def UpdateFingerprintSettings(md5):
+    # Adds every setting that changes the exported files, including the script itself
+    md5.update(repr((GetOutputSettings(), os.path.getmtime(__file__))))
+
+def UpdateFingerprintJoints(md5, jointTable, samples):
+    # Adds the joint hierarchy and a list of joint sample blocks (see SampleJoints)
+    md5.update(repr([(joint["name"], joint["parent"]) for joint in jointTable]))
+    md5.update(repr(samples))
+
+def GetMeshChangeTick(shapeNode):
+    # Returns a number that changes whenever the points, topology, UVs, normals, colors, skin weights or face material
+    # assignments of a mesh change, so fingerprints don't have to read the mesh itself
+    # Every such change dirties the shape or connects/disconnects one of its plugs. Ticks only grow, so a mesh that's
+    # deleted and recreated under the same name never gets the tick of the old one
+    if len(MeshChangeCallbacks) == 0:
+        MeshChangeCallbacks.append(OpenMaya.MDGMessage.addConnectionCallback(MarkConnectedMeshesChanged))
+    
+    key = OpenMaya.MObjectHandle(shapeNode).hashCode()
+    entry = MeshChangeTicks.get(key)
+    if entry == None or not entry[0].isValid() or not entry[0].object() == shapeNode: # Hash codes aren't unique
+        entry = [OpenMaya.MObjectHandle(shapeNode), GetNextMeshChangeTick()]
+        MeshChangeTicks[key] = entry
+        MeshChangeCallbacks.append(OpenMaya.MNodeMessage.addNodeDirtyCallback(shapeNode, MarkMeshChanged))
+    return entry[1]
+
+def GetNextMeshChangeTick():
+    global LastMeshChangeTick
+    LastMeshChangeTick += 1
+    return LastMeshChangeTick
+
+def MarkMeshChanged(node, *args):
+    entry = MeshChangeTicks.get(OpenMaya.MObjectHandle(node).hashCode())
+    if entry != None and entry[0].isValid() and entry[0].object() == node:
+        entry[1] = GetNextMeshChangeTick()
+
+def MarkConnectedMeshesChanged(srcPlug, destPlug, *args):
+    MarkMeshChanged(srcPlug.node())
+    MarkMeshChanged(destPlug.node())
+
+def GetSMDModelFingerprint():
+    # Hashes everything ExportSMDModel reads from the scene: the selected joints and their current pose, and the
+    # change tick, world matrix and material names of the selected meshes
+    # Meshes aren't read (that would cost as much as exporting them), so every slot is exported again in a new Maya session
+    md5 = hashlib.md5()
+    UpdateFingerprintSettings(md5)
+    md5.update(GeneralWindow_GetFormat('smdmodel'))
+    md5.update(FINGERPRINT_SESSION)
+    
+    jointTable = GetSelectedJointTable()
+    UpdateFingerprintJoints(md5, jointTable, [GetJointSample(joint) for joint in jointTable])
+    
+    selectedObjects = OpenMaya.MSelectionList()
+    OpenMaya.MGlobal.getActiveSelectionList(selectedObjects)
+    meshPaths = set()
+    for i in range(selectedObjects.length()):
+        dagPath = OpenMaya.MDagPath()
+        selectedObjects.getDagPath(i, dagPath)
+        if not dagPath.hasFn(OpenMaya.MFn.kMesh):
+            continue
+        dagPath.extendToShape()
+        meshName = dagPath.partialPathName()
+        if meshName in meshPaths:
+            continue
+        meshPaths.add(meshName)
+        
+        mesh = OpenMaya.MFnMesh(dagPath)
+        matrix = dagPath.inclusiveMatrix()
+        md5.update(meshName)
+        md5.update(repr((GetMeshChangeTick(dagPath.node()), [matrix(r, c) for r in range(4) for c in range(4)], GetMeshShaderMaterials(mesh, dagPath)[0])))
+    
+    return md5.hexdigest()
+
+def GetSMDAnimFingerprint():
+    # Hashes everything ExportSMDAnim reads from the scene: the selected joints, the frame range and subtract settings,
+    # and the keys of every animation curve upstream of the joints
+    # Joints aren't sampled on every frame (that would cost as much as exporting), so the first, last and subtract frames
+    # are sampled as well to catch changes that aren't made on animation curves
+    md5 = hashlib.md5()
+    UpdateFingerprintSettings(md5)
+    
+    frameStart = cmds.intField(OBJECT_NAMES['smdanim'][0]+"_FrameStartField", query=True, value=True)
+    frameEnd = cmds.intField(OBJECT_NAMES['smdanim'][0]+"_FrameEndField", query=True, value=True)
+    substract = cmds.checkBox(OBJECT_NAMES['smdanim'][0]+("_SubstractCheckBox"), query=True, value=True)
+    substractFrame = cmds.intField(OBJECT_NAMES['smdanim'][0]+("_SubstractFrame"), query=True, value=True)
+    md5.update(repr((frameStart, frameEnd, substract, substractFrame, GeneralWindow_GetFormat('smdanim'), mel.eval("currentTimeUnitToFPS()"))))
+    
+    jointTable = GetSelectedJointTable()
+    UpdateFingerprintJoints(md5, jointTable, SampleJoints(jointTable, [frameStart, frameEnd, substractFrame]))
+    md5.update(GetAnimCurvesHash(jointTable))
+    
+    return md5.hexdigest()
+
+def GetAnimCurvesHash(jointTable):
+    # Hashes the keys, tangents and infinity modes of every animation curve upstream of the joints
+    # While an export is running (see StartSkeletonIndexCache) each set of joints is only hashed once, however many
+    # fingerprints, sample caches and scratch files need it
+    if AnimCurvesHashCache != None:
+        key = frozenset([joint["path"].fullPathName() for joint in jointTable])
+        if not key in AnimCurvesHashCache:
+            AnimCurvesHashCache[key] = HashAnimCurves(jointTable)
+        return AnimCurvesHashCache[key]
+    return HashAnimCurves(jointTable)
+
+def HashAnimCurves(jointTable):
+    md5 = hashlib.md5()
+    if len(jointTable) > 0:
+        history = cmds.listHistory([joint["path"].fullPathName() for joint in jointTable]) or []
+        for curve in sorted(set(cmds.ls(history, type="animCurve") or [])):
+            md5.update(curve)
+            md5.update(repr(cmds.keyframe(curve, query=True, timeChange=True, valueChange=True)))
+            md5.update(repr(cmds.keyTangent(curve, query=True, inAngle=True, outAngle=True, inWeight=True, outWeight=True)))
+            md5.update(repr(cmds.keyTangent(curve, query=True, inTangentType=True, outTangentType=True)))
+            md5.update(repr((cmds.getAttr(curve + ".preInfinity"), cmds.getAttr(curve + ".postInfinity"), cmds.getAttr(curve + ".weightedTangents"))))
+    return md5.hexdigest()
+
+def GetExportedFileStamp(filePath):
+    # Size and modification time of an exported file, or None if it doesn't exist
+    if not os.path.isfile(filePath):
+        return None
+    return "%i:%i" % (os.path.getsize(filePath), int(os.path.getmtime(filePath)))
+
+def IsSlotUnchanged(windowID, slotIndex, filePath, fingerprint):
+    stamp = GetExportedFileStamp(filePath)
+    if stamp == None:
+        return False
+    savedFingerprint = cmds.getAttr(OBJECT_NAMES[windowID][2]+(".fingerprints[%i]" % slotIndex))
+    return savedFingerprint == "%s:%s:%s" % (fingerprint, filePath, stamp)
+
+def SaveSlotFingerprint(windowID, slotIndex, filePath, fingerprint):
+    # Remembers the fingerprint a slot was exported with, along with the file it was exported to
+    stamp = GetExportedFileStamp(filePath)
+    if fingerprint == None or stamp == None:
+        savedFingerprint = ""
+    else:
+        savedFingerprint = "%s:%s:%s" % (fingerprint, filePath, stamp)
+    cmds.setAttr(OBJECT_NAMES[windowID][2]+(".fingerprints[%i]" % slotIndex), savedFingerprint, type='string')
+
+
+# SAMPLE CACHE
+# Sampled joint transforms are kept on disk, one file per scene, joint set and state of the animation curves driving them.
+# Each file holds whichever frames were sampled so far, so exporting a different range or subtract frame only samples the
+# frames that are missing. Files are stored as a small header followed by the frame numbers and raw doubles, in the order
+# the frames were added, and are memory mapped so only the frames an export needs are read
+
+def GetSampleCacheFolder():
+    folder = SAMPLE_CACHE_FOLDER
+    if folder == None or folder.strip() == "":
+        folder = os.path.join(cmds.internalVar(userTmpDir=True), "SourceMayaToolsSamples")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+def GetSampleCacheKey(jointTable):
+    md5 = hashlib.md5()
+    md5.update(repr(cmds.file(query=True, sceneName=True)))
+    md5.update(repr([joint["path"].fullPathName() for joint in jointTable]))
+    md5.update(GetAnimCurvesHash(jointTable))
+    return md5.hexdigest()
+
+def OpenSampleCache(filePath, numJoints):
+    # Memory maps a cache file, or returns None if the file is missing or unusable
+    # Only the frame numbers are read, the samples of a frame are read by offset when they're needed (see ReadSampleCacheFrames)
+    try:
+        f = open(filePath, 'rb')
+    except (IOError, OSError) as e:
+        return None
+    try:
+        fileMap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError) as e: # Empty files can't be mapped
+        f.close()
+        return None
+    
+    cache = {"file": f, "map": fileMap, "numJoints": numJoints}
+    try:
+        magic, version, fileJoints, numFrames = SAMPLE_CACHE_HEADER.unpack(fileMap[:SAMPLE_CACHE_HEADER.size])
+    except struct.error as e:
+        CloseSampleCache(cache)
+        return None
+    cache["valuesStart"] = SAMPLE_CACHE_HEADER.size + numFrames * 4
+    if magic != "SMTS" or version != 1 or fileJoints != numJoints or len(fileMap) < cache["valuesStart"] + numFrames * numJoints * SAMPLE_CACHE_VALUES * 8:
+        CloseSampleCache(cache)
+        return None
+    
+    frames = array.array('i')
+    frames.fromstring(fileMap[SAMPLE_CACHE_HEADER.size:cache["valuesStart"]])
+    cache["frames"] = dict([(frame, i) for i, frame in enumerate(frames)]) # Frame -> position in the file
+    return cache
+
+def ReadSampleCacheFrames(cache, frames):
+    # Returns the joint samples of each of the given frames, which must be in the open cache file
+    frameSize = cache["numJoints"] * SAMPLE_CACHE_VALUES * 8
+    jointIndices = range(cache["numJoints"])
+    frameSamples = []
+    for frame in frames:
+        start = cache["valuesStart"] + cache["frames"][frame] * frameSize
+        values = array.array('d')
+        values.fromstring(cache["map"][start:start + frameSize])
+        frameSamples.append(UnpackJointSamples(values, 0, jointIndices))
+    return frameSamples
+
+def CloseSampleCache(cache):
+    if cache != None:
+        cache["map"].close()
+        cache["file"].close()
+
+def PackJointSamples(values, frameSamples):
+    # Appends the joint samples of a frame to an array('d'), SAMPLE_CACHE_VALUES values per joint
+    for pos, scale, matrix in frameSamples:
+        values.extend(pos)
+        values.extend(scale)
+        values.extend(matrix)
+
+def UnpackJointSamples(values, firstJoint, jointIndices):
+    # Reads the given joints of a frame packed by PackJointSamples, firstJoint being the position of the frame's first joint in the array
+    frameSamples = []
+    for j in jointIndices:
+        offset = (firstJoint + j) * SAMPLE_CACHE_VALUES
+        frameSamples.append((tuple(values[offset:offset+3]), values[offset+3:offset+6].tolist(), values[offset+6:offset+22].tolist()))
+    return frameSamples
+
+def WriteSampleCache(filePath, numJoints, samples, cache=None):
+    # Writes a dictionary of {frame: joint samples} to a cache file, after every frame of an open cache file if one is given
+    # The frames of the open file are copied as they are, without unpacking them, and the open file is closed
+    frames = array.array('i', sorted(samples))
+    values = array.array('d')
+    for frame in frames:
+        PackJointSamples(values, samples[frame])
+    
+    oldFrames = array.array('i')
+    if cache != None:
+        oldFrames.fromstring(cache["map"][SAMPLE_CACHE_HEADER.size:cache["valuesStart"]])
+    
+    tempFilePath = filePath + ".tmp"
+    f = open(tempFilePath, 'wb')
+    try:
+        f.write(SAMPLE_CACHE_HEADER.pack("SMTS", 1, numJoints, len(oldFrames) + len(frames)))
+        oldFrames.tofile(f)
+        frames.tofile(f)
+        if cache != None:
+            cache["file"].seek(cache["valuesStart"])
+            shutil.copyfileobj(cache["file"], f)
+        values.tofile(f)
+    finally:
+        f.close()
+        CloseSampleCache(cache)
+    if os.path.exists(filePath):
+        os.remove(filePath)
+    os.rename(tempFilePath, filePath)
+
+def GetSpreadFrames(frames, count):
+    # Returns at most count of the given sorted frames, spread evenly from the first one to the last one
+    if len(frames) <= count:
+        return list(frames)
+    return [frames[i * (len(frames) - 1) / (count - 1)] for i in range(count)]
+
+def TrimSampleCache(folder):
+    # Removes the least recently used cache files until the cache fits in SAMPLE_CACHE_SIZE
+    files = []
+    for name in os.listdir(folder):
+        if name.endswith(".smc"):
+            filePath = os.path.join(folder, name)
+            files.append((os.path.getmtime(filePath), os.path.getsize(filePath), filePath))
+    files.sort()
+    
+    totalSize = sum([file[1] for file in files])
+    for modified, size, filePath in files:
+        if totalSize <= SAMPLE_CACHE_SIZE * 1024 * 1024:
+            break
+        os.remove(filePath)
+        totalSize -= size
+
+def SampleJointsCached(jointTable, frames):
+    # Same as SampleJoints, but only samples the frames that aren't in the sample cache yet
+    if SAMPLE_CACHE_SIZE <= 0 or len(jointTable) == 0 or len(frames) == 0:
+        return SampleJoints(jointTable, frames)
+    
+    try:
+        folder = GetSampleCacheFolder()
+        filePath = os.path.join(folder, GetSampleCacheKey(jointTable) + ".smc")
+    except (IOError, OSError) as e:
+        PrintWarning("Unable to use the sample cache: %s" % e)
+        return SampleJoints(jointTable, frames)
+    cache = OpenSampleCache(filePath, len(jointTable))
+    
+    try:
+        # Anything that isn't on an animation curve (constraint offsets, static values, ...) isn't part of the key,
+        # so a spread of the cached frames is sampled again to make sure the cache still matches the scene
+        samples = {}
+        newSamples = {} # Sampled frames that aren't in the cache file yet
+        numCachedFrames = 0
+        if cache != None and len(cache["frames"]) > 0:
+            cachedFrames = sorted(set([frame for frame in frames if frame in cache["frames"]]))
+            checkFrames = GetSpreadFrames(cachedFrames or sorted(cache["frames"]), SAMPLE_CACHE_CHECK_FRAMES)
+            checkSamples = SampleJoints(jointTable, checkFrames)
+            if ReadSampleCacheFrames(cache, checkFrames) == checkSamples:
+                samples.update(zip(cachedFrames, ReadSampleCacheFrames(cache, cachedFrames)))
+                numCachedFrames = len(cachedFrames)
             else:
-                f.write(" 0 1.000000 ")
-            f.write("\n")
-    f.write("end\n")
+                print "Sample cache is out of date, sampling every frame again"
+                CloseSampleCache(cache)
+                cache = None
+                newSamples.update(zip(checkFrames, checkSamples))
+            samples.update(zip(checkFrames, checkSamples))
+        
+        missingFrames = sorted(set([frame for frame in frames if not frame in samples]))
+        if len(missingFrames) > 0:
+            newSamples.update(zip(missingFrames, SampleJoints(jointTable, missingFrames)))
+            samples.update(newSamples)
+        print "Sample cache: %i of %i frames cached" % (numCachedFrames, len(set(frames)))
+        
+        try:
+            if len(newSamples) > 0:
+                WriteSampleCache(filePath, len(jointTable), newSamples, cache)
+                cache = None
+                TrimSampleCache(folder)
+            else:
+                os.utime(filePath, None) # Mark as recently used
+        except (IOError, OSError) as e:
+            PrintWarning("Unable to write the sample cache: %s" % e)
+    finally:
+        CloseSampleCache(cache)
+    
+    return [samples[frame] for frame in frames]
+
 
+# SAMPLE SCRATCH FILES
+# Very long animations (see ANIM_CHUNK_FRAMES) are sampled a chunk of frames at a time into a scratch file, which the
+# writers then read back a chunk at a time through a memory map, so memory use doesn't grow with the length of the animation.
+# The file header holds the number of finished frames and is updated after every chunk, so an export that was
+# interrupted picks up where it stopped
+
+def GetScratchFolder():
+    # Outside of Maya the system's temp folder is used instead
+    if cmds != None:
+        folder = os.path.join(cmds.internalVar(userTmpDir=True), "SourceMayaToolsScratch")
+    else:
+        folder = os.path.join(tempfile.gettempdir(), "SourceMayaToolsScratch")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+def SampleJointsToScratch(jointTable, frames, frameSamples=None):
+    # Samples the joints at each of the given frames into a scratch file, and returns the scratch description used by ReadSampleScratch
+    # If frameSamples is given (an iterator over the joint samples of each frame), it's used instead of sampling the scene
+    md5 = hashlib.md5()
+    md5.update(GetSampleCacheKey(jointTable))
+    md5.update(repr(frames))
+    filePath = os.path.join(GetScratchFolder(), md5.hexdigest() + ".sms")
+    numJoints = len(jointTable)
+    frameSize = numJoints * SAMPLE_CACHE_VALUES * 8
+    
+    # Resume an interrupted export, as long as the first frame still matches the scene
+    finishedFrames = 0
+    if os.path.exists(filePath) and os.path.getsize(filePath) >= SAMPLE_CACHE_HEADER.size:
+        f = open(filePath, 'rb')
+        magic, version, fileJoints, finishedFrames = SAMPLE_CACHE_HEADER.unpack(f.read(SAMPLE_CACHE_HEADER.size))
+        if magic != "SMTS" or version != 1 or fileJoints != numJoints or os.path.getsize(filePath) < SAMPLE_CACHE_HEADER.size + finishedFrames * frameSize:
+            finishedFrames = 0
+        elif finishedFrames > 0:
+            values = array.array('d')
+            values.fromfile(f, numJoints * SAMPLE_CACHE_VALUES)
+            if UnpackJointSamples(values, 0, range(numJoints)) != SampleJoints(jointTable, frames[:1])[0]:
+                finishedFrames = 0
+        f.close()
+    
+    if finishedFrames > 0:
+        print "Resuming sampling at frame %i of %i" % (finishedFrames, len(frames))
+        f = open(filePath, 'r+b')
+    else:
+        f = open(filePath, 'w+b')
+        f.write(SAMPLE_CACHE_HEADER.pack("SMTS", 1, numJoints, 0))
+    
+    if frameSamples != None:
+        frameSamples = itertools.islice(frameSamples, finishedFrames, None)
+    
+    try:
+        for start in range(finishedFrames, len(frames), ANIM_CHUNK_FRAMES):
+            chunkFrames = frames[start:start+ANIM_CHUNK_FRAMES]
+            if frameSamples != None:
+                chunkSamples = list(itertools.islice(frameSamples, len(chunkFrames)))
+            else:
+                chunkSamples = SampleJoints(jointTable, chunkFrames)
+            values = array.array('d')
+            for samples in chunkSamples:
+                PackJointSamples(values, samples)
+            f.seek(SAMPLE_CACHE_HEADER.size + start * frameSize)
+            values.tofile(f)
+            f.flush()
+            
+            # Checkpoint
+            f.seek(0)
+            f.write(SAMPLE_CACHE_HEADER.pack("SMTS", 1, numJoints, start + len(chunkFrames)))
+            f.flush()
+            os.fsync(f.fileno())
+            print "Sampled %i of %i frames" % (start + len(chunkFrames), len(frames))
+    finally:
+        f.close()
+    
+    return {"path": filePath, "numJoints": numJoints, "chunkFrames": ANIM_CHUNK_FRAMES}
+
+def ReadSampleScratch(scratch, firstFrame, numFrames, jointIndices):
+    # Returns the samples of the given joints for numFrames frames of a scratch file, starting at the frame index firstFrame
+    frameValues = scratch["numJoints"] * SAMPLE_CACHE_VALUES
+    f = open(scratch["path"], 'rb')
+    try:
+        fileMap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = SAMPLE_CACHE_HEADER.size + firstFrame * frameValues * 8
+            values = array.array('d')
+            values.fromstring(fileMap[start:start + numFrames * frameValues * 8])
+        finally:
+            fileMap.close()
+    finally:
+        f.close()
+    return [UnpackJointSamples(values, i * scratch["numJoints"], jointIndices) for i in range(numFrames)]
+
+def RemoveSampleScratch(scratch):
+    # Removes a scratch file once nothing reads it anymore
+    if ExportPool != None:
+        PendingScratchFiles.append(scratch["path"])
+    elif os.path.exists(scratch["path"]):
+        os.remove(scratch["path"])
+
+def IterAnimSampleChunks(anim):
+    # Yields (first frame index, samples) of an animation payload, one chunk of frames at a time if it was sampled to a scratch file
+    scratch = anim["scratch"]
+    if scratch == None:
+        yield 0, anim["samples"]
+        return
+    numFrames = len(anim["frames"])
+    for start in range(0, numFrames, scratch["chunkFrames"]):
+        yield start, ReadSampleScratch(scratch, scratch["firstFrame"] + start, min(scratch["chunkFrames"], numFrames - start), scratch["joints"])
+
+
+# SAMPLE SHARDS
+# Long animations can be sampled by several headless mayapy processes at once (see ANIM_SHARDS), each one opening the saved
+# scene and sampling a contiguous part of the frame range. Every shard is described by a JSON job file and writes its samples
+# to a file in the sample cache format, which the parent reads back in frame order.
+# Starting the processes and reading their output back are done by the launcher and merger functions given to
+# ExportSMDAnimClips, so they can be replaced (for example by a stand-in writing synthetic samples outside of Maya)
+
+def GetSavedSceneName():
+    # Returns the path of the open scene, or None if it was never saved or has unsaved changes
+    sceneName = cmds.file(query=True, sceneName=True)
+    if not sceneName or cmds.file(query=True, modified=True):
+        return None
+    return sceneName
+
+def SampleJointsSharded(jointTable, frames, sceneName, launcher=None):
+    # Samples the joints at each of the given frames in shard processes opening sceneName (see GetSavedSceneName), started by
+    # launcher(shard) (LaunchMayapyShard by default)
+    # Returns the finished shards, or None if the animation isn't sharded (or a shard failed), in which case it should be sampled inside Maya
+    if ANIM_SHARDS < 2 or len(frames) < max(ANIM_SHARD_MIN_FRAMES, 2) or len(jointTable) == 0:
+        return None
+    
+    if sceneName == None:
+        print "Warning: The scene isn't saved, so it can't be sampled by shard processes. Sampling inside Maya instead."
+        return None
+    if launcher == None:
+        launcher = LaunchMayapyShard
+    
+    # Split the frames into contiguous shards
+    numShards = min(ANIM_SHARDS, len(frames))
+    shardSize = (len(frames) + numShards - 1) / numShards
+    folder = GetScratchFolder()
+    jobName = hashlib.md5(repr((sceneName, frames[0], frames[-1], os.getpid(), time.time()))).hexdigest()
+    joints = [(joint["path"].fullPathName(), joint["parent"]) for joint in jointTable]
+    shards = []
+    for start in range(0, len(frames), shardSize):
+        shard = {
+            "index": len(shards),
+            "frames": frames[start:start+shardSize],
+            "job": os.path.join(folder, "%s_%i.json" % (jobName, len(shards))),
+            "output": os.path.join(folder, "%s_%i.smc" % (jobName, len(shards)))
+        }
+        f = open(shard["job"], 'w')
+        json.dump({"scene": sceneName, "joints": joints, "frames": shard["frames"], "output": shard["output"]}, f)
+        f.close()
+        shards.append(shard)
+    
+    print "Sampling %i frames in %i shard processes" % (len(frames), len(shards))
+    processes = []
+    for shard in shards:
+        try:
+            process = launcher(shard)
+        except (IOError, OSError) as e:
+            PrintWarning("Unable to start shard process %i: %s" % (shard["index"], e))
+            process = None
+        if process == None:
+            # Don't leave the shards that did start running on their own
+            for process in processes:
+                if hasattr(process, "kill"):
+                    try:
+                        process.kill()
+                    except OSError as e: # Already finished
+                        pass
+                process.wait()
+            PrintWarning("Shard processes couldn't be started, sampling inside Maya instead.")
+            RemoveSampleShards(shards)
+            return None
+        processes.append(process)
+    
+    # Make sure every shard wrote all of its frames before anything is merged
+    failed = []
+    for shard, process in zip(shards, processes):
+        result = process.wait()
+        numFrames = -1
+        try:
+            f = open(shard["output"], 'rb')
+            magic, version, numJoints, numFrames = SAMPLE_CACHE_HEADER.unpack(f.read(SAMPLE_CACHE_HEADER.size))
+            f.close()
+        except (IOError, OSError, struct.error) as e:
+            pass
+        if result != 0 or numFrames != len(shard["frames"]):
+            failed.append(str(shard["index"]))
+    
+    if len(failed) > 0:
+        PrintWarning("Shard processes %s failed, sampling inside Maya instead." % ", ".join(failed))
+        RemoveSampleShards(shards)
+        return None
+    
+    return shards
+
+def LaunchMayapyShard(shard):
+    # Default shard launcher: starts a headless mayapy process running RunSampleShard on the shard's job file
+    # Returns the process, or anything else with a wait() method returning 0 on success (and optionally a kill() method),
+    # or None if the process can't be started
+    mayapy = os.path.join(os.path.dirname(sys.executable), os.name == "nt" and "mayapy.exe" or "mayapy")
+    if not os.path.isfile(mayapy):
+        PrintWarning("mayapy wasn't found at %s" % mayapy)
+        return None
+    command = "import sys; sys.path.insert(0, %r); import SourceMayaTools; SourceMayaTools.RunSampleShard(%r)" % (os.path.dirname(os.path.abspath(__file__)), shard["job"])
+    environment = dict(os.environ)
+    environment["SOURCEMAYATOOLS_EXPORT_WORKER"] = "1" # Keeps the process from building the UI
+    return subprocess.Popen([mayapy, "-c", command], env=environment)
+
+def RunSampleShard(jobPath):
+    # Runs inside a shard process: opens the scene, samples the job's joints on its frames, and writes them to the job's output file
+    import maya.standalone
+    maya.standalone.initialize()
+    
+    f = open(jobPath, 'r')
+    job = json.load(f)
     f.close()
+    cmds.file(job["scene"], open=True, force=True)
+    
+    joints = []
+    for path, parent in job["joints"]:
+        selection = OpenMaya.MSelectionList()
+        selection.add(path)
+        dagPath = OpenMaya.MDagPath()
+        selection.getDagPath(0, dagPath)
+        joints.append((parent, OpenMaya.MFnDagNode(dagPath)))
+    jointTable = GetJointTable(joints)
+    
+    frames = job["frames"]
+    WriteSampleCache(job["output"], len(jointTable), dict(zip(frames, SampleJoints(jointTable, frames))))
+
+def IterSampleShards(shards, numJoints):
+    # Default shard merger: yields the joint samples of every frame, reading the shard outputs in order, one shard at a time
+    for shard in shards:
+        cache = OpenSampleCache(shard["output"], numJoints)
+        try:
+            for frame in shard["frames"]:
+                yield ReadSampleCacheFrames(cache, [frame])[0]
+        finally:
+            CloseSampleCache(cache)
+
+def RemoveSampleShards(shards):
+    for shard in shards:
+        for filePath in (shard["job"], shard["output"]):
+            if os.path.exists(filePath):
+                os.remove(filePath)
 
-    cmds.currentUnit(linear=currentunit_state, angle=currentangle_state)
 
-def ExportSMDAnim(filePath):
+# EXPORT
+
+def GetSMDHeader():
+    header = "// Exported with Source Maya Tools\n"
+    if cmds.file(query=True, exists=True):
+        header += "// Scene: '%s'\n" % os.path.normpath(os.path.abspath(cmds.file(query=True, sceneName=True))).encode('ascii', 'ignore') # Ignore Ascii characters using .encode()
+    else:
+        header += "// Scene: Unsaved\n\n"
+    return header + "version 1\n"
+
+def ExportSMDModel(filePath):
     currentunit_state = cmds.currentUnit(query=True, linear=True)
     currentangle_state = cmds.currentUnit(query=True, angle=True)
     cmds.autoKeyframe(state=False)
@@ -691,11 +2840,108 @@ def ExportSMDAnim(filePath):
         return "Error: No objects selected for export"
 
     # Get data
-    joints = GetJointList()
-    if len(joints) == 0:
+    jointTable = GetSelectedJointTable()
+
+    shapes = {"meshes": [], "materials": []}
+    model = {
+        "header": GetSMDHeader(),
+        "nodes": [(joint["name"], joint["parent"]) for joint in jointTable],
+        "skeleton": [GetJointSample(joint) for joint in jointTable],
+        "shapes": shapes,
+        "buffers": IterShapes(jointTable, shapes) # Stream the triangles one mesh at a time, so only a single mesh is held in memory
+    }
+
+    del MeshExtractionStats[:]
+    if ExportPool != None or (MAX_MESH_JOINTS > 0 and len(jointTable) > MAX_MESH_JOINTS) or len(LOD_RATIOS) > 0 or PRUNE_UNUSED_JOINTS:
+        # Extract every mesh now, so only plain data is handed to the worker, or so the triangles can be split and decimated
+        # and the joints pruned
+        buffers = []
+        for batch in model["buffers"]:
+            if type(batch) == str:
+                return batch
+            buffers.append(batch)
+        model["buffers"] = buffers
+    if PRUNE_UNUSED_JOINTS:
+        numPruned = PruneModelJoints(model)
+        if numPruned > 0:
+            print "Pruned %i unused joints, %i are left" % (numPruned, len(model["nodes"]))
+    
+    numJoints = len(model["nodes"])
+    if numJoints > 128 and (MAX_MESH_JOINTS <= 0 or MAX_MESH_JOINTS > 128):
+        print "Warning: More than 128 joints have been selected. The model might not compile."
+    splitMeshes = MAX_MESH_JOINTS > 0 and numJoints > MAX_MESH_JOINTS
+    writer = GeneralWindow_GetFormat('smdmodel') == "DMX" and WriteDMXModel or WriteSMDModel
+    error = SubmitSMDModel(writer, filePath, model, splitMeshes)
+    
+    for lod, ratio in enumerate(LOD_RATIOS):
+        startTime = time.clock()
+        lodModel = dict(model, buffers=[DecimateMeshBuffer(buffer, ratio) for buffer in model["buffers"]])
+        numTris = sum([GetMeshBufferCounts(buffer)[1] for buffer in model["buffers"]])
+        lodTris = sum([GetMeshBufferCounts(buffer)[1] for buffer in lodModel["buffers"]])
+        print "Decimated LOD %i: %i tris -> %i tris (%.0f%%) in %.3fs" % (lod+1, numTris, lodTris, lodTris * 100.0 / max(numTris, 1), time.clock() - startTime)
+        error = SubmitSMDModel(writer, GetLODFilePath(filePath, lod), lodModel, splitMeshes) or error
+
+    if len(MeshExtractionStats) > 0:
+        PrintMeshExtractionStats()
+
+    if error != None:
+        return error
+
+    cmds.currentUnit(linear=currentunit_state, angle=currentangle_state)
+
+def PrintMeshExtractionStats():
+    # Prints one summary of the meshes in MeshExtractionStats
+    totalTris = sum([stats["tris"] for stats in MeshExtractionStats])
+    totalTime = sum([stats["seconds"] for stats in MeshExtractionStats])
+    numCached = len([stats for stats in MeshExtractionStats if stats["cached"]])
+    print "Extracted %i meshes (%i from cache): %i verts, %i tris in %.3fs (%.0f tris/s)" % (len(MeshExtractionStats), numCached, sum([stats["verts"] for stats in MeshExtractionStats]), totalTris, totalTime, totalTris / max(totalTime, 0.000001))
+    if OPTIMIZE_TRIANGLE_ORDER:
+        # Averaged over every triangle, so large meshes weigh more
+        before = sum([stats["acmrBefore"] * stats["tris"] for stats in MeshExtractionStats]) / max(totalTris, 1)
+        after = sum([stats["acmrAfter"] * stats["tris"] for stats in MeshExtractionStats]) / max(totalTris, 1)
+        print "Reordered %i meshes: ACMR %.3f -> %.3f in %.3fs" % (len(MeshExtractionStats), before, after, sum([stats["reorderSeconds"] for stats in MeshExtractionStats]))
+    if REPORT_VERTEX_DUPLICATION:
+        totalWelded = sum([stats["weldedVerts"] for stats in MeshExtractionStats])
+        print "Welded %i corners into %i vertices (%.2f copies per vertex), %i degenerate tris" % (totalTris * 3, totalWelded, totalTris * 3.0 / max(totalWelded, 1), sum([stats["degenerateTris"] for stats in MeshExtractionStats]))
+
+def SubmitSMDModel(writer, filePath, model, splitMeshes):
+    # Writes an extracted model with SubmitExport, as several parts if its meshes have to be split (see MAX_MESH_JOINTS)
+    if not splitMeshes:
+        return SubmitExport(writer, filePath, model)
+    
+    # Each part only holds the joints its triangles are weighted to and their parents. Every triangle goes to a single part,
+    # but the vertices of triangles that went to different parts are written in each of them
+    partBuffers, oversized, sharedVerts = PartitionMeshBuffers(model["buffers"], MAX_MESH_JOINTS, model["nodes"])
+    parts = []
+    for buffers in partBuffers:
+        part = dict(model, buffers=buffers)
+        PruneModelJoints(part)
+        parts.append(part)
+    print "Split %i joints into %i parts of %s joints, %i vertices are used by triangles of more than one part" % (len(model["nodes"]), len(parts), ", ".join([str(len(part["nodes"])) for part in parts]), sharedVerts)
+    if oversized > 0:
+        PrintWarning("%i triangles use more than %i joints on their own, the part holding them might not compile." % (oversized, MAX_MESH_JOINTS))
+    error = None
+    for i, part in enumerate(parts):
+        error = SubmitExport(writer, GetPartFilePath(filePath, i), part) or error
+    return error
+
+def ExportSMDAnim(filePath):
+    clip = GetSMDAnimClip(filePath)
+    if type(clip) == str:
+        return clip
+    return ExportSMDAnimClips([clip])[0]
+
+def GetSMDAnimClip(filePath):
+    # Gathers everything needed to sample the selected joints for the current anim slot settings
+    # Returns a clip for ExportSMDAnimClips, or an error string
+    numSelectedObjects = len(cmds.ls(selection=True))
+    if numSelectedObjects == 0:
+        return "Error: No objects selected for export"
+
+    # Get data
+    jointTable = GetSelectedJointTable()
+    if len(jointTable) == 0:
         return "Error: No joints selected for export"
-    if len(joints) > 128:
-        print "Warning: More than 128 joints have been selected. The animation might not compile."
 
     frameStart = cmds.intField(OBJECT_NAMES['smdanim'][0]+"_FrameStartField", query=True, value=True)
     frameEnd = cmds.intField(OBJECT_NAMES['smdanim'][0]+"_FrameEndField", query=True, value=True)
@@ -703,64 +2949,148 @@ def ExportSMDAnim(filePath):
     substract = cmds.checkBox(OBJECT_NAMES['smdanim'][0]+("_SubstractCheckBox"), query=True, value=True)
     substractFrame = cmds.intField(OBJECT_NAMES['smdanim'][0]+("_SubstractFrame"), query=True, value=True)
 
-    # Open file
-    f = None
+    return {
+        "filePath": filePath,
+        "header": GetSMDHeader(),
+        "jointTable": jointTable,
+        "frameStart": frameStart,
+        "frames": range(int(frameStart), int(frameEnd+1)),
+        "frameRate": mel.eval("currentTimeUnitToFPS()"),
+        "substractFrame": substract == True and substractFrame or None,
+        "format": GeneralWindow_GetFormat('smdanim')
+    }
+
+def ExportSMDAnimClips(clips, shardLauncher=None, shardMerger=None):
+    # Samples and writes several clips (see GetSMDAnimClip), with one sweep of the timeline per distinct set of joints
+    # Clips selecting the same joints are sampled together (see ExportSMDAnimClipGroup), so a joint is only sampled on the
+    # frames of the clips that actually use it
+    # Long animations are sampled in shard processes started by shardLauncher and read back by shardMerger, see SampleJointsSharded
+    # Returns an error string or None for each clip
+    if shardMerger == None:
+        shardMerger = IterSampleShards
+    currentunit_state = cmds.currentUnit(query=True, linear=True)
+    currentangle_state = cmds.currentUnit(query=True, angle=True)
+    cmds.autoKeyframe(state=False)
+    cmds.currentUnit(linear="cm", angle="deg")
+    
+    groups = collections.OrderedDict() # Joint paths -> indices of the clips selecting them
+    for i, clip in enumerate(clips):
+        groups.setdefault(frozenset([joint["path"].fullPathName() for joint in clip["jointTable"]]), []).append(i)
+    
+    responses = [None] * len(clips)
     try:
-        # Create export directory if it doesn't exist
-        directory = os.path.dirname(filePath)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        
-        # Create file
-        f = open(filePath, 'w')
-    except (IOError, OSError) as e:
-        typex, value, traceback = sys.exc_info()
-        return "Unable to create file:\n\n%s" % value.strerror
-
-    # Write header
-    f.write("// Exported with Source Maya Tools\n")
-    if cmds.file(query=True, exists=True):
-        f.write("// Scene: '%s'\n" % os.path.normpath(os.path.abspath(cmds.file(query=True, sceneName=True))).encode('ascii', 'ignore')) # Ignore Ascii characters using .encode()
-    else:
-        f.write("// Scene: Unsaved\n\n")
-    f.write("version 1\n")
-
-    f.write("nodes\n")
-    if len(joints) == 0:
-        f.write("0 \"tag_origin\" -1\n")
+        for clipIndices in groups.values():
+            # A failing group fails all of its clips with the same error, but doesn't stop the other groups
+            try:
+                groupResponses = ExportSMDAnimClipGroup([clips[i] for i in clipIndices], shardLauncher, shardMerger)
+            except Exception as e:
+                groupResponses = ["An unhandled error occurred during export:\n\n" + traceback.format_exc()] * len(clipIndices)
+            for i, response in zip(clipIndices, groupResponses):
+                responses[i] = response
+    finally:
+        cmds.currentUnit(linear=currentunit_state, angle=currentangle_state)
+    
+    return responses
+
+def ExportSMDAnimClipGroup(clips, shardLauncher, shardMerger):
+    # Samples and writes clips in a single sweep of the timeline
+    # Every joint used by any clip is sampled once on every frame used by any clip, including the subtract frames,
+    # however many clips share that joint or frame
+    # Returns an error string or None for each clip
+
+    # Merge the joints of every clip into one table
+    joints = []
+    jointIndices = {}
+    clipJoints = []
+    for clip in clips:
+        indices = []
+        for joint in clip["jointTable"]:
+            path = joint["path"].fullPathName()
+            if not path in jointIndices:
+                jointIndices[path] = len(joints)
+                joints.append(joint)
+            indices.append(jointIndices[path])
+        clipJoints.append(indices)
+
+    frames = set()
+    for clip in clips:
+        frames.update(clip["frames"])
+        if clip["substractFrame"] != None:
+            frames.add(clip["substractFrame"])
+    frames = sorted(frames)
+    frameIndices = dict([(frame, i) for i, frame in enumerate(frames)])
+
+    # Sample every frame up front, without scrubbing the timeline
+    # Very long animations go to a scratch file instead of memory
+    # Long animations can be split between shard processes
+    samples = None
+    scratch = None
+    shards = SampleJointsSharded(joints, frames, GetSavedSceneName(), shardLauncher)
+    shardSamples = None
+    if shards != None:
+        shardSamples = shardMerger(shards, len(joints))
+    if ANIM_CHUNK_FRAMES > 0 and len(frames) > ANIM_CHUNK_FRAMES:
+        scratch = SampleJointsToScratch(joints, frames, shardSamples)
+    elif shardSamples != None:
+        samples = list(shardSamples)
     else:
-        for i, joint in enumerate(joints):
-            name = joint[1].partialPathName().split("|")
-            name = name[len(name)-1].split(":") # Remove namespace prefixes
-            name = name[len(name)-1].replace('_', '.', 1)
-            f.write("%i \"%s\" %i\n" % (i, name, joint[0]))
-    f.write("end\n")
-
-    f.write("skeleton\n")
-
-    cmds.currentTime(substractFrame)
-    jointsToSubstract = []
-    for i, joint in enumerate(joints):
-        jointsToSubstract.append(GetJointData(joint))
-
-
-    for i in range(int(frameStart), int(frameEnd+1)):
-        f.write("time %i\n" % (i - frameStart)) 
-        cmds.currentTime(i)
-        if len(joints) == 0:
-            f.write("0 0 0 0 0 0 0\n")
+        samples = SampleJointsCached(joints, frames)
+    if shards != None:
+        RemoveSampleShards(shards)
+
+    # Each clip gets its own rows out of the shared samples
+    # The frames of a clip are always next to each other in the shared samples, since they're a range
+    substractData = {} # (frame, joint index) -> GetJointSampleData
+    skinnedJoints = PRUNE_UNUSED_JOINTS and GetSkinnedJointPaths() or set()
+    responses = []
+    for clip, indices in zip(clips, clipJoints):
+        anim = {
+            "header": clip["header"],
+            "nodes": [(joint["name"], joint["parent"]) for joint in clip["jointTable"]],
+            "frameStart": clip["frameStart"],
+            "frames": clip["frames"],
+            "frameRate": clip["frameRate"],
+            "samples": None,
+            "scratch": None,
+            "substract": None,
+            "sparse": SPARSE_ANIM_FRAMES and (SPARSE_POSITION_EPSILON, SPARSE_ROTATION_EPSILON) or None
+        }
+        if scratch != None:
+            anim["scratch"] = dict(scratch, firstFrame=len(clip["frames"]) > 0 and frameIndices[clip["frames"][0]] or 0, joints=indices)
         else:
-            for j, joint in enumerate(joints):
-                f.write("%i  " % (j))
-                if(substract == True):
-                    WriteJointDataSubstracted(f, joint, jointsToSubstract[j])
-                else:
-                    WriteJointData(f, joint)
-    f.write("end\n")
-
-    f.close()
+            anim["samples"] = [[samples[frameIndices[frame]][j] for j in indices] for frame in clip["frames"]]
 
-    cmds.currentUnit(linear=currentunit_state, angle=currentangle_state)
+        substractFrame = clip["substractFrame"]
+        substractSamples = None
+        if substractFrame != None:
+            if scratch != None:
+                substractSamples = ReadSampleScratch(scratch, frameIndices[substractFrame], 1, indices)[0]
+            else:
+                substractSamples = [samples[frameIndices[substractFrame]][j] for j in indices]
+            for j, sample in zip(indices, substractSamples):
+                if not (substractFrame, j) in substractData:
+                    substractData[(substractFrame, j)] = GetJointSampleData(sample)
+            anim["substract"] = [substractData[(substractFrame, j)] for j in indices]
+        
+        if PRUNE_UNUSED_JOINTS and len(clip["frames"]) > 0:
+            # Joints are compared to the subtract frame if there's one, since a still joint posed differently than on that
+            # frame is still offset by the animation
+            referenceSamples = substractSamples
+            if referenceSamples == None:
+                referenceSamples = IterAnimSampleChunks(anim).next()[1][0]
+            usedJoints = GetAnimatedJoints(anim, referenceSamples)
+            usedJoints.update([j for j, joint in enumerate(clip["jointTable"]) if joint["path"].fullPathName() in skinnedJoints])
+            PruneAnimJoints(anim, usedJoints)
+        if len(anim["nodes"]) > 128:
+            print "Warning: More than 128 joints have been selected. The animation might not compile."
+
+        writer = clip["format"] == "DMX" and WriteDMXAnim or WriteSMDAnim
+        responses.append(SubmitExport(writer, clip["filePath"], anim))
+
+    if scratch != None:
+        RemoveSampleScratch(scratch)
+
+    return responses
 
 def GetRootFolder(firstTimePrompt=False, category="none"):
     SrcRootPath = ""
@@ -833,7 +3163,11 @@ def CreateSMDModelWindow():
     
     saveToLabel = cmds.text(label="Save to:", annotation="This is where the .xmodel_export is saved to")
     saveToField = cmds.textField(OBJECT_NAMES['smdmodel'][0]+"_SaveToField", height=21, changeCommand=lambda x:GeneralWindow_SaveToField('smdmodel'), annotation="This is where the .xmodel_export is saved to")
-    fileBrowserButton = cmds.button(label="...", height=21, command=lambda x:GeneralWindow_FileBrowser('smdmodel', "SMD File (*.smd)"), annotation="Open a file browser dialog")
+    fileBrowserButton = cmds.button(label="...", height=21, command=lambda x:GeneralWindow_FileBrowser('smdmodel', "SMD File (*.smd);;DMX File (*.dmx)"), annotation="Open a file browser dialog")
+    
+    formatDropDown = cmds.optionMenu(OBJECT_NAMES['smdmodel'][0]+"_FormatDropDown", changeCommand=lambda x:GeneralWindow_SaveFormat('smdmodel'), annotation="SMD is plain text, DMX is binary and stores every vertex once, which makes much smaller files")
+    for exportFormat in EXPORT_FORMATS:
+        cmds.menuItem(label=exportFormat)
     
     exportSelectedButton = cmds.button(label="Export Selected", command=lambda x:GeneralWindow_ExportSelected('smdmodel', False), annotation="Export all currently selected objects from the scene (current frame)\nWarning: Will automatically overwrite if the export path if it already exists")
     saveSelectionButton = cmds.button(label="Save Selection", command=lambda x:GeneralWindow_SaveSelection('smdmodel'), annotation="Save the current object selection")
@@ -859,7 +3193,8 @@ def CreateSMDModelWindow():
         
         attachControl=[ (separator1, 'top', 0, slotDropDown),
                         (saveToLabel, 'bottom', 9, exportSelectedButton),
-                        (saveToField, 'bottom', 5, exportSelectedButton), (saveToField, 'left', 5, saveToLabel), (saveToField, 'right', 5, fileBrowserButton),
+                        (saveToField, 'bottom', 5, exportSelectedButton), (saveToField, 'left', 5, saveToLabel), (saveToField, 'right', 5, formatDropDown),
+                        (formatDropDown, 'bottom', 5, exportSelectedButton), (formatDropDown, 'right', 5, fileBrowserButton),
                         (fileBrowserButton, 'bottom', 5, exportSelectedButton),
                         (exportSelectedButton, 'bottom', 5, separator2),
                         (saveSelectionButton, 'bottom', 5, separator2),
@@ -884,6 +3219,12 @@ def RefreshSMDModelWindow():
     if not cmds.attributeQuery("useinmultiexport", node=OBJECT_NAMES['smdmodel'][2], exists=True):
         cmds.addAttr(OBJECT_NAMES['smdmodel'][2], longName="useinmultiexport", multi=True, attributeType='bool', defaultValue=False)
         cmds.setAttr(OBJECT_NAMES['smdmodel'][2]+".useinmultiexport", size=EXPORT_WINDOW_NUMSLOTS)
+    if not cmds.attributeQuery("fingerprints", node=OBJECT_NAMES['smdmodel'][2], exists=True):
+        cmds.addAttr(OBJECT_NAMES['smdmodel'][2], longName="fingerprints", multi=True, dataType='string')
+        cmds.setAttr(OBJECT_NAMES['smdmodel'][2]+".fingerprints", size=EXPORT_WINDOW_NUMSLOTS)
+    if not cmds.attributeQuery("formats", node=OBJECT_NAMES['smdmodel'][2], exists=True):
+        cmds.addAttr(OBJECT_NAMES['smdmodel'][2], longName="formats", multi=True, attributeType='short', defaultValue=0)
+        cmds.setAttr(OBJECT_NAMES['smdmodel'][2]+".formats", size=EXPORT_WINDOW_NUMSLOTS)
         
     cmds.lockNode(OBJECT_NAMES['smdmodel'][2], lock=True)
     
@@ -895,6 +3236,9 @@ def RefreshSMDModelWindow():
 
     useInMultiExport = cmds.getAttr(OBJECT_NAMES['smdmodel'][2]+(".useinmultiexport[%i]" % slotIndex))
     cmds.checkBox(OBJECT_NAMES['smdmodel'][0]+"_UseInMultiExportCheckBox", edit=True, value=useInMultiExport)
+    
+    exportFormat = cmds.getAttr(OBJECT_NAMES['smdmodel'][2]+(".formats[%i]" % slotIndex))
+    cmds.optionMenu(OBJECT_NAMES['smdmodel'][0]+"_FormatDropDown", edit=True, select=exportFormat+1)
 
 
 # ------------------------------------------------------------------------------------------------------------------------------------------------------------------
@@ -927,7 +3271,10 @@ def CreateSMDAnimWindow():
 
     saveToLabel = cmds.text(label="Save to:", annotation="This is where .smd is saved to")
     saveToField = cmds.textField(OBJECT_NAMES['smdanim'][0]+"_SaveToField", height=21, changeCommand=lambda x:GeneralWindow_SaveToField('smdanim'), annotation="This is where .xanim_export is saved to")
-    fileBrowserButton = cmds.button(label="...", height=21, command=lambda x:GeneralWindow_FileBrowser('smdanim', "SMD File (*.smd)"), annotation="Open a file browser dialog")
+    fileBrowserButton = cmds.button(label="...", height=21, command=lambda x:GeneralWindow_FileBrowser('smdanim', "SMD File (*.smd);;DMX File (*.dmx)"), annotation="Open a file browser dialog")
+    formatDropDown = cmds.optionMenu(OBJECT_NAMES['smdanim'][0]+"_FormatDropDown", changeCommand=lambda x:GeneralWindow_SaveFormat('smdanim'), annotation="SMD is plain text, DMX is binary and stores each joint's position and orientation as one list of keys, which makes much smaller files")
+    for exportFormat in EXPORT_FORMATS:
+        cmds.menuItem(label=exportFormat)
     
     exportSelectedButton = cmds.button(label="Export Selected", command=lambda x:GeneralWindow_ExportSelected('smdanim', False), annotation="Export all currently selected joints from the scene (specified frames)\nWarning: Will automatically overwrite if the export path if it already exists")
     saveSelectionButton = cmds.button(label="Save Selection", command=lambda x:GeneralWindow_SaveSelection('smdanim'), annotation="Save the current object selection")
@@ -958,7 +3305,8 @@ def CreateSMDAnimWindow():
                         (substractCheckbox, 'bottom', 10, separator2), (substractFrameField, 'left', 10, substractCheckbox), (substractFrameField, 'bottom', 8, separator2),
                         (separator2, 'bottom', 5, fileBrowserButton),
                         (saveToLabel, 'bottom', 10, exportSelectedButton),
-                        (saveToField, 'bottom', 5, exportSelectedButton), (saveToField, 'left', 5, saveToLabel), (saveToField, 'right', 5, fileBrowserButton),
+                        (saveToField, 'bottom', 5, exportSelectedButton), (saveToField, 'left', 5, saveToLabel), (saveToField, 'right', 5, formatDropDown),
+                        (formatDropDown, 'bottom', 5, exportSelectedButton), (formatDropDown, 'right', 5, fileBrowserButton),
                         (fileBrowserButton, 'bottom', 5, exportSelectedButton),
                         (exportSelectedButton, 'bottom', 5, separator3),
                         (saveSelectionButton, 'bottom', 5, separator3),
@@ -1200,6 +3548,58 @@ def SMDAnimWindow_SelectNote():
             
         noteFrameField = cmds.intField(OBJECT_NAMES['smdanim'][0]+"_NoteFrameField", edit=True, value=frame)
         
+def SMDAnimWindow_ExportMultiple():
+    # Exports every anim slot set to multi export, with one sweep of the timeline for all the slots selecting the same joints
+    # (see ExportSMDAnimClips) instead of sampling each slot's frame range on its own
+    clips = []
+    for i in range(1, EXPORT_WINDOW_NUMSLOTS+1):
+        useInMultiExport = cmds.getAttr(OBJECT_NAMES['smdanim'][2]+(".useinmultiexport[%i]" % i))
+        if not useInMultiExport:
+            continue
+        
+        print "Exporting slot %i in multiexport" % i
+        cmds.optionMenu(OBJECT_NAMES['smdanim'][0]+"_SlotDropDown", edit=True, select=i)
+        RefreshSMDAnimWindow()
+        filePath = GeneralWindow_GetExportPath('smdanim', True)
+        if filePath == None or not GeneralWindow_GetSavedSelection('smdanim'):
+            continue
+        
+        fingerprint = None
+        try:
+            fingerprint = GeneralWindow_GetSlotFingerprint('smdanim', i, filePath)
+            if fingerprint == False:
+                continue
+            clip = GetSMDAnimClip(filePath)
+        except Exception as e:
+            clip = "An unhandled error occurred during export:\n\n" + traceback.format_exc()
+        if type(clip) == str:
+            GeneralWindow_FinishSlotExport('smdanim', i, filePath, fingerprint, clip)
+            continue
+        clip["slot"] = i
+        clip["fingerprint"] = fingerprint
+        clips.append(clip)
+    
+    if len(clips) == 0:
+        return
+    
+    try:
+        responses = ExportSMDAnimClips(clips)
+    except Exception as e:
+        responses = ["An unhandled error occurred during export:\n\n" + traceback.format_exc()] * len(clips)
+    
+    # Clips sampled together fail together, so each error is shown once with every slot it stopped
+    errors = collections.OrderedDict() # Error -> slot numbers
+    for clip, response in zip(clips, responses):
+        GeneralWindow_FinishSlotExport('smdanim', clip["slot"], clip["filePath"], clip["fingerprint"], response, False)
+        if type(response) == str or type(response) == unicode:
+            errors.setdefault(response, []).append(str(clip["slot"]))
+    
+    for error, slots in errors.items():
+        if len(slots) == 1:
+            MessageBox("Slot %s\n\n%s" % (slots[0], error))
+        else:
+            MessageBox("Slots %s\n\n%s" % (", ".join(slots), error))
+
 def RefreshSMDAnimWindow():
     # Refresh/create node
     if len(cmds.ls(OBJECT_NAMES['smdanim'][2])) == 0:
@@ -1221,6 +3621,9 @@ def RefreshSMDAnimWindow():
     if not cmds.attributeQuery("useinmultiexport", node=OBJECT_NAMES['smdanim'][2], exists=True):
         cmds.addAttr(OBJECT_NAMES['smdanim'][2], longName="useinmultiexport", multi=True, attributeType='bool', defaultValue=False)
         cmds.setAttr(OBJECT_NAMES['smdanim'][2]+".useinmultiexport", size=EXPORT_WINDOW_NUMSLOTS)
+    if not cmds.attributeQuery("fingerprints", node=OBJECT_NAMES['smdanim'][2], exists=True):
+        cmds.addAttr(OBJECT_NAMES['smdanim'][2], longName="fingerprints", multi=True, dataType='string')
+        cmds.setAttr(OBJECT_NAMES['smdanim'][2]+".fingerprints", size=EXPORT_WINDOW_NUMSLOTS)
 
     if not cmds.attributeQuery("substract", node=OBJECT_NAMES['smdanim'][2], exists=True):
         cmds.addAttr(OBJECT_NAMES['smdanim'][2], longName="substract", multi=True, attributeType='bool', defaultValue=False)
@@ -1228,6 +3631,9 @@ def RefreshSMDAnimWindow():
     if not cmds.attributeQuery("substractFrames", node=OBJECT_NAMES['smdanim'][2], exists=True):
         cmds.addAttr(OBJECT_NAMES['smdanim'][2], longName="substractFrames", multi=True, attributeType='long', defaultValue=0)
         cmds.setAttr(OBJECT_NAMES['smdanim'][2]+".substractFrames", size=EXPORT_WINDOW_NUMSLOTS)
+    if not cmds.attributeQuery("formats", node=OBJECT_NAMES['smdanim'][2], exists=True):
+        cmds.addAttr(OBJECT_NAMES['smdanim'][2], longName="formats", multi=True, attributeType='short', defaultValue=0)
+        cmds.setAttr(OBJECT_NAMES['smdanim'][2]+".formats", size=EXPORT_WINDOW_NUMSLOTS)
     
     cmds.lockNode(OBJECT_NAMES['smdanim'][2], lock=True)
     
@@ -1256,6 +3662,9 @@ def RefreshSMDAnimWindow():
     useInMultiExport = cmds.getAttr(OBJECT_NAMES['smdanim'][2]+(".useinmultiexport[%i]" % slotIndex))
     cmds.checkBox(OBJECT_NAMES['smdanim'][0]+"_UseInMultiExportCheckBox", edit=True, value=useInMultiExport)
     
+    exportFormat = cmds.getAttr(OBJECT_NAMES['smdanim'][2]+(".formats[%i]" % slotIndex))
+    cmds.optionMenu(OBJECT_NAMES['smdanim'][0]+"_FormatDropDown", edit=True, select=exportFormat+1)
+    
 
 # ------------------------------------------------------------------------------------------------------------------------------------------------------------------
 # --------------------------------------------------------------------------- General GUI --------------------------------------------------------------------------
@@ -1320,6 +3729,18 @@ def GeneralWindow_FileBrowser(windowID, formatExtension):
     cmds.textField(OBJECT_NAMES[windowID][0]+"_SaveToField", edit=True, fileName=saveTo)
     GeneralWindow_SaveToField(windowID)
 
+def GeneralWindow_SaveFormat(windowID):
+    slotIndex = cmds.optionMenu(OBJECT_NAMES[windowID][0]+"_SlotDropDown", query=True, select=True)
+    exportFormat = cmds.optionMenu(OBJECT_NAMES[windowID][0]+"_FormatDropDown", query=True, select=True)
+    cmds.setAttr(OBJECT_NAMES[windowID][2]+(".formats[%i]" % slotIndex), exportFormat-1)
+
+def GeneralWindow_GetFormat(windowID):
+    # Returns the file format (see EXPORT_FORMATS) of the current slot
+    exportFormat = cmds.optionMenu(OBJECT_NAMES[windowID][0]+"_FormatDropDown", query=True, select=True)
+    if exportFormat == None or exportFormat < 1 or exportFormat > len(EXPORT_FORMATS):
+        return EXPORT_FORMATS[0]
+    return EXPORT_FORMATS[exportFormat-1]
+
 def GeneralWindow_SaveSelection(windowID):
     slotIndex = cmds.optionMenu(OBJECT_NAMES[windowID][0]+"_SlotDropDown", query=True, select=True)
     selection = cmds.ls(selection=True)
@@ -1346,25 +3767,56 @@ def GeneralWindow_GetSavedSelection(windowID):
     cmds.select(validSelection)
     return True
 
-def GeneralWindow_ExportSelected(windowID, exportingMultiple):
-    global WarningsDuringExport
-    
+def GeneralWindow_GetExportPath(windowID, exportingMultiple):
+    # Returns the path of the current slot, or None (after telling the user) if it's invalid
     slotIndex = cmds.optionMenu(OBJECT_NAMES[windowID][0]+"_SlotDropDown", query=True, select=True)
     
-    # Get path
     filePath = cmds.textField(OBJECT_NAMES[windowID][0]+"_SaveToField", query=True, fileName=True)
     if filePath.strip() == "":
         if exportingMultiple:
             MessageBox("Invalid path on slot %i:\n\nPath is empty." % slotIndex)
         else:
             MessageBox("Invalid path:\n\nPath is empty.")
-        return
+        return None
         
     if os.path.isdir(filePath):
         if exportingMultiple:
             MessageBox("Invalid path on slot %i:\n\nPath points to an existing directory." % slotIndex)
         else:
             MessageBox("Invalid path:\n\nPath points to an existing directory.")
+        return None
+    
+    return filePath
+
+def GeneralWindow_GetSlotFingerprint(windowID, slotIndex, filePath):
+    # Returns the fingerprint of the current slot (None if SKIP_UNCHANGED_SLOTS is off), or False if the slot hasn't changed since it was last exported
+    fingerprint = None
+    if SKIP_UNCHANGED_SLOTS:
+        exec("fingerprint = %s()" % OBJECT_NAMES[windowID][5])
+        if IsSlotUnchanged(windowID, slotIndex, filePath, fingerprint):
+            print "Skipping unchanged slot %i" % slotIndex
+            return False
+    return fingerprint
+
+def GeneralWindow_FinishSlotExport(windowID, slotIndex, filePath, fingerprint, response, showError=True):
+    # Handles the response of a slot exported during multi export
+    failed = type(response) == str or type(response) == unicode
+    if ExportPool != None and not failed:
+        PendingFingerprints.append((windowID, slotIndex, filePath, fingerprint))
+    else:
+        SaveSlotFingerprint(windowID, slotIndex, filePath, not failed and fingerprint or None)
+    
+    if failed and showError:
+        MessageBox("Slot %i\n\n%s" % (slotIndex, response))
+
+def GeneralWindow_ExportSelected(windowID, exportingMultiple):
+    global WarningsDuringExport
+    
+    slotIndex = cmds.optionMenu(OBJECT_NAMES[windowID][0]+"_SlotDropDown", query=True, select=True)
+    
+    # Get path
+    filePath = GeneralWindow_GetExportPath(windowID, exportingMultiple)
+    if filePath == None:
         return
         
     # Save reminder
@@ -1380,26 +3832,30 @@ def GeneralWindow_ExportSelected(windowID, exportingMultiple):
     cmds.showWindow(progressWindow)
     cmds.refresh() # Force the progress bar to be drawn
     
-    # Export
+    # Export, skipping slots that haven't changed since they were last exported
     if not exportingMultiple:
         WarningsDuringExport = 0
+    fingerprint = None
     response = None
     try:
-        exec("response = %s(\"%s\")" % (OBJECT_NAMES[windowID][4], filePath))
+        if exportingMultiple:
+            fingerprint = GeneralWindow_GetSlotFingerprint(windowID, slotIndex, filePath)
+        if not fingerprint == False:
+            exec("response = %s(\"%s\")" % (OBJECT_NAMES[windowID][4], filePath))
     except Exception as e:
         response = "An unhandled error occurred during export:\n\n" + traceback.format_exc()
     
     # Delete progress bar
     cmds.deleteUI(progressWindow, window=True)
+    if fingerprint == False:
+        return
     
     # Handle response
-    
-    if type(response) == str or type(response) == unicode:
-        if exportingMultiple:
-            MessageBox("Slot %i\n\n%s" % (slotIndex, response))
-        else:
-            MessageBox(response)
-    elif WarningsDuringExport > 0 and not exportingMultiple:
+    if exportingMultiple:
+        GeneralWindow_FinishSlotExport(windowID, slotIndex, filePath, fingerprint, response)
+    elif type(response) == str or type(response) == unicode:
+        MessageBox(response)
+    elif WarningsDuringExport > 0:
         MessageBox("Warnings occurred during export. Check the script editor output for more details.")
 
 def GeneralWindow_ExportMultiple(windowID):
@@ -1421,14 +3877,26 @@ def GeneralWindow_ExportMultiple(windowID):
     WarningsDuringExport = 0
     originalSelection = cmds.ls(selection=True)
     
-    for i in range(1, EXPORT_WINDOW_NUMSLOTS+1):
-        useInMultiExport = cmds.getAttr(OBJECT_NAMES[windowID][2]+(".useinmultiexport[%i]" % i))
-        if useInMultiExport:
-            print "Exporting slot %i in multiexport" % i
-            cmds.optionMenu(OBJECT_NAMES[windowID][0]+"_SlotDropDown", edit=True, select=i)
-            exec(OBJECT_NAMES[windowID][3] + "()") # Refresh window
-            if GeneralWindow_GetSavedSelection(windowID):
-                GeneralWindow_ExportSelected(windowID, True)
+    # Files are written in the background while the next slot is extracted, if EXPORT_WORKERS is set
+    startedPool = StartExportPool()
+    startedSkeletonCache = StartSkeletonIndexCache()
+    try:
+        if windowID == 'smdanim':
+            SMDAnimWindow_ExportMultiple()
+        else:
+            for i in range(1, EXPORT_WINDOW_NUMSLOTS+1):
+                useInMultiExport = cmds.getAttr(OBJECT_NAMES[windowID][2]+(".useinmultiexport[%i]" % i))
+                if useInMultiExport:
+                    print "Exporting slot %i in multiexport" % i
+                    cmds.optionMenu(OBJECT_NAMES[windowID][0]+"_SlotDropDown", edit=True, select=i)
+                    exec(OBJECT_NAMES[windowID][3] + "()") # Refresh window
+                    if GeneralWindow_GetSavedSelection(windowID):
+                        GeneralWindow_ExportSelected(windowID, True)
+    finally:
+        if startedSkeletonCache:
+            FinishSkeletonIndexCache()
+        if startedPool:
+            FinishExportPool()
     
     if originalSelection == None or len(originalSelection) == 0:
         cmds.select(clear=True)
@@ -1448,8 +3916,18 @@ def GeneralWindow_ExportInMultiExport(windowID):
     cmds.setAttr(OBJECT_NAMES[windowID][2]+(".useinmultiexport[%i]" % slotIndex), useInMultiExport)
 
 def ExportAll():
-    GeneralWindow_ExportMultiple('smdmodel')
-    GeneralWindow_ExportMultiple('smdanim')
+    # Both windows share one worker pool, so the animations are extracted while the models are still being written,
+    # and the joint tables of their selections
+    startedPool = StartExportPool()
+    startedSkeletonCache = StartSkeletonIndexCache()
+    try:
+        GeneralWindow_ExportMultiple('smdmodel')
+        GeneralWindow_ExportMultiple('smdanim')
+    finally:
+        if startedSkeletonCache:
+            FinishSkeletonIndexCache()
+        if startedPool:
+            FinishExportPool()
 
 # ------------------------------------------------------------------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------ Init ------------------------------------------------------------------------------
@@ -1477,6 +3955,7 @@ def CreateMenu():
     # Tools Info
     cmds.menuItem(label="About", command=lambda x:AboutWindow())
 
-CreateMenu()
-CreateSMDModelWindow()
-CreateSMDAnimWindow()
+if cmds != None and not IS_EXPORT_WORKER:
+    CreateMenu()
+    CreateSMDModelWindow()
+    CreateSMDAnimWindow()
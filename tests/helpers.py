@@ -0,0 +1,52 @@
+# Shared setup for the tests: makes the script importable and builds mesh buffers without Maya
+import array
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SourceMayaTools
+
+
+def MakeGridBuffer(size, height=None, jointForVertex=None, material=0):
+    # Returns a mesh buffer (see NewMeshBuffer) of a size x size vertex grid on the XY plane, 2 triangles per cell
+    # height(x, y) gives the Z of each vertex, jointForVertex(x, y) the single joint each vertex is fully weighted to
+    buffer = SourceMayaTools.NewMeshBuffer()
+    for y in range(size):
+        for x in range(size):
+            z = 0.0
+            if height != None:
+                z = height(x, y)
+            buffer["positions"].extend((float(x), float(y), z))
+            if jointForVertex != None:
+                buffer["weightJoints"].append(jointForVertex(x, y))
+                buffer["weightValues"].append(1.0)
+            buffer["weightOffsets"].append(len(buffer["weightJoints"]))
+    for y in range(size - 1):
+        for x in range(size - 1):
+            v = y * size + x
+            for triangle in ((v, v + 1, v + size), (v + 1, v + size + 1, v + size)):
+                AddTriangle(buffer, triangle, material)
+    return buffer
+
+def AddTriangle(buffer, triangle, material=0, shape=0):
+    # Adds a triangle with planar UVs taken from the vertex positions, an up normal and a white color on every corner
+    positions = buffer["positions"]
+    buffer["triShapes"].append(shape)
+    buffer["triMaterials"].append(material)
+    buffer["triVerts"].extend(triangle)
+    for vert in triangle:
+        buffer["uvs"].extend((positions[vert*3] * 0.1, positions[vert*3+1] * 0.1))
+        buffer["normals"].extend((0.0, 0.0, 1.0))
+        buffer["colors"].extend((1.0, 1.0, 1.0, 1.0))
+
+def GetTriangles(buffer):
+    # Returns the set of triangles of a buffer as sorted tuples of rounded corner positions, to compare buffers whose
+    # vertices were reindexed
+    positions = buffer["positions"]
+    triVerts = buffer["triVerts"]
+    triangles = set()
+    for t in range(len(buffer["triMaterials"])):
+        corners = [tuple([round(positions[triVerts[t*3+k]*3+i], 6) for i in range(3)]) for k in range(3)]
+        triangles.add(tuple(sorted(corners)))
+    return triangles
@@ -0,0 +1,61 @@
+# Checks the quadric error mesh decimation used for LOD models
+import unittest
+
+import helpers
+from helpers import SourceMayaTools
+
+
+def GetSignedArea(buffer):
+    # Returns the area of the triangles projected on the XY plane, counting flipped triangles as negative
+    positions = buffer["positions"]
+    triVerts = buffer["triVerts"]
+    area = 0.0
+    for t in range(len(triVerts) / 3):
+        a, b, c = [triVerts[t*3+k] * 3 for k in range(3)]
+        area += ((positions[b] - positions[a]) * (positions[c+1] - positions[a+1]) - (positions[c] - positions[a]) * (positions[b+1] - positions[a+1])) / 2.0
+    return area
+
+
+class DecimateMeshBufferTest(unittest.TestCase):
+    def test_flat_grid_keeps_its_outline(self):
+        buffer = helpers.MakeGridBuffer(20)
+        decimated = SourceMayaTools.DecimateMeshBuffer(buffer, 0.25)
+        numTris = len(decimated["triMaterials"])
+        self.assertTrue(0 < numTris <= len(buffer["triMaterials"]) / 2)
+        # Border vertices are locked, and no triangle folds over another
+        self.assertAlmostEqual(GetSignedArea(decimated), GetSignedArea(buffer))
+        for t in range(numTris):
+            self.assertTrue(GetSignedArea(SourceMayaTools.SliceMeshBufferTriangles(decimated, [t])) > 0)
+
+        # Unused vertices are dropped
+        self.assertEqual(len(set(decimated["triVerts"])), len(decimated["positions"]) / 3)
+        self.assertEqual(len(decimated["weightOffsets"]), len(decimated["positions"]) / 3 + 1)
+
+    def test_full_ratio_keeps_every_triangle(self):
+        buffer = helpers.MakeGridBuffer(10)
+        decimated = SourceMayaTools.DecimateMeshBuffer(buffer, 1.0)
+        self.assertEqual(helpers.GetTriangles(decimated), helpers.GetTriangles(buffer))
+
+    def test_vertices_only_collapse_onto_the_same_joint(self):
+        # Every neighbour of a vertex is weighted to another joint
+        buffer = helpers.MakeGridBuffer(10, jointForVertex=lambda x, y: (x + 2 * y) % 3)
+        decimated = SourceMayaTools.DecimateMeshBuffer(buffer, 0.25)
+        self.assertEqual(helpers.GetTriangles(decimated), helpers.GetTriangles(buffer))
+
+    def test_material_borders_are_kept(self):
+        buffer = helpers.MakeGridBuffer(20)
+        for t in range(len(buffer["triMaterials"])):
+            if buffer["positions"][buffer["triVerts"][t*3]*3] >= 10: # Right half
+                buffer["triMaterials"][t] = 1
+        decimated = SourceMayaTools.DecimateMeshBuffer(buffer, 0.25)
+        self.assertTrue(len(decimated["triMaterials"]) < len(buffer["triMaterials"]) / 2)
+        for material in (0, 1):
+            areas = []
+            for mesh in (buffer, decimated):
+                tris = [t for t in range(len(mesh["triMaterials"])) if mesh["triMaterials"][t] == material]
+                areas.append(GetSignedArea(SourceMayaTools.SliceMeshBufferTriangles(mesh, tris)))
+            self.assertAlmostEqual(areas[0], areas[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# Checks how files are handed to and collected from the export worker pool, using stand-in pools
+import unittest
+
+import helpers
+from helpers import SourceMayaTools
+
+
+class FailingResult(object):
+    def get(self):
+        raise KeyboardInterrupt()
+
+
+class FinishedResult(object):
+    def __init__(self, response):
+        self.response = response
+
+    def get(self):
+        return self.response
+
+
+class RecordingPool(object):
+    def __init__(self):
+        self.calls = []
+
+    def close(self):
+        self.calls.append("close")
+
+    def terminate(self):
+        self.calls.append("terminate")
+
+    def join(self):
+        self.calls.append("join")
+
+
+class ExportPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.originalSettings = SourceMayaTools.GetOutputSettings()
+
+    def tearDown(self):
+        SourceMayaTools.RunExportWorker(lambda filePath, payload: None, None, None, self.originalSettings)
+        SourceMayaTools.ExportPool = None
+        del SourceMayaTools.PendingExports[:]
+
+    def test_worker_receives_every_output_setting(self):
+        settings = dict(SourceMayaTools.GetOutputSettings())
+        settings["FLOAT_PRECISION"] = 3
+        settings["DMX_CONSTANT_EPSILON"] = 0.5
+        settings["WELD_PRECISION"] = 2
+        writer = lambda filePath, payload: [(name, getattr(SourceMayaTools, name)) for name in payload]
+        response = SourceMayaTools.RunExportWorker(writer, "file.smd", ["FLOAT_PRECISION", "DMX_CONSTANT_EPSILON", "WELD_PRECISION"], settings.items())
+        self.assertEqual(response, [("FLOAT_PRECISION", 3), ("DMX_CONSTANT_EPSILON", 0.5), ("WELD_PRECISION", 2)])
+
+    def test_output_settings_exist(self):
+        for name, value in SourceMayaTools.GetOutputSettings():
+            self.assertTrue(name.isupper())
+
+    def test_pool_is_reset_when_waiting_fails(self):
+        pool = RecordingPool()
+        SourceMayaTools.ExportPool = pool
+        SourceMayaTools.PendingExports.extend([("a.smd", FinishedResult(None)), ("b.smd", FailingResult())])
+        self.assertRaises(KeyboardInterrupt, SourceMayaTools.FinishExportPool)
+        self.assertEqual(pool.calls, ["close", "terminate", "join"])
+        self.assertEqual(SourceMayaTools.ExportPool, None)
+        self.assertEqual(SourceMayaTools.PendingExports, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+# Checks which mesh data decides whether copies of a mesh share one buffer
+import array
+import unittest
+
+from helpers import SourceMayaTools
+
+
+def MakeQuadData(color):
+    # Returns GetMeshBulkData-style data of a single quad with every face-vertex in one color
+    return {
+        "points": array.array('d', [0, 0, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0]),
+        "polyVertCounts": [4],
+        "polyVerts": [0, 1, 2, 3],
+        "triCounts": [2],
+        "triVerts": [0, 1, 2, 0, 2, 3],
+        "normals": array.array('d', [0, 0, 1]),
+        "normalIds": [0, 0, 0, 0],
+        "Us": [0.0, 1.0, 1.0, 0.0],
+        "Vs": [0.0, 0.0, 1.0, 1.0],
+        "uvCounts": [4],
+        "uvIds": [0, 1, 2, 3],
+        "colors": array.array('f', color * 4)
+    }
+
+
+class GetMeshContentHashTest(unittest.TestCase):
+    def test_identical_meshes_share_a_key(self):
+        materials = [("mat", "mat.tga")]
+        self.assertEqual(SourceMayaTools.GetMeshContentHash(MakeQuadData([1, 0, 0, 1]), materials), SourceMayaTools.GetMeshContentHash(MakeQuadData([1, 0, 0, 1]), materials))
+
+    def test_meshes_differing_only_in_color_get_different_keys(self):
+        materials = [("mat", "mat.tga")]
+        self.assertNotEqual(SourceMayaTools.GetMeshContentHash(MakeQuadData([1, 0, 0, 1]), materials), SourceMayaTools.GetMeshContentHash(MakeQuadData([0, 0, 1, 1]), materials))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# Checks splitting models with too many joints into parts with a joint budget
+import unittest
+
+import helpers
+from helpers import SourceMayaTools
+
+
+def GetPartJoints(buffers, nodes):
+    # Returns the joints a part's triangles are weighted to, with their parents and the first joint
+    joints = set([0])
+    for buffer in buffers:
+        for vert in buffer["triVerts"]:
+            for joint in buffer["weightJoints"][buffer["weightOffsets"][vert]:buffer["weightOffsets"][vert+1]]:
+                while joint >= 0 and not joint in joints:
+                    joints.add(joint)
+                    joint = nodes[joint][1]
+    return joints
+
+
+class PartitionMeshBuffersTest(unittest.TestCase):
+    def setUp(self):
+        # Each column of the grid is weighted to its own joint, all of them children of the first one
+        self.buffer = helpers.MakeGridBuffer(8, jointForVertex=lambda x, y: x)
+        self.nodes = [("joint%i" % j, j > 0 and 0 or -1) for j in range(8)]
+
+    def test_every_triangle_goes_to_one_part_within_the_budget(self):
+        parts, oversized, sharedVerts = SourceMayaTools.PartitionMeshBuffers([self.buffer], 4, self.nodes)
+        self.assertTrue(len(parts) > 1)
+        self.assertEqual(oversized, 0)
+        self.assertTrue(sharedVerts > 0)
+
+        triangles = []
+        for buffers in parts:
+            self.assertTrue(len(GetPartJoints(buffers, self.nodes)) <= 4)
+            for buffer in buffers:
+                triangles.extend(helpers.GetTriangles(buffer))
+        self.assertEqual(sorted(triangles), sorted(helpers.GetTriangles(self.buffer)))
+
+    def test_parents_count_towards_the_budget(self):
+        chain = [("joint%i" % j, j - 1) for j in range(8)] # Every joint is the child of the previous one
+        parts, oversized, sharedVerts = SourceMayaTools.PartitionMeshBuffers([self.buffer], 4, chain)
+        # Only the cells of the first 3 columns (joints 0 to 3) fit in 4 joints once the parents are added
+        self.assertEqual(oversized, len(self.buffer["triMaterials"]) - 3 * 7 * 2)
+
+        parts, oversized, sharedVerts = SourceMayaTools.PartitionMeshBuffers([self.buffer], 4)
+        self.assertEqual(oversized, 0)
+
+    def test_pruned_parts_only_keep_their_joints(self):
+        parts, oversized, sharedVerts = SourceMayaTools.PartitionMeshBuffers([self.buffer], 4, self.nodes)
+        skeleton = [("sample", j) for j in range(len(self.nodes))]
+        for buffers in parts:
+            names = set([self.nodes[j][0] for j in GetPartJoints(buffers, self.nodes)])
+            part = {"nodes": self.nodes, "skeleton": skeleton, "buffers": buffers}
+            SourceMayaTools.PruneModelJoints(part)
+            self.assertEqual(set([name for name, parent in part["nodes"]]), names)
+            self.assertEqual(len(part["skeleton"]), len(names))
+            for buffer in part["buffers"]:
+                self.assertTrue(max([buffer["weightJoints"][buffer["weightOffsets"][vert]] for vert in buffer["triVerts"]]) < len(names))
+
+
+if __name__ == "__main__":
+    unittest.main()
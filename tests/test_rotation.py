@@ -0,0 +1,110 @@
+# Checks the batch rotation functions against the scalar math they replaced, outside of Maya
+import math
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SourceMayaTools
+
+
+def ScalarMatrixToQuat(maya_matrix):
+    # The per-joint conversion the batch functions replaced (__math_matrixtoquat__), returning a tuple instead of an MQuaternion
+    quat_x, quat_y, quat_z, quat_w = (0, 0, 0, 1)
+
+    trans_remain = maya_matrix[0] + maya_matrix[5] + maya_matrix[10]
+    if trans_remain > 0:
+        divisor = math.sqrt(trans_remain + 1.0) * 2.0
+        quat_w = 0.25 * divisor
+        quat_x = (maya_matrix[6] - maya_matrix[9]) / divisor
+        quat_y = (maya_matrix[8] - maya_matrix[2]) / divisor
+        quat_z = (maya_matrix[1] - maya_matrix[4]) / divisor
+    elif (maya_matrix[0] > maya_matrix[5]) and (maya_matrix[0] > maya_matrix[10]):
+        divisor = math.sqrt(1.0 + maya_matrix[0] - maya_matrix[5] - maya_matrix[10]) * 2.0
+        quat_w = (maya_matrix[6] - maya_matrix[9]) / divisor
+        quat_x = 0.25 * divisor
+        quat_y = (maya_matrix[4] + maya_matrix[1]) / divisor
+        quat_z = (maya_matrix[8] + maya_matrix[2]) / divisor
+    elif maya_matrix[5] > maya_matrix[10]:
+        divisor = math.sqrt(1.0 + maya_matrix[5] - maya_matrix[0] - maya_matrix[10]) * 2.0
+        quat_w = (maya_matrix[8] - maya_matrix[2]) / divisor
+        quat_x = (maya_matrix[4] + maya_matrix[1]) / divisor
+        quat_y = 0.25 * divisor
+        quat_z = (maya_matrix[9] + maya_matrix[6]) / divisor
+    else:
+        divisor = math.sqrt(1.0 + maya_matrix[10] - maya_matrix[0] - maya_matrix[5]) * 2.0
+        quat_w = (maya_matrix[1] - maya_matrix[4]) / divisor
+        quat_x = (maya_matrix[8] + maya_matrix[2]) / divisor
+        quat_y = (maya_matrix[9] + maya_matrix[6]) / divisor
+        quat_z = 0.25 * divisor
+
+    return (quat_x, quat_y, quat_z, quat_w)
+
+def EulerToMatrix(rx, ry, rz):
+    # Maya's 4x4 row-major matrix (row vectors) for an XYZ rotation order
+    def Multiply(a, b):
+        return [[sum([a[i][k] * b[k][j] for k in range(3)]) for j in range(3)] for i in range(3)]
+    c, s = math.cos(rx), math.sin(rx)
+    x = [[1, 0, 0], [0, c, s], [0, -s, c]]
+    c, s = math.cos(ry), math.sin(ry)
+    y = [[c, 0, -s], [0, 1, 0], [s, 0, c]]
+    c, s = math.cos(rz), math.sin(rz)
+    z = [[c, s, 0], [-s, c, 0], [0, 0, 1]]
+    r = Multiply(Multiply(x, y), z)
+    return r[0] + [0.0] + r[1] + [0.0] + r[2] + [0.0] + [0.0, 0.0, 0.0, 1.0]
+
+def RandomEulers(count):
+    # Angles inside the range an XYZ decomposition returns, so round trips give back the same angles
+    rng = random.Random(5)
+    return [(rng.uniform(-3.1, 3.1), rng.uniform(-1.5, 1.5), rng.uniform(-3.1, 3.1)) for i in range(count)]
+
+def QuatDistance(p, q):
+    # Largest component difference, ignoring the sign flip between equivalent quaternions
+    return min(max([abs(a - b) for a, b in zip(p, q)]), max([abs(a + b) for a, b in zip(p, q)]))
+
+
+class BatchRotationTest(unittest.TestCase):
+    def setUp(self):
+        self.eulers = RandomEulers(2000)
+        self.matrices = [EulerToMatrix(*euler) for euler in self.eulers]
+        # Cover every branch of the conversion: identity and half turns around each axis
+        self.matrices += [EulerToMatrix(0, 0, 0), EulerToMatrix(math.pi, 0, 0), EulerToMatrix(0, math.pi, 0), EulerToMatrix(0, 0, math.pi)]
+
+    def test_matrices_to_quats_matches_scalar(self):
+        quats = SourceMayaTools.BatchMatricesToQuats(self.matrices)
+        self.assertEqual(len(quats), len(self.matrices))
+        for matrix, quat in zip(self.matrices, quats):
+            self.assertLess(QuatDistance(quat, ScalarMatrixToQuat(matrix)), 1e-6)
+
+    def test_quats_to_eulers_round_trip(self):
+        eulers = SourceMayaTools.BatchQuatsToEulers(SourceMayaTools.BatchMatricesToQuats(self.matrices[:len(self.eulers)]))
+        for expected, euler in zip(self.eulers, eulers):
+            for a, b in zip(expected, euler):
+                self.assertLess(abs(a - b), 1e-6)
+
+    def test_gimbal_lock_keeps_the_rotation(self):
+        for euler in [(0.3, math.pi / 2, 0.2), (-1.0, -math.pi / 2, 0.5)]:
+            matrix = EulerToMatrix(*euler)
+            result = SourceMayaTools.BatchQuatsToEulers(SourceMayaTools.BatchMatricesToQuats([matrix]))[0]
+            rebuilt = EulerToMatrix(*result)
+            for a, b in zip(matrix, rebuilt):
+                self.assertLess(abs(a - b), 1e-6)
+
+    def test_multiply_by_inverse_is_identity(self):
+        quats = SourceMayaTools.BatchMatricesToQuats(self.matrices)
+        for quat in SourceMayaTools.BatchQuatMultiply(SourceMayaTools.BatchQuatInverse(quats), quats):
+            self.assertLess(QuatDistance(quat, (0.0, 0.0, 0.0, 1.0)), 1e-6)
+
+    def test_sample_rotations_splits_frames(self):
+        samples = [[((0, 0, 0), [1, 1, 1], self.matrices[frame * 3 + joint]) for joint in range(3)] for frame in range(4)]
+        rotations = SourceMayaTools.GetSampleRotations(samples)
+        self.assertEqual([len(frame) for frame in rotations], [3, 3, 3, 3])
+        for frame in range(4):
+            for joint in range(3):
+                for a, b in zip(rotations[frame][joint], self.eulers[frame * 3 + joint]):
+                    self.assertLess(abs(a - b), 1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
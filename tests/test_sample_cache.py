@@ -0,0 +1,75 @@
+# Checks the sample cache file format: memory mapped reads by offset, appending frames, and rejecting unusable files
+import os
+import shutil
+import tempfile
+import unittest
+
+import helpers
+from helpers import SourceMayaTools
+
+
+def MakeSamples(frames, numJoints):
+    # Returns {frame: joint samples} with values unique to each frame and joint
+    samples = {}
+    for frame in frames:
+        frameSamples = []
+        for j in range(numJoints):
+            base = frame * 100.0 + j
+            frameSamples.append(((base, base + 0.25, base + 0.5), [1.0, 1.0, 1.0], [base + k for k in range(16)]))
+        samples[frame] = frameSamples
+    return samples
+
+
+class SampleCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.folder, "test.smc")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_frames_are_read_by_offset(self):
+        samples = MakeSamples([5, 1, 3], 4)
+        SourceMayaTools.WriteSampleCache(self.filePath, 4, samples)
+        cache = SourceMayaTools.OpenSampleCache(self.filePath, 4)
+        try:
+            self.assertEqual(sorted(cache["frames"]), [1, 3, 5])
+            self.assertEqual(SourceMayaTools.ReadSampleCacheFrames(cache, [3, 5]), [samples[3], samples[5]])
+        finally:
+            SourceMayaTools.CloseSampleCache(cache)
+
+    def test_new_frames_are_appended_to_an_open_file(self):
+        samples = MakeSamples(range(10), 3)
+        SourceMayaTools.WriteSampleCache(self.filePath, 3, dict([(frame, samples[frame]) for frame in range(0, 10, 2)]))
+        cache = SourceMayaTools.OpenSampleCache(self.filePath, 3)
+        SourceMayaTools.WriteSampleCache(self.filePath, 3, dict([(frame, samples[frame]) for frame in range(1, 10, 2)]), cache)
+
+        cache = SourceMayaTools.OpenSampleCache(self.filePath, 3)
+        try:
+            self.assertEqual(sorted(cache["frames"]), range(10))
+            self.assertEqual(SourceMayaTools.ReadSampleCacheFrames(cache, range(10)), [samples[frame] for frame in range(10)])
+        finally:
+            SourceMayaTools.CloseSampleCache(cache)
+
+    def test_unusable_files_are_ignored(self):
+        self.assertEqual(SourceMayaTools.OpenSampleCache(self.filePath, 2), None)
+        open(self.filePath, 'wb').close()
+        self.assertEqual(SourceMayaTools.OpenSampleCache(self.filePath, 2), None)
+
+        SourceMayaTools.WriteSampleCache(self.filePath, 2, MakeSamples([1, 2], 2))
+        self.assertEqual(SourceMayaTools.OpenSampleCache(self.filePath, 3), None) # Different joint count
+        f = open(self.filePath, 'r+b')
+        f.truncate(os.path.getsize(self.filePath) - 8)
+        f.close()
+        self.assertEqual(SourceMayaTools.OpenSampleCache(self.filePath, 2), None) # Truncated
+
+    def test_spread_frames_include_both_ends(self):
+        self.assertEqual(SourceMayaTools.GetSpreadFrames([1, 2, 3], 8), [1, 2, 3])
+        frames = SourceMayaTools.GetSpreadFrames(range(100), 8)
+        self.assertEqual(len(frames), 8)
+        self.assertEqual((frames[0], frames[-1]), (0, 99))
+        self.assertEqual(frames, sorted(set(frames)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# Checks splitting an animation between shard processes, using stand-in workers instead of mayapy
+import json
+import os
+import unittest
+
+import helpers
+from helpers import SourceMayaTools
+
+
+class StandInPath(object):
+    def __init__(self, name):
+        self.name = name
+
+    def fullPathName(self):
+        return self.name
+
+
+class FinishedProcess(object):
+    def __init__(self, result):
+        self.result = result
+        self.killed = False
+
+    def wait(self):
+        return self.result
+
+    def kill(self):
+        self.killed = True
+
+
+def GetStandInSample(frame, joint):
+    return ((frame, joint, 0.0), [1.0, 1.0, 1.0], [float(frame * 16 + k) for k in range(16)])
+
+
+def LaunchStandInShard(shard):
+    # Does what a shard process does, writing synthetic samples for the job's joints and frames
+    f = open(shard["job"], 'r')
+    job = json.load(f)
+    f.close()
+    numJoints = len(job["joints"])
+    samples = dict([(frame, [GetStandInSample(frame, j) for j in range(numJoints)]) for frame in job["frames"]])
+    SourceMayaTools.WriteSampleCache(job["output"], numJoints, samples)
+    return FinishedProcess(0)
+
+
+class SampleShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.originalSettings = (SourceMayaTools.ANIM_SHARDS, SourceMayaTools.ANIM_SHARD_MIN_FRAMES)
+        SourceMayaTools.ANIM_SHARDS = 3
+        SourceMayaTools.ANIM_SHARD_MIN_FRAMES = 10
+        self.jointTable = [{"path": StandInPath("|root"), "parent": -1}, {"path": StandInPath("|root|arm"), "parent": 0}]
+        self.frames = range(5, 45)
+
+    def tearDown(self):
+        SourceMayaTools.ANIM_SHARDS, SourceMayaTools.ANIM_SHARD_MIN_FRAMES = self.originalSettings
+
+    def test_shards_are_merged_in_frame_order(self):
+        shards = SourceMayaTools.SampleJointsSharded(self.jointTable, self.frames, "scene.ma", LaunchStandInShard)
+        try:
+            self.assertEqual(len(shards), 3)
+            merged = list(SourceMayaTools.IterSampleShards(shards, 2))
+        finally:
+            SourceMayaTools.RemoveSampleShards(shards)
+        self.assertEqual(merged, [[GetStandInSample(frame, j) for j in range(2)] for frame in self.frames])
+        for shard in shards:
+            self.assertFalse(os.path.exists(shard["job"]) or os.path.exists(shard["output"]))
+
+    def test_failed_shard_falls_back_to_maya(self):
+        launcher = lambda shard: shard["index"] == 1 and FinishedProcess(1) or LaunchStandInShard(shard)
+        self.assertEqual(SourceMayaTools.SampleJointsSharded(self.jointTable, self.frames, "scene.ma", launcher), None)
+
+    def test_started_shards_are_killed_if_one_cannot_start(self):
+        started = []
+        def Launch(shard):
+            if shard["index"] == 2:
+                raise OSError("mayapy not found")
+            started.append(FinishedProcess(0))
+            return started[-1]
+        self.assertEqual(SourceMayaTools.SampleJointsSharded(self.jointTable, self.frames, "scene.ma", Launch), None)
+        self.assertEqual([process.killed for process in started], [True, True])
+
+    def test_unsaved_scene_is_not_sharded(self):
+        self.assertEqual(SourceMayaTools.SampleJointsSharded(self.jointTable, self.frames, None, LaunchStandInShard), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+# Checks the conversion of dense skin weights to CSR arrays
+import unittest
+
+from helpers import SourceMayaTools
+
+
+class GetSkinWeightsCSRTest(unittest.TestCase):
+    def setUp(self):
+        self.originals = (SourceMayaTools.MAX_VERTEX_INFLUENCES, SourceMayaTools.MIN_VERTEX_WEIGHT, SourceMayaTools.WarningsDuringExport)
+        SourceMayaTools.MIN_VERTEX_WEIGHT = 0.000001
+        SourceMayaTools.MAX_VERTEX_INFLUENCES = 0
+        # 3 vertices x 4 influences
+        self.weights = [0.1, 0.2, 0.3, 0.4,
+                        1.0, 0.0, 0.0, 0.0,
+                        0.0, 0.0000001, 0.5, 0.5]
+        self.influences = ["a", "b", "c", "d"]
+
+    def tearDown(self):
+        SourceMayaTools.MAX_VERTEX_INFLUENCES, SourceMayaTools.MIN_VERTEX_WEIGHT, SourceMayaTools.WarningsDuringExport = self.originals
+
+    def Convert(self, influenceToJoint=(0, 1, 2, 3)):
+        offsets, joints, values = SourceMayaTools.GetSkinWeightsCSR(self.weights, 3, 4, self.influences, list(influenceToJoint), "mesh")
+        return [[(joints[i], round(values[i], 9)) for i in range(offsets[v], offsets[v+1])] for v in range(len(offsets) - 1)]
+
+    def test_drops_tiny_weights(self):
+        self.assertEqual(self.Convert(), [[(0, 0.1), (1, 0.2), (2, 0.3), (3, 0.4)], [(0, 1.0)], [(2, 0.5), (3, 0.5)]])
+
+    def test_caps_and_renormalizes_keeping_influence_order(self):
+        SourceMayaTools.MAX_VERTEX_INFLUENCES = 2
+        self.assertEqual(self.Convert(), [[(2, round(0.3 / 0.7, 9)), (3, round(0.4 / 0.7, 9))], [(0, 1.0)], [(2, 0.5), (3, 0.5)]])
+
+    def test_remaps_influences_to_joints(self):
+        self.assertEqual(self.Convert((3, 2, 1, 0))[0], [(3, 0.1), (2, 0.2), (1, 0.3), (0, 0.4)])
+
+    def test_unexported_influences_are_dropped_and_the_rest_renormalized(self):
+        SourceMayaTools.MAX_WARNINGS_SHOWN, maxWarnings = 0, SourceMayaTools.MAX_WARNINGS_SHOWN
+        try:
+            converted = self.Convert((0, 1, None, 3))
+        finally:
+            SourceMayaTools.MAX_WARNINGS_SHOWN = maxWarnings
+        self.assertEqual(converted[0], [(0, round(0.1 / 0.7, 9)), (1, round(0.2 / 0.7, 9)), (3, round(0.4 / 0.7, 9))])
+        self.assertEqual(converted[2], [(3, 1.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# Checks the SMD serializer's block writing
+import unittest
+
+import helpers
+from helpers import SourceMayaTools
+
+
+class RecordingFile(object):
+    def __init__(self):
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+
+
+class WriteSMDTrianglesTest(unittest.TestCase):
+    def setUp(self):
+        self.originalBlockTriangles = SourceMayaTools.SMD_BLOCK_TRIANGLES
+        self.buffer = helpers.MakeGridBuffer(60, jointForVertex=lambda x, y: x % 3) # 6962 triangles of one material
+        self.materials = [("mat", "mat.tga")]
+
+    def tearDown(self):
+        SourceMayaTools.SMD_BLOCK_TRIANGLES = self.originalBlockTriangles
+
+    def Write(self, blockTriangles):
+        SourceMayaTools.SMD_BLOCK_TRIANGLES = blockTriangles
+        f = RecordingFile()
+        SourceMayaTools.WriteSMDTriangles(f, self.buffer, self.materials)
+        return f.writes
+
+    def test_long_material_runs_are_cut_into_blocks(self):
+        writes = self.Write(4096)
+        self.assertEqual([write.count("mat\n") for write in writes], [4096, len(self.buffer["triMaterials"]) - 4096])
+
+    def test_block_size_does_not_change_the_output(self):
+        self.assertEqual("".join(self.Write(100)), "".join(self.Write(1000000)))
+
+    def test_material_changes_start_new_blocks(self):
+        self.buffer["triMaterials"][10] = 1
+        self.materials.append(("other", "other.tga"))
+        writes = self.Write(4096)
+        self.assertEqual([write.count("\n") / 4 for write in writes], [10, 1, 4096, len(self.buffer["triMaterials"]) - 4096 - 11])
+
+
+class FinishSMDBlockTest(unittest.TestCase):
+    def setUp(self):
+        self.originalTrimTrailingZeros = SourceMayaTools.TRIM_TRAILING_ZEROS
+        SourceMayaTools.TRIM_TRAILING_ZEROS = True
+
+    def tearDown(self):
+        SourceMayaTools.TRIM_TRAILING_ZEROS = self.originalTrimTrailingZeros
+
+    def test_numbers_are_trimmed(self):
+        self.assertEqual(SourceMayaTools.FinishSMDBlock("0 1.000000 -0.500000 2.250000 10.000000\n"), "0 1 -0.5 2.25 10\n")
+
+    def test_material_names_ending_in_digits_are_kept(self):
+        text = "mat1.50\n0 1.000000 0.000000\n"
+        self.assertEqual(SourceMayaTools.FinishSMDBlock(text), "mat1.50\n0 1 0\n")
+
+    def test_trimming_is_optional(self):
+        SourceMayaTools.TRIM_TRAILING_ZEROS = False
+        self.assertEqual(SourceMayaTools.FinishSMDBlock("mat1.50\n0 1.000000\n"), "mat1.50\n0 1.000000\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
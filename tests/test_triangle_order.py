@@ -0,0 +1,57 @@
+# Checks the vertex cache (Tipsify) triangle reordering and material grouping
+import random
+import unittest
+
+import helpers
+from helpers import SourceMayaTools
+
+
+class VertexCacheOrderTest(unittest.TestCase):
+    def setUp(self):
+        # A grid whose triangles are shuffled, so it starts out with a poor vertex cache hit rate
+        grid = helpers.MakeGridBuffer(20)
+        triangles = range(len(grid["triMaterials"]))
+        random.Random(7).shuffle(triangles)
+        self.buffer = SourceMayaTools.SliceMeshBufferTriangles(grid, triangles)
+        self.indices = SourceMayaTools.WeldMeshBuffer(self.buffer, 6)["indices"]
+        self.numTris = len(self.buffer["triMaterials"])
+
+    def test_cache_miss_ratio(self):
+        indices = [0, 1, 2, 1, 3, 2, 4, 5, 6]
+        self.assertEqual(SourceMayaTools.GetCacheMissRatio(indices, [0], 16), 3.0)
+        self.assertEqual(SourceMayaTools.GetCacheMissRatio(indices, [0, 1], 16), 2.0)
+        self.assertEqual(SourceMayaTools.GetCacheMissRatio(indices, [0, 2, 1], 3), 3.0) # The third triangle pushed vertices 1 and 2 out
+        self.assertEqual(SourceMayaTools.GetCacheMissRatio(indices, [], 16), 0.0)
+
+    def test_order_is_a_permutation(self):
+        order = SourceMayaTools.GetVertexCacheOrder(self.indices, range(self.numTris), 16)
+        self.assertEqual(sorted(order), range(self.numTris))
+        self.assertEqual(SourceMayaTools.GetVertexCacheOrder(self.indices, [], 16), [])
+
+    def test_order_reduces_cache_misses(self):
+        before = SourceMayaTools.GetCacheMissRatio(self.indices, range(self.numTris), 16)
+        order = SourceMayaTools.GetVertexCacheOrder(self.indices, range(self.numTris), 16)
+        after = SourceMayaTools.GetCacheMissRatio(self.indices, order, 16)
+        self.assertTrue(before > 2.0)
+        self.assertTrue(after < 0.8) # A regular grid has 0.5 vertices per triangle, so this is within 60% of ideal
+
+    def test_optimized_buffer_groups_materials_and_keeps_its_weld(self):
+        for t in range(0, self.numTris, 3):
+            self.buffer["triMaterials"][t] = 1
+        optimized, before, after = SourceMayaTools.OptimizeMeshBufferTriangles(self.buffer, 16)
+        self.assertTrue(after < before)
+        self.assertEqual(helpers.GetTriangles(optimized), helpers.GetTriangles(self.buffer))
+
+        materials = list(optimized["triMaterials"])
+        self.assertEqual(materials, sorted(materials))
+        # The reordered weld keeps its vertex numbers, but must match welding the optimized buffer again
+        weld = SourceMayaTools.WeldMeshBuffer(optimized, SourceMayaTools.WELD_PRECISION)
+        renumber = dict(zip(optimized["weld"]["indices"], weld["indices"]))
+        self.assertEqual(len(set(renumber.values())), len(renumber))
+        self.assertEqual([renumber[v] for v in optimized["weld"]["indices"]], list(weld["indices"]))
+        for v, corner in enumerate(optimized["weld"]["vertices"]):
+            self.assertEqual(weld["vertices"][renumber[v]], corner)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+# Checks welding triangle corners into unique vertices
+import unittest
+
+import helpers
+from helpers import SourceMayaTools
+
+
+class WeldMeshBufferTest(unittest.TestCase):
+    def test_shared_corners_become_one_vertex(self):
+        buffer = helpers.MakeGridBuffer(3, jointForVertex=lambda x, y: 0)
+        weld = SourceMayaTools.WeldMeshBuffer(buffer, 6)
+        self.assertEqual(len(weld["vertices"]), 9)
+        self.assertEqual(len(weld["indices"]), len(buffer["triVerts"]))
+        self.assertEqual(weld["degenerate"], 0)
+        # Corners welded together come from the same buffer vertex, and each vertex points at its first corner
+        for corner, vertex in enumerate(weld["indices"]):
+            self.assertEqual(buffer["triVerts"][weld["vertices"][vertex]], buffer["triVerts"][corner])
+            self.assertTrue(weld["vertices"][vertex] <= corner)
+
+    def test_positions_are_compared_at_the_given_precision(self):
+        buffer = helpers.MakeGridBuffer(2)
+        buffer["positions"].extend((1.00001, 1.0, 0.0))
+        buffer["weightOffsets"].append(len(buffer["weightJoints"]))
+        helpers.AddTriangle(buffer, (0, 1, 4))
+        self.assertEqual(len(SourceMayaTools.WeldMeshBuffer(buffer, 6)["vertices"]), 5)
+        # At 4 decimals the extra vertex (and its planar UV) lands on the grid corner at (1, 1)
+        self.assertEqual(len(SourceMayaTools.WeldMeshBuffer(buffer, 4)["vertices"]), 4)
+
+    def test_different_normals_weights_or_colors_keep_corners_apart(self):
+        for key, offset in (("normals", 3), ("colors", 4)):
+            buffer = helpers.MakeGridBuffer(2)
+            buffer[key][offset] += 0.5 # Second corner of the first triangle
+            self.assertEqual(len(SourceMayaTools.WeldMeshBuffer(buffer, 6)["vertices"]), 5)
+
+        buffer = helpers.MakeGridBuffer(2, jointForVertex=lambda x, y: x)
+        self.assertEqual(len(SourceMayaTools.WeldMeshBuffer(buffer, 6)["vertices"]), 4)
+        buffer["positions"][3:6] = buffer["positions"][0:3] # Same position as vertex 0, but weighted to another joint
+        self.assertEqual(len(SourceMayaTools.WeldMeshBuffer(buffer, 6)["vertices"]), 4)
+
+    def test_triangles_collapsed_by_welding_are_counted(self):
+        buffer = helpers.MakeGridBuffer(2)
+        buffer["positions"][3:6] = buffer["positions"][0:3]
+        buffer["uvs"][2:4] = buffer["uvs"][0:2]
+        self.assertEqual(SourceMayaTools.WeldMeshBuffer(buffer, 6)["degenerate"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()